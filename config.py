@@ -1,9 +1,11 @@
 """ Configuration module for the flask app.
 
 Each class represents a configuration to use by the flask app
-created in hercules_sync/__init__.py.
+created in hercules_sync/__init__.py. The settings read from the
+environment variables are added by load_config_from_env.
 """
 
+import json
 import os
 
 from wbsync.util.error import InvalidConfigError
@@ -13,15 +15,82 @@ def _try_get_config_from_env(config_key):
         raise InvalidConfigError(f"{config_key} environment variable is not set.")
     return os.environ[config_key]
 
+def _to_bool(value):
+    return value.lower() in ('1', 'true', 'yes')
+
+def _get_config_from_env(config_key, default, cast=str):
+    if config_key not in os.environ:
+        return default
+    return cast(os.environ[config_key])
+
+def load_config_from_env():
+    """ Read the settings of the app from the environment variables.
+
+    The variables are read when the app is created instead of when this
+    module is imported, so changes to the environment made before calling
+    create_app are applied.
+
+    Returns
+    -------
+    dict
+        Settings of the app, using the default value of each optional
+        setting that is not set.
+    """
+    return {
+        'GITHUB_OAUTH': _try_get_config_from_env('GITHUB_OAUTH'),
+        'WBAPI': _try_get_config_from_env('WBAPI'),
+        'WBSPARQL': _try_get_config_from_env('WBSPARQL'),
+        'WBUSER': _try_get_config_from_env('WBUSER'),
+        'WBPASS': _try_get_config_from_env('WBPASS'),
+        'WEBHOOK_SECRET': _try_get_config_from_env('WEBHOOK_SECRET'),
+        'URIS_FACTORY': _try_get_config_from_env('URIS_FACTORY'),
+        'GITHUB_DOWNLOAD_WORKERS': _get_config_from_env('GITHUB_DOWNLOAD_WORKERS', 8, int),
+        'SYNC_RULES': _get_config_from_env('SYNC_RULES', [{"formats": ["ttl"]}], json.loads),
+        'BLOB_CACHE_DIR': _get_config_from_env('BLOB_CACHE_DIR', None),
+        'BLOB_CACHE_SIZE': _get_config_from_env('BLOB_CACHE_SIZE', 256 * 1024 * 1024, int),
+        'REBUILD_SOURCE_FROM_DIFF':
+            _get_config_from_env('REBUILD_SOURCE_FROM_DIFF', False, _to_bool),
+        'HTTP_POOL_SIZE': _get_config_from_env('HTTP_POOL_SIZE', 10, int),
+        'HTTP_TIMEOUT': _get_config_from_env('HTTP_TIMEOUT', 30.0, float),
+        'HTTP_CONNECT_TIMEOUT': _get_config_from_env('HTTP_CONNECT_TIMEOUT', 5.0, float),
+        'HTTP_RETRIES': _get_config_from_env('HTTP_RETRIES', 3, int),
+        'HTTP_BACKOFF': _get_config_from_env('HTTP_BACKOFF', 0.5, float),
+        'URIS_CACHE_SIZE': _get_config_from_env('URIS_CACHE_SIZE', 10000, int),
+        'URIS_CACHE_TTL': _get_config_from_env('URIS_CACHE_TTL', 3600.0, float),
+        'URIS_CACHE_NEGATIVE_TTL': _get_config_from_env('URIS_CACHE_NEGATIVE_TTL', 60.0, float),
+        'URIS_STORE_PATH': _get_config_from_env('URIS_STORE_PATH', None),
+        'URIS_WRITE_BEHIND': _get_config_from_env('URIS_WRITE_BEHIND', False, _to_bool),
+        'URIS_WRITE_BATCH_SIZE': _get_config_from_env('URIS_WRITE_BATCH_SIZE', 50, int),
+        'URIS_WRITE_INTERVAL': _get_config_from_env('URIS_WRITE_INTERVAL', 0.5, float),
+        'URIS_WRITE_RETRIES': _get_config_from_env('URIS_WRITE_RETRIES', 3, int),
+        'URIS_PREFETCH_WORKERS': _get_config_from_env('URIS_PREFETCH_WORKERS', 8, int),
+        'PUSH_COALESCE_WINDOW': _get_config_from_env('PUSH_COALESCE_WINDOW', 0.0, float),
+        'SYNC_PROCESSES': _get_config_from_env('SYNC_PROCESSES', 0, int),
+        'SYNC_WARM_UP': _get_config_from_env('SYNC_WARM_UP', True, _to_bool),
+        'SYNC_ALGORITHM': _get_config_from_env('SYNC_ALGORITHM', 'graphdiff'),
+        'GRAPH_CACHE_SIZE': _get_config_from_env('GRAPH_CACHE_SIZE', 16, int),
+        'GRAPH_CACHE_DIR': _get_config_from_env('GRAPH_CACHE_DIR', None),
+        'SYNC_BATCH_EDITS': _get_config_from_env('SYNC_BATCH_EDITS', False, _to_bool),
+        'WB_SESSIONS': _get_config_from_env('WB_SESSIONS', 2, int),
+        'WB_SESSION_CHECK_INTERVAL': _get_config_from_env('WB_SESSION_CHECK_INTERVAL', 60.0, float),
+        'TRACE_EXPORT': _get_config_from_env('TRACE_EXPORT', 'log'),
+        'TRACE_FILE': _get_config_from_env('TRACE_FILE', 'traces.jsonl'),
+        'DELIVERY_CACHE_SIZE': _get_config_from_env('DELIVERY_CACHE_SIZE', 10000, int),
+        'DELIVERY_TTL': _get_config_from_env('DELIVERY_TTL', 3 * 24 * 3600.0, float),
+        'JOB_QUEUE_PATH': _get_config_from_env('JOB_QUEUE_PATH', 'jobs.db'),
+        'JOB_WORKERS': _get_config_from_env('JOB_WORKERS', 2, int),
+        'JOB_MAX_ATTEMPTS': _get_config_from_env('JOB_MAX_ATTEMPTS', 3, int),
+        'JOB_RETENTION': _get_config_from_env('JOB_RETENTION', 86400.0, float),
+        'JOB_RETRY_BACKOFF': _get_config_from_env('JOB_RETRY_BACKOFF', 30.0, float),
+        'JOB_LEASE_TIME': _get_config_from_env('JOB_LEASE_TIME', 300.0, float),
+        'GIT_BACKEND': _get_config_from_env('GIT_BACKEND', 'github'),
+        'GIT_MIRROR_DIR': _get_config_from_env('GIT_MIRROR_DIR', 'mirrors'),
+        'GIT_MIRROR_URL': _get_config_from_env('GIT_MIRROR_URL', 'https://github.com/{repo}.git')
+    }
+
 class BaseConfig():
     DEBUG = False
     TESTING = False
-    GITHUB_OAUTH = _try_get_config_from_env('GITHUB_OAUTH')
-    WBAPI = _try_get_config_from_env('WBAPI')
-    WBSPARQL = _try_get_config_from_env('WBSPARQL')
-    WBUSER = _try_get_config_from_env('WBUSER')
-    WBPASS = _try_get_config_from_env('WBPASS')
-    WEBHOOK_SECRET = _try_get_config_from_env('WEBHOOK_SECRET')
 
 class DevelopmentConfig(BaseConfig):
     DEBUG = True
@@ -5,6 +5,7 @@ import os
 
 from flask import Flask
 
+from config import load_config_from_env
 
 CONFIG = {
     "base": "config.BaseConfig",
@@ -18,7 +19,8 @@ def create_app():
 
     By default config.BaseConfig is used. In order to change this config
     the FLASK_CONFIG environment variable must be changed to match one of
-    the keys in the CONFIG dict.
+    the keys in the CONFIG dict. The rest of the settings are read from the
+    environment variables when the app is created.
 
     Returns
     -------
@@ -27,6 +29,7 @@ def create_app():
     app = Flask(__name__, instance_relative_config=True)
     config_name = os.getenv('FLASK_CONFIG', 'base')
     app.config.from_object(CONFIG[config_name])
+    app.config.from_mapping(load_config_from_env())
     with app.app_context():
         from .listener import WEBHOOK
     return app
@@ -0,0 +1,269 @@
+""" Cache module
+
+Caches used to avoid repeating expensive requests during the synchronization.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+LOGGER = logging.getLogger(__name__)
+
+FULL_SHA_LENGTH = 40
+
+def git_blob_sha(content):
+    """ Compute the sha that git assigns to a blob with the given content.
+
+    Parameters
+    ----------
+    content : bytes
+        Raw content of the blob.
+
+    Returns
+    -------
+    str
+        Hexadecimal sha1 of the blob.
+    """
+    header = f"blob {len(content)}\0".encode('utf-8')
+    return hashlib.sha1(header + content).hexdigest()
+
+
+class BlobCache():
+    """ Content-addressed on-disk cache of git blobs.
+
+    Each blob is stored in its own file, named after the full sha of the blob.
+    Blobs can be retrieved with the abbreviated shas used by git diffs. When the
+    total size of the cache goes over the limit the least recently used blobs
+    are evicted.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory where the blobs will be stored.
+    max_size : int
+        Maximum size in bytes of all the blobs stored in the cache.
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_entries()
+
+    @property
+    def size(self):
+        """ Total size in bytes of the blobs stored in the cache.
+        """
+        return self._size
+
+    def get(self, sha):
+        """ Return the content of a blob from the cache.
+
+        Parameters
+        ----------
+        sha : str
+            Full or abbreviated sha of the blob.
+
+        Returns
+        -------
+        str
+            Content of the blob or None if it is not stored in the cache.
+        """
+        with self._lock:
+            full_sha = self._find(sha)
+            if full_sha is None:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path_of(full_sha), 'rb') as blob_file:
+                    content = blob_file.read()
+                os.utime(self._path_of(full_sha))
+            except OSError:
+                LOGGER.warning("Blob %s could not be read from the cache.", full_sha)
+                self._remove(full_sha)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(full_sha)
+            self.hits += 1
+        return content.decode('utf-8')
+
+    def put(self, sha, content):
+        """ Store the content of a blob in the cache.
+
+        The content is only stored when its git sha matches the given one, so
+        contents that were modified by the server are never cached.
+
+        Parameters
+        ----------
+        sha : str
+            Full or abbreviated sha of the blob.
+        content : str
+            Content of the blob.
+
+        Returns
+        -------
+        bool
+            True if the blob was stored in the cache.
+        """
+        raw_content = content.encode('utf-8')
+        full_sha = git_blob_sha(raw_content)
+        if not full_sha.startswith(sha) or len(raw_content) > self.max_size:
+            return False
+
+        with self._lock:
+            if full_sha in self._entries:
+                self._entries.move_to_end(full_sha)
+                return True
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(raw_content)
+            os.replace(tmp_path, self._path_of(full_sha))
+            self._entries[full_sha] = len(raw_content)
+            self._size += len(raw_content)
+            self._evict()
+        return True
+
+    def _evict(self):
+        while self._size > self.max_size:
+            oldest_sha = next(iter(self._entries))
+            self._remove(oldest_sha)
+
+    def _find(self, sha):
+        if len(sha) == FULL_SHA_LENGTH:
+            return sha if sha in self._entries else None
+        candidates = [full_sha for full_sha in self._entries if full_sha.startswith(sha)]
+        return candidates[0] if len(candidates) == 1 else None
+
+    def _load_entries(self):
+        blobs = []
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            if len(filename) != FULL_SHA_LENGTH:
+                if filename.endswith('.tmp'):
+                    os.remove(path)
+                continue
+            stat = os.stat(path)
+            blobs.append((stat.st_mtime, filename, stat.st_size))
+
+        for _, full_sha, size in sorted(blobs):
+            self._entries[full_sha] = size
+            self._size += size
+        self._evict()
+
+    def _path_of(self, full_sha):
+        return os.path.join(self.cache_dir, full_sha)
+
+    def _remove(self, full_sha):
+        self._size -= self._entries.pop(full_sha)
+        try:
+            os.remove(self._path_of(full_sha))
+        except FileNotFoundError:
+            pass
+
+
+class TTLCache():
+    """ Thread-safe in-memory cache with a bounded size and time-based expiration.
+
+    When the cache is full the least recently used entry is evicted. Entries
+    can be stored with a custom time to live, which allows keeping negative
+    results (e.g. None values) for a shorter time than the rest.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of entries stored in the cache.
+    ttl : float
+        Default time to live in seconds of each entry.
+    clock : callable
+        Function that returns the current time in seconds.
+    """
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Return the value stored for the given key.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the entry.
+        default : any
+            Value returned when the key is not in the cache or it has expired.
+
+        Returns
+        -------
+        any
+            Value of the entry or the default value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """ Store a value in the cache.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the entry.
+        value : any
+            Value to store.
+        ttl : float
+            Time to live in seconds of this entry. If it is not given the
+            default ttl of the cache is used.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (value, self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """ Remove an entry from the cache, returning its value.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        """ Remove every entry of the cache and reset its counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """ Return the number of hits, misses and entries of the cache.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
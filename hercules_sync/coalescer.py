@@ -0,0 +1,61 @@
+""" Push coalescer module
+
+Pushes received for the same repository and ref within a short window are
+merged into a single push, so only the net change between the first and the
+last commit is synchronized. The pending pushes are kept in the job queue,
+which merges them using the functions of this module.
+"""
+
+def push_key(data):
+    """ Return the key shared by the pushes that can be merged with the given one.
+
+    Parameters
+    ----------
+    data : dict
+        Payload of the push event.
+
+    Returns
+    -------
+    str
+        Key made of the full name of the repository and the ref of the push.
+    """
+    return f"{data['repository']['full_name']}:{data.get('ref')}"
+
+def push_range(data):
+    """ Return the key that identifies the commits synchronized by a push.
+
+    Parameters
+    ----------
+    data : dict
+        Payload of the push event.
+
+    Returns
+    -------
+    tuple of str
+        Full name of the repository and the 'before' and 'after' commits.
+    """
+    return (data['repository']['full_name'], data['before'], data['after'])
+
+def merge_pushes(first, last):
+    """ Merge two consecutive pushes to the same repository and ref.
+
+    Parameters
+    ----------
+    first : dict
+        Payload of the earliest push.
+    last : dict
+        Payload of the latest push.
+
+    Returns
+    -------
+    dict
+        Payload going from the 'before' commit of the first push to the
+        'after' commit of the last one. It is marked as forced if any of the
+        pushes was forced or if they are not consecutive.
+    """
+    merged = dict(last)
+    merged['before'] = first['before']
+    merged['commits'] = list(first.get('commits', [])) + list(last.get('commits', []))
+    merged['forced'] = first.get('forced', False) or last.get('forced', False) or \
+        first['after'] != last['before']
+    return merged
@@ -1,10 +1,20 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
 
 import base64
 import json
-import urllib3
+import logging
+import re
 
 from unidiff import PatchSet
+from unidiff.constants import LINE_TYPE_NO_NEWLINE
+
+from .cache import git_blob_sha
+from .http_client import get_http_client
+from .metrics import DIFF_FETCH_SECONDS, DIFF_SIZE_BYTES, FILE_DOWNLOAD_SECONDS
+from .tracing import bind_span, span
 
 
 GITHUB_BASE_URL = 'https://github.com'
@@ -12,6 +22,14 @@ GITHUB_API_URL = 'https://api.github.com'
 
 USER_AGENT = 'weso'
 
+DIFF_CHUNK_SIZE = 64 * 1024
+DIFF_HEADER = 'diff --git '
+
+INDEX_LINE_RE = re.compile(r'^index ([0-9a-f]+)\.\.([0-9a-f]+)')
+NULL_SHA_RE = re.compile(r'^0+$')
+
+LOGGER = logging.getLogger(__name__)
+
 class GitPushEventHandler():
     """ Processes information from a GitHub push event.
 
@@ -19,20 +37,39 @@ class GitPushEventHandler():
     ----------
     data : dict
         Data obtained from a GitHub WebHook regarding a push event.
+    oauth : str
+        GitHub token used to download the contents of the files.
+    download_workers : int
+        Maximum number of concurrent downloads performed when loading the files.
+    path_filter : callable
+        Optional function that receives the path of each file in the diff and
+        returns False for the files that must not be downloaded.
+    blob_cache : :obj:`BlobCache`
+        Optional cache used to avoid downloading blobs that were already loaded.
+    backend : object
+        Source backend used to obtain the diff and the contents of the files,
+        such as :obj:`GitHubBackend` or :obj:`hercules_sync.mirror.GitMirrorBackend`.
+        When it is not given, a GitHubBackend is created with the previous
+        parameters.
     """
 
-    def __init__(self, data, oauth=''):
+    def __init__(self, data, oauth='', download_workers=1, path_filter=None,
+                 blob_cache=None, backend=None):
+        if backend is None:
+            backend = GitHubBackend(oauth, download_workers, blob_cache)
+        self.path_filter = path_filter
         self.before_commit = data['before']
         self.after_commit = data['after']
         self.repo_name = data['repository']['full_name']
-        self.diff_parser = GitDiffParser(self.repo_name,
-                                         self.before_commit,
-                                         self.after_commit)
-        self.diff_parser.load_diff()
-        self.data_loader = GitDataLoader(self.repo_name,
-                                         self.before_commit,
-                                         self.after_commit,
-                                         oauth)
+        self.diff_parser = backend.create_diff_parser(self.repo_name,
+                                                      self.before_commit,
+                                                      self.after_commit)
+        with span('GitDiffParser.load_diff', repository=self.repo_name):
+            self.diff_parser.load_diff(path_filter)
+        self.data_loader = backend.create_data_loader(self.repo_name,
+                                                      self.before_commit,
+                                                      self.after_commit,
+                                                      not data.get('forced', False))
 
     @property
     def added_files(self):
@@ -74,12 +111,111 @@ class GitPushEventHandler():
         return self._git_loader_iterator(removed_files)
 
     def _git_loader_iterator(self, patched_files):
+        if self.path_filter is not None:
+            patched_files = [patched_file for patched_file in patched_files
+                             if self.path_filter(patched_file.path)]
         for gitfile in self.data_loader.load_files(patched_files):
             yield gitfile
 
+class GitHubBackend():
+    """ Source backend that obtains the diff and files through the GitHub API.
+
+    Parameters
+    ----------
+    oauth : str
+        GitHub token used to download the contents of the files.
+    download_workers : int
+        Maximum number of concurrent downloads performed when loading the files.
+    blob_cache : :obj:`BlobCache`
+        Optional cache used to avoid downloading blobs that were already loaded.
+    rebuild_source : bool
+        Whether the source version of the modified files is rebuilt from the
+        diff instead of downloading it.
+    """
+
+    def __init__(self, oauth='', download_workers=1, blob_cache=None, rebuild_source=False):
+        self.oauth = oauth
+        self.download_workers = download_workers
+        self.blob_cache = blob_cache
+        self.rebuild_source = rebuild_source
+
+    def create_diff_parser(self, repo_name, before_commit, after_commit):
+        """ Return the parser used to load the diff of a push.
+
+        Returns
+        -------
+        :obj:`GitDiffParser`
+            Parser of the compare diff between both commits.
+        """
+        return GitDiffParser(repo_name, before_commit, after_commit)
+
+    def create_data_loader(self, repo_name, before_commit, after_commit, linear_history=True):
+        """ Return the loader used to obtain the contents of the files of a push.
+
+        Returns
+        -------
+        :obj:`GitDataLoader`
+            Loader of the files before and after the push.
+        """
+        return GitDataLoader(repo_name, before_commit, after_commit, self.oauth,
+                             self.download_workers, self.blob_cache, linear_history,
+                             self.rebuild_source)
+
+class DiffLines():
+    """ Compact index with the numbers and contents of the lines changed in a file.
+
+    The line numbers are kept in an unsigned int array and the contents of
+    every line are joined in a single string, with an array of offsets to
+    the start of each line.
+
+    Parameters
+    ----------
+    lines : iterable of (str, int)
+        Content and number of each line, sorted by line number.
+    """
+
+    __slots__ = ('numbers', 'offsets', 'text')
+
+    def __init__(self, lines=()):
+        self.numbers = array('I')
+        self.offsets = array('I', [0])
+        values = []
+        for value, line_no in lines:
+            values.append(value)
+            self.numbers.append(line_no)
+            self.offsets.append(self.offsets[-1] + len(value))
+        self.text = ''.join(values)
+
+    def value(self, index):
+        """ Return the content of the line at the given position of the index.
+        """
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+
+    def in_range(self, first, last):
+        """ Return the lines whose number is between first and last, both included.
+
+        Returns
+        -------
+        list of (str, int)
+            List of tuples with the content and number of each line.
+        """
+        start = bisect_left(self.numbers, first)
+        end = bisect_right(self.numbers, last)
+        return [(self.value(i), self.numbers[i]) for i in range(start, end)]
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        for i, line_no in enumerate(self.numbers):
+            yield self.value(i), line_no
+
+
 class GitFile():
     """ Encapsulates the content of a file and the git diff information.
 
+    The added and removed lines are indexed the first time they are needed.
+
     Parameters
     ----------
     patched_file : :obj:`unidiff.PatchFile`
@@ -90,10 +226,14 @@ class GitFile():
         Final content of the file after the push (target).
     """
 
+    __slots__ = ('_patched_file', 'source_content', 'target_content', '_added', '_removed')
+
     def __init__(self, patched_file, source_content, target_content):
         self._patched_file = patched_file
         self.source_content = source_content
         self.target_content = target_content
+        self._added = None
+        self._removed = None
 
     @property
     def path(self):
@@ -109,9 +249,7 @@ class GitFile():
             List of tuples where each tuple contains the content of the added
             line and the number of the line in the target file.
         """
-        return [(line.value, line.target_line_no)
-                for hunk in self._patched_file
-                for line in hunk if line.is_added]
+        return list(self._get_added())
 
     @property
     def removed_lines(self):
@@ -123,14 +261,41 @@ class GitFile():
             List of tuples where each tuple contains the content of the removed
             line and the number of the line in the source file.
         """
-        return [(line.value, line.source_line_no)
-                for hunk in self._patched_file
-                for line in hunk if line.is_removed]
+        return list(self._get_removed())
+
+    def added_lines_between(self, first, last):
+        """ Return the added lines with a target line number between first and last.
+
+        Returns
+        -------
+        list of (str, int)
+            Same tuples as :attr:`added_lines`, limited to the given range.
+        """
+        return self._get_added().in_range(first, last)
+
+    def removed_lines_between(self, first, last):
+        """ Return the removed lines with a source line number between first and last.
 
-    def _get_lines(self, line_filter):
-        return [(line.value, line.target_line_no)
-                for hunk in self._patched_file
-                for line in hunk if line_filter(line)]
+        Returns
+        -------
+        list of (str, int)
+            Same tuples as :attr:`removed_lines`, limited to the given range.
+        """
+        return self._get_removed().in_range(first, last)
+
+    def _get_added(self):
+        if self._added is None:
+            self._added = DiffLines((line.value, line.target_line_no)
+                                    for hunk in self._patched_file
+                                    for line in hunk if line.is_added)
+        return self._added
+
+    def _get_removed(self):
+        if self._removed is None:
+            self._removed = DiffLines((line.value, line.source_line_no)
+                                      for hunk in self._patched_file
+                                      for line in hunk if line.is_removed)
+        return self._removed
 
     def __str__(self):
         rval = [self.path]
@@ -165,33 +330,43 @@ class GitDiffParser():
                                                    after_commit)
         self.patch = None
 
-    def load_diff(self):
-        """
+    def load_diff(self, path_filter=None):
+        """ Download and parse the diff, which is stored in the patch attribute.
 
-        Returns
-        -------
-        :obj: `unidiff.PatchSet`
-            PatchSet instance with the diff information.
+        The diff is read in chunks while it is being parsed, so it is never
+        kept whole in memory.
+
+        Parameters
+        ----------
+        path_filter : callable
+            Optional function that receives the path of each file in the diff
+            and returns False for the files that must be skipped. The hunks of
+            the skipped files are not parsed.
         """
-        req = self._send_request()
-        if req.status == 404:
-            raise DiffNotFoundError()
+        with DIFF_FETCH_SECONDS.labels(backend='github').time():
+            req = self._send_request()
+            if req.status == 404:
+                raise DiffNotFoundError()
 
-        diff = req.data.decode("utf-8")
-        self.patch = PatchSet(diff)
+            chunks = _count_bytes(req.stream(DIFF_CHUNK_SIZE), DIFF_SIZE_BYTES.labels(backend='github'))
+            try:
+                self.patch = parse_diff_stream(iter_diff_lines(chunks), path_filter)
+            finally:
+                req.release_conn()
 
     def _build_compare_url(self, repo_name, before_commit, after_commit):
         return '{0}/{1}/compare/{2}...{3}.diff'.format(GITHUB_BASE_URL, repo_name,
                                                        before_commit, after_commit)
 
     def _send_request(self):
-        http = urllib3.PoolManager()
+        http = get_http_client()
         return http.request(
             'GET',
             self.compare_url,
             headers={
                 'User-Agent': USER_AGENT
-            }
+            },
+            preload_content=False
         )
 
 class GitDataLoader():
@@ -208,17 +383,39 @@ class GitDataLoader():
         Sha of the initial commit before the push.
     after_ref : str
         Sha of the final commit after the push.
+    oauth : str
+        GitHub token used to authenticate the requests.
+    max_workers : int
+        Maximum number of files downloaded concurrently. When it is set to 1
+        the files are downloaded sequentially.
+    blob_cache : :obj:`BlobCache`
+        Optional cache of blobs. When it is given, the blob shas of the diff
+        are used to load the contents from the cache before downloading them.
+    linear_history : bool
+        Whether before_ref is an ancestor of after_ref. Otherwise the source
+        blobs of the diff don't correspond to before_ref and they can't be
+        looked up in the cache nor rebuilt from the diff.
+    rebuild_source : bool
+        When it is True, only the target version of the modified files is
+        downloaded and the source version is rebuilt by reverse-applying the
+        hunks of the diff. Files are downloaded as usual when the diff is
+        binary, truncated or can't be applied.
     """
 
     NO_COMMIT_MSG = "No commit found for the ref"
     NOT_FOUND_MSG = "Not Found"
 
-    def __init__(self, repo_name, before_ref, after_ref, oauth=''):
+    def __init__(self, repo_name, before_ref, after_ref, oauth='', max_workers=1,
+                 blob_cache=None, linear_history=True, rebuild_source=False):
         self.repo_name = repo_name
         self.before_ref = before_ref
         self.after_ref = after_ref
         self.oauth = oauth
-        self.http = urllib3.PoolManager()
+        self.max_workers = max(1, max_workers)
+        self.blob_cache = blob_cache
+        self.linear_history = linear_history
+        self.rebuild_source = rebuild_source
+        self.http = get_http_client()
 
     def load_files(self, files_to_load):
         """ Downloads the given files, returning them inside GitFile objects.
@@ -232,17 +429,87 @@ class GitDataLoader():
         -------
         :obj:`GitFile`
             Generator that returns one instance of the GitFile class for each
-            downloaded file from GitHub.
+            downloaded file from GitHub. Files are always returned in the same
+            order as they were given, even when they are downloaded concurrently.
         """
-        return (GitFile(patched_file,
-                        self._load_file(patched_file.path, self.before_ref),
-                        self._load_file(patched_file.path, self.after_ref))
-                for patched_file in files_to_load)
+        if self.max_workers == 1:
+            return (self._create_git_file(patched_file,
+                                          self._load_source(patched_file),
+                                          self._load_target(patched_file))
+                    for patched_file in files_to_load)
+        return self._load_files_concurrently(files_to_load)
+
+    def _load_files_concurrently(self, files_to_load):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # each download is bound to the current span to keep its trace
+            pending = [(patched_file,
+                        executor.submit(bind_span(self._load_source), patched_file),
+                        executor.submit(bind_span(self._load_target), patched_file))
+                       for patched_file in files_to_load]
+            try:
+                for patched_file, source, target in pending:
+                    yield self._create_git_file(patched_file, source.result(), target.result())
+            finally:
+                # avoid downloading the remaining files if the consumer stops
+                # early or one of the downloads raised an error
+                for _, source, target in pending:
+                    source.cancel()
+                    target.cancel()
+
+    def _can_rebuild_source(self, patched_file, source_sha):
+        return self.rebuild_source and self.linear_history and source_sha is not None \
+            and patched_file.is_modified_file and len(patched_file) > 0
+
+    def _create_git_file(self, patched_file, source_content, target_content):
+        if source_content is None:
+            source_content = self._rebuild_source(patched_file, target_content)
+        return GitFile(patched_file, source_content, target_content)
+
+    def _load_source(self, patched_file):
+        source_sha, _ = _get_blob_shas(patched_file)
+        if not self.linear_history:
+            source_sha = None
+        if self._can_rebuild_source(patched_file, source_sha):
+            cached_content = self.blob_cache.get(source_sha) \
+                if self.blob_cache is not None else None
+            # when it is not cached, the source is rebuilt once the target is loaded
+            return cached_content
+        return self._load_blob(patched_file.path, self.before_ref, source_sha)
+
+    def _load_target(self, patched_file):
+        _, target_sha = _get_blob_shas(patched_file)
+        return self._load_blob(patched_file.path, self.after_ref, target_sha)
+
+    def _load_blob(self, file_path, ref, blob_sha):
+        use_cache = self.blob_cache is not None and blob_sha is not None
+        if use_cache:
+            content = self.blob_cache.get(blob_sha)
+            if content is not None:
+                return content
+
+        content = self._load_file(file_path, ref)
+        if use_cache and content:
+            self.blob_cache.put(blob_sha, content)
+        return content
+
+    def _rebuild_source(self, patched_file, target_content):
+        source_sha, _ = _get_blob_shas(patched_file)
+        try:
+            source_content = reverse_patch(patched_file, target_content)
+            if git_blob_sha(source_content.encode('utf-8')).startswith(source_sha):
+                return source_content
+        except PatchApplyError:
+            pass
+        LOGGER.info("Diff of %s could not be reversed. Downloading source content...",
+                    patched_file.path)
+        return self._load_file(patched_file.path, self.before_ref)
 
     def _load_file(self, file_path, ref):
         download_url = self._build_download_url(file_path, ref)
 
-        req = self._send_request(download_url)
+        with span('GitDataLoader._load_file', path=file_path, ref=ref), \
+                FILE_DOWNLOAD_SECONDS.labels(backend='github').time():
+            req = self._send_request(download_url)
         json_response = json.loads(req.data.decode('utf-8'))
 
         if 'message' in json_response:
@@ -272,8 +539,169 @@ class GitDataLoader():
             }
         )
 
+def iter_diff_lines(chunks):
+    """ Split a stream of chunks of a diff into lines.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        Consecutive chunks of the diff.
+
+    Yields
+    ------
+    str
+        Each line of the diff, including its line terminator.
+    """
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8') + '\n'
+    if pending:
+        yield pending.decode('utf-8')
+
+def parse_diff_stream(lines, path_filter=None):
+    """ Parse the lines of a diff, skipping the files that don't pass the filter.
+
+    The header of each file is read first, and the lines of its hunks are only
+    kept when the path of the file passes the filter.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        Lines of the diff, including their line terminators.
+    path_filter : callable
+        Optional function that receives the path of each file and returns
+        False for the files that must be skipped.
+
+    Returns
+    -------
+    :obj:`unidiff.PatchSet`
+        PatchSet with the files that passed the filter.
+    """
+    patch = PatchSet('')
+    section = []
+    decided = True
+    for line in lines:
+        if line.startswith(DIFF_HEADER):
+            _add_diff_section(patch, section, decided, path_filter)
+            section = [line]
+            decided = False
+            continue
+        if not section:
+            continue
+        if not decided and line.startswith('@@'):
+            decided = True
+            if path_filter is not None and not path_filter(_get_section_path(section)):
+                # the rest of the file is skipped until the next header
+                section = []
+                continue
+        section.append(line)
+    _add_diff_section(patch, section, decided, path_filter)
+    return patch
+
+def _add_diff_section(patch, section, decided, path_filter):
+    if not section:
+        return
+    if not decided and path_filter is not None and not path_filter(_get_section_path(section)):
+        return
+    patch.extend(PatchSet(''.join(section)))
+
+def _get_section_path(header):
+    source_path = target_path = None
+    for line in header:
+        line = line.rstrip('\n')
+        if line.startswith('+++ '):
+            target_path = line[4:]
+        elif line.startswith('--- '):
+            source_path = line[4:]
+        elif line.startswith('rename to '):
+            return line[len('rename to '):]
+    if target_path is not None and target_path != '/dev/null':
+        return target_path[2:] if target_path.startswith('b/') else target_path
+    if source_path is not None and source_path != '/dev/null':
+        return source_path[2:] if source_path.startswith('a/') else source_path
+    # headers without file lines, e.g. binary files: 'diff --git a/<path> b/<path>'
+    paths = header[0].rstrip('\n')[len(DIFF_HEADER):]
+    target = paths[(len(paths) + 1) // 2:]
+    return target[2:] if target.startswith('b/') else target
+
+def _count_bytes(chunks, histogram):
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    histogram.observe(size)
+
+def reverse_patch(patched_file, target_content):
+    """ Rebuild the source content of a file by reverse-applying its diff.
+
+    Parameters
+    ----------
+    patched_file : :obj:`unidiff.PatchedFile`
+        Diff of the file.
+    target_content : str
+        Content of the file after the diff was applied.
+
+    Returns
+    -------
+    str
+        Content of the file before the diff was applied.
+
+    Raises
+    ------
+    PatchApplyError
+        If the diff doesn't match the target content.
+    """
+    target_lines = target_content.splitlines(keepends=True)
+    source_lines = []
+    target_pos = 0
+    for hunk in patched_file:
+        hunk_start = hunk.target_start - 1 if hunk.target_length > 0 else hunk.target_start
+        if hunk_start < target_pos or hunk_start > len(target_lines):
+            raise PatchApplyError(f"Hunk {hunk.target_start} is out of the target content.")
+        source_lines.extend(target_lines[target_pos:hunk_start])
+        target_pos = hunk_start
+
+        for line, value in _hunk_line_values(hunk):
+            if line.is_added or line.is_context:
+                if target_pos >= len(target_lines) or target_lines[target_pos] != value:
+                    raise PatchApplyError(f"Line {target_pos + 1} doesn't match the diff.")
+                target_pos += 1
+            if line.is_removed or line.is_context:
+                source_lines.append(value)
+    source_lines.extend(target_lines[target_pos:])
+    return ''.join(source_lines)
+
+def _hunk_line_values(hunk):
+    """ Return each line of a hunk with its real value, without the newline
+    of the lines followed by a 'No newline at end of file' marker. """
+    lines = list(hunk)
+    for idx, line in enumerate(lines):
+        if line.line_type == LINE_TYPE_NO_NEWLINE:
+            continue
+        no_newline = idx + 1 < len(lines) and lines[idx + 1].line_type == LINE_TYPE_NO_NEWLINE
+        yield line, line.value[:-1] if no_newline and line.value.endswith('\n') else line.value
+
+def _get_blob_shas(patched_file):
+    """ Return the source and target blob shas from the index line of a file diff.
+
+    Null shas, used by git for files that don't exist on one side of the diff,
+    are returned as None.
+    """
+    for line in patched_file.patch_info:
+        match = INDEX_LINE_RE.match(line)
+        if match:
+            return tuple(None if NULL_SHA_RE.match(sha) else sha
+                         for sha in match.groups())
+    return None, None
+
 class DiffNotFoundError(Exception):
     """ Exception subclass used when a diff file cannot be found from the server """
 
+class PatchApplyError(Exception):
+    """ Exception subclass used when a diff can't be applied to the content of a file """
+
 class InvalidCommitError(Exception):
     """ Exception subclass that represents the use of an invalid commit when loading a file """
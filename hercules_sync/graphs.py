@@ -0,0 +1,267 @@
+""" Graphs module
+
+Parsing and comparison of the RDF graphs of each file, together with a cache
+of the last graph synchronized for each file of a repository. The content
+before a push is usually the content synchronized in the previous one, so its
+graph can be taken from the cache instead of being parsed again.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+import ontospy
+
+from ontospy.core.sparqlHelper import SparqlHelper
+from pandas.util import hash_array
+from rdflib.compare import graph_diff, to_canonical_graph, to_isomorphic
+from rdflib.graph import Graph
+from rdflib.term import BNode
+from wbsync.synchronization import GraphDiffSyncAlgorithm
+from wbsync.synchronization.ontology_synchronizer import _annotate_datatype_props, \
+    _annotate_object_props, _annotate_uris_etype, _extract_uris_from, _filter_invalid_ops
+
+from .cache import git_blob_sha
+
+LOGGER = logging.getLogger(__name__)
+
+RDF_FORMAT = 'turtle'
+# format of the graphs serialized by the cache, which starts with a comment with the blob sha
+CACHE_FORMAT = 'nt'
+DEFAULT_ALGORITHM = 'graphdiff'
+# subjects and predicates have no spaces in N3, so the terms can't be mixed up
+TERM_SEPARATOR = ' '
+
+def parse_graph(content):
+    """ Parse the content of a file into a rdflib graph.
+    """
+    return Graph().parse(format=RDF_FORMAT, data=content)
+
+def isomorphic_diff(source_graph, target_graph):
+    """ Return the triples removed and added between two graphs with rdflib graph_diff.
+
+    This is the diff of the GraphDiffSyncAlgorithm, which builds isomorphic
+    copies of both graphs to compare them.
+
+    Returns
+    -------
+    tuple of (:obj:`rdflib.Graph`, :obj:`rdflib.Graph`)
+        Graphs with the removed and the added triples.
+    """
+    _, removals_graph, additions_graph = graph_diff(to_isomorphic(source_graph),
+                                                    to_isomorphic(target_graph))
+    return removals_graph, additions_graph
+
+def hashed_diff(source_graph, target_graph):
+    """ Return the triples removed and added between two graphs comparing their hashes.
+
+    Each triple is hashed into a 64-bit integer from the N3 representation of
+    its terms, and the hashes of both graphs are compared as sorted NumPy
+    arrays. Only the triples that changed are collected afterwards. Graphs
+    with blank nodes are canonicalized first, so their blank nodes get the
+    same labels in both graphs.
+
+    Returns
+    -------
+    tuple of (list, list)
+        Lists with the removed and the added triples.
+    """
+    source_graph = _canonicalize(source_graph)
+    target_graph = _canonicalize(target_graph)
+    source_hashes = _hash_triples(source_graph)
+    target_hashes = _hash_triples(target_graph)
+    removed = _select_triples(source_graph, _missing_from(source_hashes, np.sort(target_hashes)))
+    added = _select_triples(target_graph, _missing_from(target_hashes, np.sort(source_hashes)))
+    return removed, added
+
+DIFF_ALGORITHMS = {
+    'graphdiff': isomorphic_diff,
+    'hashed': hashed_diff
+}
+
+def synchronize_graphs(source_graph, target_graph, algorithm=DEFAULT_ALGORITHM):
+    """ Return the synchronization operations between two graphs.
+
+    With the default algorithm this is equivalent to the OntologySynchronizer
+    with the graph diff algorithm, working on graphs that were already parsed.
+
+    Parameters
+    ----------
+    source_graph : :obj:`rdflib.Graph`
+        Graph of the file before the push.
+    target_graph : :obj:`rdflib.Graph`
+        Graph of the file after the push.
+    algorithm : str
+        Name of the diff algorithm, one of DIFF_ALGORITHMS.
+
+    Returns
+    -------
+    list of :obj:`wbsync.synchronization.operations.SyncOperation`
+        Operations needed to synchronize the changes of the file.
+    """
+    removals, additions = DIFF_ALGORITHMS[algorithm](source_graph, target_graph)
+    sync_algorithm = GraphDiffSyncAlgorithm()
+    ops = sync_algorithm._create_remove_ops_from(removals) + \
+        sync_algorithm._create_add_ops_from(additions)
+    ops = _filter_invalid_ops(ops)
+
+    source_model = _build_model(source_graph)
+    target_model = _build_model(target_graph)
+    all_urielements = _extract_uris_from(ops)
+    _annotate_uris_etype(all_urielements, source_model, target_model)
+    _annotate_datatype_props(all_urielements, source_model, target_model)
+    _annotate_object_props(all_urielements, source_model, target_model)
+    return ops
+
+def _canonicalize(graph):
+    if any(isinstance(term, BNode) for triple in graph for term in triple):
+        return to_canonical_graph(graph)
+    return graph
+
+def _hash_triples(graph):
+    keys = np.fromiter((TERM_SEPARATOR.join(term.n3() for term in triple) for triple in graph),
+                       dtype=object, count=len(graph))
+    return hash_array(keys)
+
+def _missing_from(hashes, other_sorted):
+    # mask of the hashes that are not in the other sorted array
+    if len(other_sorted) == 0:
+        return np.ones(len(hashes), dtype=bool)
+    positions = np.searchsorted(other_sorted, hashes)
+    positions[positions == len(other_sorted)] = 0
+    return other_sorted[positions] != hashes
+
+def _select_triples(graph, mask):
+    # graphs are iterated in the same order while they are not modified
+    return [triple for triple, selected in zip(graph, mask) if selected]
+
+def _build_model(graph):
+    model = ontospy.Ontospy()
+    if len(graph) == 0:
+        return model
+    model.rdflib_graph = graph
+    model.sparqlHelper = SparqlHelper(graph)
+    model.namespaces = sorted(graph.namespaces())
+    model.build_all()
+    return model
+
+
+class GraphCache():
+    """ Cache of the last graph synchronized for each file of a repository.
+
+    Each graph is stored together with the git blob sha of the content it was
+    parsed from, and it is only returned for that exact content. The graphs
+    are kept in memory, evicting the least recently used ones, and optionally
+    serialized to disk as N-Triples so they survive a restart.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of graphs kept in memory.
+    cache_dir : str
+        Directory where the graphs are serialized. If it is None the graphs
+        are only kept in memory.
+    """
+
+    def __init__(self, max_size, cache_dir=None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, repository, path, content):
+        """ Return the cached graph of a file if it was parsed from the given content.
+
+        Parameters
+        ----------
+        repository : str
+            Full name of the repository.
+        path : str
+            Path of the file in the repository.
+        content : str
+            Content of the file.
+
+        Returns
+        -------
+        :obj:`rdflib.Graph`
+            Graph of the file or None if it is not in the cache.
+        """
+        key = (repository, path)
+        sha = git_blob_sha(content.encode('utf-8'))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == sha:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        graph = self._load(key, sha)
+        with self._lock:
+            if graph is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._add(key, sha, graph)
+        return graph
+
+    def put(self, repository, path, content, graph):
+        """ Store the graph parsed from the given content of a file.
+
+        The graph must not be modified after it is stored.
+        """
+        key = (repository, path)
+        sha = git_blob_sha(content.encode('utf-8'))
+        with self._lock:
+            self._add(key, sha, graph)
+        self._save(key, sha, graph)
+
+    def stats(self):
+        """ Return the number of hits, misses and graphs in memory of the cache.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def _add(self, key, sha, graph):
+        self._entries[key] = (sha, graph)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _load(self, key, sha):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._path_of(key), 'r', encoding='utf-8') as graph_file:
+                if graph_file.readline().strip() != f'# {sha}':
+                    return None
+                return Graph().parse(data=graph_file.read(), format=CACHE_FORMAT)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            LOGGER.warning("Graph of %s could not be read from the cache.", key, exc_info=True)
+            return None
+
+    def _save(self, key, sha, graph):
+        if self.cache_dir is None:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(f'# {sha}\n'.encode('utf-8'))
+                graph.serialize(destination=tmp_file, format=CACHE_FORMAT, encoding='utf-8')
+            os.replace(tmp_path, self._path_of(key))
+        except OSError:
+            LOGGER.warning("Graph of %s could not be written to the cache.", key)
+
+    def _path_of(self, key):
+        name = hashlib.sha1('\0'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{name}.nt')
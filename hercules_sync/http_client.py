@@ -0,0 +1,179 @@
+""" HTTP client module
+
+Process-wide HTTP client used to access GitHub. Connections are pooled and
+reused across pushes, responses are requested with gzip compression and
+failed requests are retried with a jittered exponential backoff.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import urllib3
+
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError, \
+                              ProtocolError, ReadTimeoutError
+
+LOGGER = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+RETRY_EXCEPTIONS = (ConnectTimeoutError, NewConnectionError, ProtocolError, ReadTimeoutError)
+
+class HttpClient():
+    """ Pooled HTTP client with retries and compression.
+
+    Parameters
+    ----------
+    pool_size : int
+        Maximum number of connections kept alive for each host.
+    timeout : float
+        Timeout in seconds to read the response of a request.
+    connect_timeout : float
+        Timeout in seconds to establish a new connection.
+    retries : int
+        Number of times that a request is retried after a connection error or
+        a 5xx response.
+    backoff_factor : float
+        Base delay in seconds between retries. The delay of each retry is a
+        random value between zero and backoff_factor * 2 ** attempt.
+    max_backoff : float
+        Maximum delay in seconds between retries.
+    """
+
+    def __init__(self, pool_size=10, timeout=30.0, connect_timeout=5.0, retries=3,
+                 backoff_factor=0.5, max_backoff=30.0):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self._pool = urllib3.PoolManager(maxsize=pool_size,
+                                         timeout=urllib3.Timeout(connect=connect_timeout,
+                                                                 read=timeout))
+        self._stats = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, **kwargs):
+        """ Send a request, retrying it if the server or the connection fail.
+
+        Parameters
+        ----------
+        method : str
+            HTTP method of the request.
+        url : str
+            Url of the request.
+        headers : dict
+            Headers of the request. Gzip encoding is requested by default.
+
+        Returns
+        -------
+        :obj:`urllib3.response.HTTPResponse`
+            Response of the last attempt, with its content already decoded.
+        """
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', 'gzip')
+        host = urlsplit(url).netloc
+        max_retries = self.retries if method.upper() in IDEMPOTENT_METHODS else 0
+
+        attempt = 0
+        while True:
+            self._increment(host, 'requests')
+            try:
+                response = self._pool.request(method, url, headers=headers,
+                                              retries=False, **kwargs)
+            except RETRY_EXCEPTIONS as excpt:
+                self._increment(host, 'errors')
+                if attempt >= max_retries:
+                    raise
+                LOGGER.warning("Request to %s failed (%s). Retrying...", url, excpt)
+                delay = self._backoff(attempt)
+            else:
+                if response.status not in RETRY_STATUSES or attempt >= max_retries:
+                    return response
+                self._increment(host, 'errors')
+                LOGGER.warning("Request to %s returned %s. Retrying...", url, response.status)
+                delay = self._backoff(attempt, response.headers.get('Retry-After'))
+                _release(response)
+
+            self._increment(host, 'retries')
+            time.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        """ Return usage statistics of the client for each host.
+
+        Returns
+        -------
+        dict
+            Dictionary indexed by host, where each value contains the number of
+            requests, retries and errors, as well as the number of connections
+            opened by the pool of the host.
+        """
+        with self._lock:
+            stats = {host: dict(host_stats) for host, host_stats in self._stats.items()}
+        for pool_key in list(self._pool.pools.keys()):
+            pool = self._pool.pools.get(pool_key)
+            if pool is None:
+                continue
+            host = pool.host if pool.port in (None, 80, 443) else f'{pool.host}:{pool.port}'
+            host_stats = stats.setdefault(host, {})
+            host_stats['connections'] = host_stats.get('connections', 0) + pool.num_connections
+            host_stats['pool_requests'] = host_stats.get('pool_requests', 0) + pool.num_requests
+        return stats
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, min(self.max_backoff, float(retry_after)))
+        return delay
+
+    def _increment(self, host, stat):
+        with self._lock:
+            self._stats[host][stat] += 1
+
+def _release(response):
+    # responses requested without preload_content keep their connection until they are read
+    try:
+        if hasattr(response, 'drain_conn'):
+            response.drain_conn()
+        else:
+            response.read()
+    except Exception:
+        LOGGER.debug("Error draining the response before retrying.", exc_info=True)
+    response.release_conn()
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+def configure_http_client(**kwargs):
+    """ Replace the shared HTTP client with a new one created with the given arguments.
+
+    Returns
+    -------
+    :obj:`HttpClient`
+        New shared client.
+    """
+    global _CLIENT
+    with _CLIENT_LOCK:
+        _CLIENT = HttpClient(**kwargs)
+        return _CLIENT
+
+def get_http_client():
+    """ Return the HTTP client shared by the whole process.
+
+    Returns
+    -------
+    :obj:`HttpClient`
+        Shared client, created with the default configuration if
+        :func:`configure_http_client` wasn't called before.
+    """
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = HttpClient()
+        return _CLIENT
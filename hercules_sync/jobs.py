@@ -0,0 +1,429 @@
+""" Job queue module
+
+Persistent queue where the synchronization jobs are stored until a worker
+completes them. Jobs are kept in an embedded SQLite database, so pending jobs
+survive a restart of the service.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+from .metrics import JOBS_FINISHED
+
+LOGGER = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+COLUMNS = [
+    ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    ('task', 'TEXT NOT NULL'),
+    ('payload', 'TEXT NOT NULL'),
+    ('status', 'TEXT NOT NULL'),
+    ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ('created', 'REAL NOT NULL'),
+    ('started', 'REAL'),
+    ('finished', 'REAL'),
+    ('error', 'TEXT'),
+    ('key', 'TEXT'),
+    ('run_at', 'REAL NOT NULL DEFAULT 0'),
+    ('stage', 'TEXT'),
+    ('owner', 'TEXT'),
+    ('lease_until', 'REAL'),
+    ('timings', 'TEXT'),
+    ('result', 'TEXT')
+]
+JOB_FIELDS = ('id', 'task', 'status', 'stage', 'attempts', 'created', 'started', 'finished',
+              'run_at', 'timings', 'result', 'error')
+
+class JobQueue():
+    """ Durable job queue processed by a pool of worker threads.
+
+    Each job has a task name, which selects the function registered to run it,
+    and a JSON serializable payload that is passed to that function. Jobs are
+    only marked as done once their function returns. While a job runs, the
+    queue that claimed it keeps renewing its lease, and jobs whose lease
+    expires because their process crashed are queued again (at-least-once
+    delivery). Several processes can share the same database.
+    Jobs whose function raises an exception are retried until they reach the
+    maximum number of attempts, waiting twice as long before each new retry.
+    Jobs with the same key are run in the order they were queued: a job isn't
+    run while an earlier job with its key is queued, running or waiting to be
+    retried.
+
+    While a job runs, its function can report the stage it is in with
+    :meth:`set_stage`, and the value it returns is stored as the result of the
+    job. Both of them, as well as the time spent in each stage, are available
+    through :meth:`get`.
+
+    Parameters
+    ----------
+    db_path : str
+        Path of the SQLite database. It is created if it doesn't exist.
+    workers : int
+        Number of worker threads that process jobs concurrently.
+    max_attempts : int
+        Maximum number of times that a job is run before it is marked as failed.
+    retention : float
+        Time in seconds that finished jobs are kept in the database.
+    retry_backoff : float
+        Time in seconds that a failed job waits before its first retry. It is
+        doubled on each following retry.
+    lease_time : float
+        Time in seconds that a running job is kept by its queue without
+        renewing its lease before other queues run it again.
+    poll_interval : float
+        Maximum time in seconds that an idle worker waits before checking the
+        database again.
+    dedup_cache : :obj:`TTLCache`
+        Optional cache where :meth:`enqueue_unique` records the job of each
+        deduplication key. It can be shared with other components, such as
+        the webhook, to recognise duplicated requests.
+    """
+
+    def __init__(self, db_path, workers=1, max_attempts=3, retention=86400.0,
+                 retry_backoff=30.0, lease_time=300.0, poll_interval=5.0, dedup_cache=None):
+        self.db_path = db_path
+        self.dedup_cache = dedup_cache
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.retry_backoff = retry_backoff
+        self.lease_time = lease_time
+        self.poll_interval = poll_interval
+        self._owner = uuid.uuid4().hex
+        self._tasks = {}
+        self._threads = []
+        self._stopped = False
+        self._stop_heartbeat = threading.Event()
+        self._current = threading.local()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        with self._lock, self._conn:
+            self._create_schema()
+
+    def register(self, task, function):
+        """ Register the function that runs the jobs of a task.
+
+        Parameters
+        ----------
+        task : str
+            Name of the task.
+        function : callable
+            Function called with the payload of each job of the task.
+        """
+        self._tasks[task] = function
+
+    def enqueue(self, task, payload, key=None, delay=0.0, merge=None):
+        """ Store a new job in the queue.
+
+        Parameters
+        ----------
+        task : str
+            Name of the task that will run the job.
+        payload : any
+            JSON serializable payload of the job.
+        key : str
+            Key of the job. Jobs with the same key are run one after another.
+            If a merge function is given and there is a queued job of the same
+            task and key that hasn't started yet, the payload is merged into
+            that job instead of creating a new one.
+        delay : float
+            Time in seconds that the new job waits before it can be run.
+        merge : callable
+            Function called with the payloads of the queued job and the new
+            one, which returns the payload of the merged job.
+
+        Returns
+        -------
+        int
+            Identifier of the job where the payload was stored.
+        """
+        with self._condition:
+            return self._enqueue(task, payload, key, delay, merge)
+
+    def enqueue_unique(self, dedup_key, task, payload, **kwargs):
+        """ Store a new job in the queue unless it duplicates a recent one.
+
+        A job is a duplicate when the deduplication cache has a job for the same
+        key which is still queued, running or done. Failed jobs are not taken
+        into account, so they can be requested again.
+
+        Parameters
+        ----------
+        dedup_key : hashable
+            Key that identifies the duplicates of the job.
+        task : str
+            Name of the task that will run the job.
+        payload : any
+            JSON serializable payload of the job.
+        **kwargs
+            Rest of the arguments of :meth:`enqueue`.
+
+        Returns
+        -------
+        tuple of (int, bool)
+            Identifier of the job and whether it is a new one (False if the
+            job is a duplicate).
+        """
+        with self._condition:
+            job_id = self.dedup_cache.get(dedup_key) if self.dedup_cache is not None else None
+            if job_id is not None:
+                row = self._conn.execute("SELECT status FROM jobs WHERE id = ?",
+                                         (job_id,)).fetchone()
+                if row is not None and row[0] != FAILED:
+                    LOGGER.info("Job %d was already queued for %s.", job_id, dedup_key)
+                    return job_id, False
+
+            job_id = self._enqueue(task, payload, **kwargs)
+            if self.dedup_cache is not None:
+                self.dedup_cache.set(dedup_key, job_id)
+            return job_id, True
+
+    def set_stage(self, stage):
+        """ Record the stage of the job run by the current worker.
+
+        The time elapsed since the previous stage started is added to the
+        timings of the job. Calls made outside of a job are ignored.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the new stage.
+        """
+        job = getattr(self._current, 'job', None)
+        if job is None:
+            return
+        self._close_stage(job)
+        job['stage'] = stage
+        job['stage_start'] = time.monotonic()
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET stage = ?, timings = ? WHERE id = ?",
+                               (stage, json.dumps(job['timings']), job['id']))
+
+    def get(self, job_id):
+        """ Return the information of a job.
+
+        Returns
+        -------
+        dict
+            Dictionary with the id, task, status, stage, attempts, timestamps
+            (including the time of the next attempt), time in seconds spent
+            in each stage, result and error of the job, or None if it doesn't
+            exist.
+        """
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?",
+                                     (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job['timings'] = json.loads(job['timings']) if job['timings'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def depth(self):
+        """ Return the number of jobs waiting to be run.
+        """
+        return self.stats().get(QUEUED, 0)
+
+    def stats(self):
+        """ Return the number of jobs of the queue in each status.
+
+        Returns
+        -------
+        dict
+            Dictionary indexed by status with the number of jobs.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs "
+                                      "GROUP BY status").fetchall()
+        return dict(rows)
+
+    def start(self):
+        """ Recover the jobs interrupted by a previous crash and start the workers.
+
+        Only the running jobs whose lease expired are recovered, so the jobs
+        run by other processes sharing the database are left alone.
+        """
+        with self._condition:
+            self._recover()
+        self._stopped = False
+        self._stop_heartbeat.clear()
+        threads = [threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                   for i in range(self.workers)]
+        threads.append(threading.Thread(target=self._heartbeat, name='job-heartbeat',
+                                        daemon=True))
+        for thread in threads:
+            thread.start()
+        self._threads.extend(threads)
+
+    def stop(self, timeout=None):
+        """ Stop the workers once they finish their current jobs.
+        """
+        with self._condition:
+            self._stopped = True
+            self._stop_heartbeat.set()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+
+    def join(self, timeout=None):
+        """ Wait until there are no queued nor running jobs.
+
+        Returns
+        -------
+        bool
+            True if the queue was emptied before the timeout expired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stats = self.stats()
+            if not stats.get(QUEUED) and not stats.get(RUNNING):
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def close(self):
+        """ Stop the workers and close the connection with the database.
+        """
+        self.stop()
+        with self._lock:
+            self._conn.close()
+
+    def _enqueue(self, task, payload, key=None, delay=0.0, merge=None):
+        # must be called while holding the lock of the queue
+        with self._conn:
+            if key is not None and merge is not None:
+                row = self._conn.execute("SELECT id, payload FROM jobs WHERE task = ? AND "
+                                         "key = ? AND status = ? AND started IS NULL "
+                                         "ORDER BY id LIMIT 1",
+                                         (task, key, QUEUED)).fetchone()
+                if row is not None:
+                    merged = merge(json.loads(row[1]), payload)
+                    self._conn.execute("UPDATE jobs SET payload = ? WHERE id = ?",
+                                       (json.dumps(merged), row[0]))
+                    LOGGER.info("Payload merged into queued job %d.", row[0])
+                    return row[0]
+
+            now = time.time()
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (task, payload, status, created, key, run_at, stage) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (task, json.dumps(payload), QUEUED, now, key, now + delay, QUEUED))
+        self._condition.notify()
+        return cursor.lastrowid
+
+    def _create_schema(self):
+        columns = ', '.join(f'{name} {definition}' for name, definition in COLUMNS)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS jobs ({columns})")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)")
+
+    def _claim(self):
+        with self._condition:
+            while not self._stopped:
+                now = time.time()
+                # jobs wait for the earlier jobs with the same key, including their retries
+                row = self._conn.execute("SELECT id, task, payload, attempts, run_at "
+                                         "FROM jobs AS job WHERE status = ? AND NOT EXISTS "
+                                         "(SELECT 1 FROM jobs AS earlier WHERE "
+                                         "earlier.key = job.key AND earlier.id < job.id AND "
+                                         "earlier.status IN (?, ?)) "
+                                         "ORDER BY run_at, id LIMIT 1",
+                                         (QUEUED, QUEUED, RUNNING)).fetchone()
+                if row is not None and row[4] <= now:
+                    with self._conn:
+                        # another process sharing the database may have claimed it already
+                        claimed = self._conn.execute(
+                            "UPDATE jobs SET status = ?, stage = ?, attempts = ?, started = ?, "
+                            "timings = NULL, owner = ?, lease_until = ? "
+                            "WHERE id = ? AND status = ?",
+                            (RUNNING, RUNNING, row[3] + 1, now, self._owner,
+                             now + self.lease_time, row[0], QUEUED)).rowcount
+                    if claimed == 1:
+                        return row[0], row[1], row[2], row[3] + 1
+                    continue
+                timeout = self.poll_interval if row is None else \
+                    min(self.poll_interval, row[4] - now)
+                self._condition.wait(timeout)
+        return None
+
+    def _recover(self):
+        # must be called while holding the lock of the queue
+        with self._conn:
+            recovered = self._conn.execute("UPDATE jobs SET status = ?, stage = ?, owner = NULL "
+                                           "WHERE status = ? AND lease_until < ?",
+                                           (QUEUED, QUEUED, RUNNING, time.time())).rowcount
+        if recovered:
+            LOGGER.warning("Recovered %d interrupted jobs.", recovered)
+            self._condition.notify_all()
+
+    def _heartbeat(self):
+        while not self._stop_heartbeat.wait(self.lease_time / 3):
+            with self._condition:
+                with self._conn:
+                    self._conn.execute("UPDATE jobs SET lease_until = ? "
+                                       "WHERE owner = ? AND status = ?",
+                                       (time.time() + self.lease_time, self._owner, RUNNING))
+                self._recover()
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                return
+            job_id, task, payload, attempts = job
+            self._current.job = {'id': job_id, 'stage': RUNNING,
+                                 'stage_start': time.monotonic(), 'timings': {}}
+            try:
+                result = self._tasks[task](json.loads(payload))
+            except Exception:
+                LOGGER.exception("Error running job %d (attempt %d).", job_id, attempts)
+                if attempts < self.max_attempts:
+                    # back off, so a failing service isn't requested again right away
+                    delay = self.retry_backoff * 2 ** (attempts - 1)
+                    self._finish(job_id, QUEUED, error=traceback.format_exc(), retry_delay=delay)
+                else:
+                    self._finish(job_id, FAILED, error=traceback.format_exc())
+            else:
+                self._finish(job_id, DONE, result=result)
+            finally:
+                self._current.job = None
+
+    def _close_stage(self, job):
+        elapsed = time.monotonic() - job['stage_start']
+        job['timings'][job['stage']] = job['timings'].get(job['stage'], 0.0) + elapsed
+
+    def _finish(self, job_id, status, result=None, error=None, retry_delay=0.0):
+        job = self._current.job
+        self._close_stage(job)
+        now = time.time()
+        with self._condition:
+            with self._conn:
+                updated = self._conn.execute("UPDATE jobs SET status = ?, stage = ?, "
+                                             "finished = ?, run_at = ?, timings = ?, "
+                                             "result = ?, error = ? "
+                                             "WHERE id = ? AND owner = ? AND status = ?",
+                                             (status, status, now if status != QUEUED else None,
+                                              now + retry_delay, json.dumps(job['timings']),
+                                              json.dumps(result), error, job_id, self._owner,
+                                              RUNNING)).rowcount
+                if updated == 0:
+                    LOGGER.warning("Job %d was recovered by another worker after its lease "
+                                   "expired.", job_id)
+                self._conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?",
+                                   (DONE, FAILED, now - self.retention))
+            if status == QUEUED:
+                self._condition.notify()
+        JOBS_FINISHED.labels(status='retried' if status == QUEUED else status).inc()
@@ -1,61 +1,232 @@
 import logging
+import threading
 
 from typing import List
 
 from flask import current_app as app
-from flask import abort
-from flask_executor import Executor
+from flask import Response, abort, jsonify
 
-from .git import GitFile, GitPushEventHandler, DiffNotFoundError
-from wbsync.synchronization import GraphDiffSyncAlgorithm, OntologySynchronizer
-from wbsync.triplestore import WikibaseAdapter
+from .cache import BlobCache, TTLCache
+from .coalescer import merge_pushes, push_key, push_range
+from .git import GitFile, GitHubBackend, GitPushEventHandler, DiffNotFoundError
+from .http_client import configure_http_client
+from .jobs import FAILED, JobQueue
+from .metrics import JOB_QUEUE_DEPTH, REGISTRY
+from .mirror import GitMirrorBackend
+from .rules import RuleSet
+from .tracing import configure_tracing, trace
 from .webhook import WebHook
-from .uris_factory import HerculesURIsFactory
 
-EXECUTOR = Executor(app)
 LOGGER = logging.getLogger(__name__)
-WEBHOOK = WebHook(app, endpoint='/postreceive', key=app.config['WEBHOOK_SECRET'])
+RULES = RuleSet.from_config(app.config['SYNC_RULES'])
+configure_http_client(pool_size=max(app.config['HTTP_POOL_SIZE'],
+                                     app.config['GITHUB_DOWNLOAD_WORKERS']),
+                      timeout=app.config['HTTP_TIMEOUT'],
+                      connect_timeout=app.config['HTTP_CONNECT_TIMEOUT'],
+                      retries=app.config['HTTP_RETRIES'],
+                      backoff_factor=app.config['HTTP_BACKOFF'])
+BLOB_CACHE = BlobCache(app.config['BLOB_CACHE_DIR'], app.config['BLOB_CACHE_SIZE']) \
+    if app.config['BLOB_CACHE_DIR'] else None
+
+def _create_git_backend():
+    if app.config['GIT_BACKEND'] == 'mirror':
+        return GitMirrorBackend(app.config['GIT_MIRROR_DIR'], app.config['GIT_MIRROR_URL'],
+                                app.config['GITHUB_OAUTH'])
+    return GitHubBackend(app.config['GITHUB_OAUTH'], app.config['GITHUB_DOWNLOAD_WORKERS'],
+                         BLOB_CACHE, app.config['REBUILD_SOURCE_FROM_DIFF'])
+
+GIT_BACKEND = _create_git_backend()
+configure_tracing(app.config['TRACE_EXPORT'], app.config['TRACE_FILE'])
+# created with the synchronization dependencies, see _load_sync_dependencies
+SYNC_POOL = None
+ADAPTER_POOL = None
+_SYNC_LOCK = threading.Lock()
+# deliveries and pushes already received, shared by the webhook and the job queue
+DELIVERIES = TTLCache(app.config['DELIVERY_CACHE_SIZE'], app.config['DELIVERY_TTL'])
+
+def _is_job_alive(response):
+    # redeliveries of a push whose job failed are processed again, so the job is retried
+    _, body = response
+    if not isinstance(body, dict) or 'job' not in body:
+        return True
+    job = JOB_QUEUE.get(body['job'])
+    return job is not None and job['status'] != FAILED
+
+WEBHOOK = WebHook(app, endpoint='/postreceive', key=app.config['WEBHOOK_SECRET'],
+                  deliveries=DELIVERIES, replay_check=_is_job_alive)
+PUSH_REQUIRED_KEYS = ('repository', 'before', 'after')
+_APP = app._get_current_object()
+JOB_QUEUE = JobQueue(app.config['JOB_QUEUE_PATH'], app.config['JOB_WORKERS'],
+                     app.config['JOB_MAX_ATTEMPTS'], app.config['JOB_RETENTION'],
+                     app.config['JOB_RETRY_BACKOFF'], app.config['JOB_LEASE_TIME'],
+                     dedup_cache=DELIVERIES)
+JOB_QUEUE_DEPTH.set_function(JOB_QUEUE.depth)
 
 @WEBHOOK.hook()
 def on_push(data):
-    try:
-        LOGGER.info("Got push with: %s", data)
-        git_handler = GitPushEventHandler(data, app.config['GITHUB_OAUTH'])
-        ontology_files = _extract_ontology_files(git_handler, 'ttl', None)
-        LOGGER.info("Modified files: %s", ontology_files)
-    except DiffNotFoundError:
-        LOGGER.info("There was no diff to synchronize.")
-        return 200, 'No diff'
-    except Exception as excpt:
-        LOGGER.exception("There was an error processing the request.")
+    LOGGER.info("Got push with: %s", data)
+    if not all(key in data for key in PUSH_REQUIRED_KEYS):
+        abort(400, "Invalid push payload.")
+    if not RULES.matches_push(data):
+        LOGGER.info("Push does not match any synchronization rule.")
+        return 200, 'Ignored'
+
+    window = app.config['PUSH_COALESCE_WINDOW']
+    # pushes to the same ref are synchronized in order, even when one is retried
+    job_id, is_new = JOB_QUEUE.enqueue_unique(push_range(data), 'push', data,
+                                              key=push_key(data), delay=window,
+                                              merge=merge_pushes if window > 0 else None)
+    if not is_new:
+        LOGGER.info("Push already queued in job %d.", job_id)
+        return 200, {'job': job_id, 'url': f'/jobs/{job_id}', 'duplicate': True}
+    LOGGER.info("Push queued in job %d.", job_id)
+    return 202, {'job': job_id, 'url': f'/jobs/{job_id}'}
+
+@app.route('/jobs/<int:job_id>')
+def get_job(job_id):
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
         abort(404)
+    return jsonify(job)
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
-    if len(ontology_files) > 0:
-        EXECUTOR.submit(_synchronize_files, ontology_files)
-    return 200, 'Ok'
+def _load_push_files(data) -> List[GitFile]:
+    git_handler = GitPushEventHandler(data, path_filter=RULES.path_filter(data),
+                                      backend=GIT_BACKEND)
+    ontology_files = _extract_ontology_files(git_handler)
+    LOGGER.info("Modified files: %s", ontology_files)
+    return ontology_files
 
-def _extract_ontology_files(git_handler: GitPushEventHandler, file_format: str,
+def _process_push(data):
+    LOGGER.info("Processing push from %s to %s...", data['before'], data['after'])
+    with trace('push', repository=data['repository']['full_name'], ref=data.get('ref', ''),
+               before=data['before'], after=data['after']):
+        JOB_QUEUE.set_stage('fetching')
+        try:
+            ontology_files = _load_push_files(data)
+        except DiffNotFoundError:
+            LOGGER.info("There was no diff to synchronize.")
+            return {'files': 0, 'message': 'No diff'}
+        if len(ontology_files) == 0:
+            return {'files': 0}
+        result = _synchronize_files(ontology_files, data['repository']['full_name'])
+        result['files'] = len(ontology_files)
+        return result
+
+def _extract_ontology_files(git_handler: GitPushEventHandler, file_format: str = None,
                             custom_filter=None) -> List[GitFile]:
     LOGGER.info("Extracting ontology files modified from push...")
     all_files = list(git_handler.removed_files) + list(git_handler.added_files) + \
         list(git_handler.modified_files)
     if custom_filter:
         return custom_filter(all_files)
+    if file_format is None:
+        return all_files
     return list(filter(lambda x: x._patched_file.path.endswith(f".{file_format}"), all_files))
 
-def _synchronize_files(files: List[GitFile]):
+def _load_sync_dependencies():
+    """ Import the synchronization dependencies and create the objects shared by the jobs.
+
+    rdflib, ontospy, pandas and wikidataintegrator are only needed to run the
+    jobs, so they are loaded in the background after startup, or by the
+    first job, instead of delaying the start of the server. The workers of
+    the process pool are started here as well.
+    """
+    global SYNC_POOL, ADAPTER_POOL
+    with _SYNC_LOCK:
+        if SYNC_POOL is not None:
+            return
+        from .graphs import GraphCache
+        from .parallel import SyncProcessPool
+        from .uris_factory import configure_uris_factory, warm_up_uris_cache
+        from .wikibase import WikibaseAdapterPool
+
+        graph_cache = GraphCache(app.config['GRAPH_CACHE_SIZE'], app.config['GRAPH_CACHE_DIR']) \
+            if app.config['GRAPH_CACHE_SIZE'] > 0 else None
+        ADAPTER_POOL = WikibaseAdapterPool(app.config['WBAPI'], app.config['WBSPARQL'],
+                                           app.config['WBUSER'], app.config['WBPASS'],
+                                           app.config['WB_SESSIONS'],
+                                           app.config['WB_SESSION_CHECK_INTERVAL'])
+        configure_uris_factory(app.config['URIS_CACHE_SIZE'], app.config['URIS_CACHE_TTL'],
+                               app.config['URIS_CACHE_NEGATIVE_TTL'],
+                               app.config['URIS_STORE_PATH'],
+                               app.config['URIS_WRITE_BEHIND'],
+                               app.config['URIS_WRITE_BATCH_SIZE'],
+                               app.config['URIS_WRITE_INTERVAL'],
+                               app.config['URIS_WRITE_RETRIES'],
+                               app.config['URIS_FACTORY'], app.config['WBAPI'])
+        warm_up_uris_cache()
+        sync_pool = SyncProcessPool(app.config['SYNC_PROCESSES'], graph_cache)
+        # workers are forked here, so the first push doesn't wait for them
+        sync_pool.start()
+        SYNC_POOL = sync_pool
+        LOGGER.info("Synchronization dependencies loaded.")
+
+def _warm_up(_):
+    try:
+        _load_sync_dependencies()
+    except Exception:
+        LOGGER.exception("Error loading the synchronization dependencies. "
+                         "They will be loaded again by the first job.")
+
+def _synchronize_files(files: List[GitFile], repository: str = None) -> dict:
+    from .operations import count_operations, execute_operations
+    from .uris_factory import HerculesURIsFactory
+
     LOGGER.info("Synchronizing files...")
-    algorithm = GraphDiffSyncAlgorithm()
-    adapter = WikibaseAdapter(app.config['WBAPI'], app.config['WBSPARQL'],
-                              app.config['WBUSER'], app.config['WBPASS'],factory_of_uris=HerculesURIsFactory())
-    for file in files:
-        synchronizer = OntologySynchronizer(algorithm)
-        ops = synchronizer.synchronize(file.source_content, file.target_content)
-        for op in ops:
-            res = op.execute(adapter)
+    _load_sync_dependencies()
+    JOB_QUEUE.set_stage('computing operations')
+    factory = HerculesURIsFactory()
+    ops = SYNC_POOL.compute_operations(files, repository, app.config['SYNC_ALGORITHM'])
+    count_operations(ops)
+
+    if app.config['URIS_PREFETCH_WORKERS'] > 0:
+        JOB_QUEUE.set_stage('resolving uris')
+        factory.resolve_all(_collect_uri_elements(ops), app.config['URIS_PREFETCH_WORKERS'])
+    JOB_QUEUE.set_stage('writing to wikibase')
+    failed = 0
+    with ADAPTER_POOL.session(factory) as adapter:
+        for op, res in execute_operations(ops, adapter, app.config['SYNC_BATCH_EDITS']):
             if not res.successful:
+                failed += 1
                 LOGGER.warning("Error synchronizing triple: %s", res.message)
-    LOGGER.info("Synchronization finished.")
+    if not factory.flush():
+        LOGGER.warning("Some local uris could not be sent to the uris factory.")
+    LOGGER.info("Synchronization finished. Wikibase sessions: %s", ADAPTER_POOL.stats())
+    return {'operations': len(ops), 'failed': failed}
+
+def _collect_uri_elements(ops) -> list:
+    """ Return the elements of the operations that will be looked up in the uris factory. """
+    from wbsync.triplestore import URIElement, WikibaseAdapter
+
+    elements = []
+    for op in ops:
+        subject, predicate, objct = op._triple_info.content
+        elements.append(subject)
+        if WikibaseAdapter.is_wb_label(predicate) or WikibaseAdapter.is_wb_description(predicate) \
+                or WikibaseAdapter.is_wb_alias(predicate):
+            continue
+        if not objct.is_literal():
+            elements.append(objct)
+        # predicates are always resolved as properties by the adapter
+        elements.append(URIElement(predicate.uri, etype='property'))
+    return elements
 
 def _filter_asio_files(all_files: List[GitFile]) -> List[GitFile]:
     return list(filter(lambda x: "current/asio.ttl" in x._patched_file.path, all_files))
+
+def _run_in_app_context(function):
+    # jobs are run by the workers of the queue, outside of any context
+    def wrapper(payload):
+        with _APP.app_context():
+            return function(payload)
+    return wrapper
+
+JOB_QUEUE.register('push', _run_in_app_context(_process_push))
+JOB_QUEUE.start()
+if app.config['SYNC_WARM_UP']:
+    threading.Thread(target=_run_in_app_context(_warm_up), args=(None,),
+                     name='sync-warm-up', daemon=True).start()
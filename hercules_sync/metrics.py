@@ -0,0 +1,290 @@
+""" Metrics module
+
+Minimal implementation of counters, gauges and histograms that are exposed in
+the Prometheus text format, together with the metrics of every stage of the
+synchronization pipeline.
+"""
+
+import math
+import threading
+import time
+
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+class Registry():
+    """ Collection of metrics rendered together.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """ Add a metric to the registry, returning it.
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Return the metrics of the registry in the Prometheus text format.
+
+        Returns
+        -------
+        str
+            Text with the help, type and samples of each metric.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.TYPE}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Metric():
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values, **labels):
+        """ Return the child metric of the given label values.
+        """
+        if labels:
+            values = tuple(str(labels[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"Incorrect label values for metric {self.name}.")
+        with self._lock:
+            if values not in self._children:
+                self._children[values] = self._create_child()
+            return self._children[values]
+
+    def samples(self):
+        """ Return the samples of the metric as (name, labels, value) tuples.
+        """
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for values, child in children:
+            labels = list(zip(self.labelnames, values))
+            samples.extend((self.name + suffix, labels + extra_labels, value)
+                           for suffix, extra_labels, value in child.samples())
+        return samples
+
+    def _default_child(self):
+        if self.labelnames:
+            raise ValueError(f"Metric {self.name} requires label values.")
+        return self.labels()
+
+    def _create_child(self):
+        raise NotImplementedError
+
+
+class _CounterChild():
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        if amount < 0:
+            raise ValueError("Counters can only be incremented.")
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [('_total', [], self.value)]
+
+
+class Counter(_Metric):
+    """ Monotonically increasing counter.
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric, without the '_total' suffix.
+    documentation : str
+        Description of the metric.
+    labelnames : iterable of str
+        Names of the labels of the metric.
+    registry : :obj:`Registry`
+        Registry where the metric is added.
+    """
+    TYPE = 'counter'
+
+    def inc(self, amount=1.0):
+        """ Increment the counter without labels.
+        """
+        self._default_child().inc(amount)
+
+    def _create_child(self):
+        return _CounterChild()
+
+
+class _GaugeChild():
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        self.value = float(value)
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        return [('', [], self.function() if self.function is not None else self.value)]
+
+
+class Gauge(_Metric):
+    """ Value that can go up and down, or that is computed when it is rendered.
+    """
+    TYPE = 'gauge'
+
+    def set(self, value):
+        """ Set the value of the gauge without labels.
+        """
+        self._default_child().set(value)
+
+    def set_function(self, function):
+        """ Compute the value of the gauge with the given function each time it is rendered.
+        """
+        self._default_child().set_function(function)
+
+    def _create_child(self):
+        return _GaugeChild()
+
+
+class _HistogramChild():
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self):
+        with self._lock:
+            samples = []
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                samples.append(('_bucket', [('le', _format_value(bound))], cumulative))
+            samples.append(('_bucket', [('le', '+Inf')], self.count))
+            samples.append(('_count', [], self.count))
+            samples.append(('_sum', [], self.sum))
+            return samples
+
+
+class Histogram(_Metric):
+    """ Distribution of observed values, counted in cumulative buckets.
+
+    Parameters
+    ----------
+    buckets : iterable of float
+        Upper bounds of the buckets. The +Inf bucket is always added.
+    """
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None,
+                 buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value):
+        """ Observe a value in the histogram without labels.
+        """
+        self._default_child().observe(value)
+
+    def time(self):
+        """ Return a context manager that observes the seconds spent inside it.
+        """
+        return self._default_child().time()
+
+    def _create_child(self):
+        return _HistogramChild(self.buckets)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return '{' + pairs + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(float(value))
+    return repr(float(value))
+
+
+REGISTRY = Registry()
+
+WEBHOOK_VERIFICATION_SECONDS = Histogram(
+    'hercules_webhook_verification_seconds',
+    'Time spent verifying and parsing webhook requests.',
+    registry=REGISTRY)
+DIFF_FETCH_SECONDS = Histogram(
+    'hercules_diff_fetch_seconds', 'Time spent loading the diff of a push.', ['backend'],
+    registry=REGISTRY)
+DIFF_SIZE_BYTES = Histogram(
+    'hercules_diff_size_bytes', 'Size of the diffs of the pushes.', ['backend'],
+    registry=REGISTRY, buckets=SIZE_BUCKETS)
+FILE_DOWNLOAD_SECONDS = Histogram(
+    'hercules_file_download_seconds', 'Time spent downloading the content of a file.',
+    ['backend'], registry=REGISTRY)
+PARSE_DIFF_SECONDS = Histogram(
+    'hercules_parse_diff_seconds', 'Time spent parsing and comparing the versions of a file.',
+    registry=REGISTRY)
+OPERATIONS_GENERATED = Counter(
+    'hercules_operations_generated', 'Synchronization operations generated.', ['type'],
+    registry=REGISTRY)
+WIKIBASE_WRITE_SECONDS = Histogram(
+    'hercules_wikibase_write_seconds', 'Time spent executing operations in Wikibase.',
+    ['type', 'successful'], registry=REGISTRY)
+URIS_FACTORY_CALLS = Counter(
+    'hercules_uris_factory_calls', 'Calls to the uris factory client.', ['method', 'cache'],
+    registry=REGISTRY)
+URIS_FACTORY_REQUEST_SECONDS = Histogram(
+    'hercules_uris_factory_request_seconds', 'Time spent in requests to the uris factory.',
+    ['endpoint'], registry=REGISTRY)
+JOB_QUEUE_DEPTH = Gauge(
+    'hercules_job_queue_depth', 'Synchronization jobs waiting to be run.', registry=REGISTRY)
+JOBS_FINISHED = Counter(
+    'hercules_jobs_finished', 'Synchronization jobs finished.', ['status'], registry=REGISTRY)
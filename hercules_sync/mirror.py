@@ -0,0 +1,291 @@
+""" Local git mirror backend
+
+Source backend that keeps a bare local mirror of each repository. Every push
+requires a single fetch from the remote, and both the diff and the contents of
+the files are read afterwards from the local objects.
+"""
+
+import base64
+import logging
+import os
+import subprocess
+import threading
+
+from .git import DiffNotFoundError, GitFile, InvalidCommitError, parse_diff_stream
+from .metrics import DIFF_FETCH_SECONDS, DIFF_SIZE_BYTES, FILE_DOWNLOAD_SECONDS
+from .tracing import span
+
+LOGGER = logging.getLogger(__name__)
+
+GITHUB_REMOTE_URL = 'https://github.com/{repo}.git'
+FETCH_REFSPECS = ['+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+
+class GitMirrorBackend():
+    """ Source backend that reads the diff and files from local bare mirrors.
+
+    Parameters
+    ----------
+    mirror_dir : str
+        Directory where the mirrors of the repositories will be stored.
+    remote_url : str
+        Template of the url of the remote repositories. The '{repo}' field is
+        replaced with the full name of each repository.
+    oauth : str
+        GitHub token used to fetch from private repositories.
+    """
+
+    def __init__(self, mirror_dir, remote_url=GITHUB_REMOTE_URL, oauth=''):
+        self.mirror_dir = mirror_dir
+        self.remote_url = remote_url
+        self.oauth = oauth
+        self._mirrors = {}
+        self._lock = threading.Lock()
+
+    def create_diff_parser(self, repo_name, before_commit, after_commit):
+        """ Return the parser used to load the diff of a push.
+
+        Returns
+        -------
+        :obj:`MirrorDiffParser`
+            Parser that fetches the push and computes the diff locally.
+        """
+        return MirrorDiffParser(self.get_mirror(repo_name), before_commit, after_commit)
+
+    def create_data_loader(self, repo_name, before_commit, after_commit, linear_history=True):
+        """ Return the loader used to obtain the contents of the files of a push.
+
+        Returns
+        -------
+        :obj:`MirrorDataLoader`
+            Loader that reads the files from the local mirror.
+        """
+        return MirrorDataLoader(self.get_mirror(repo_name), before_commit, after_commit)
+
+    def get_mirror(self, repo_name):
+        """ Return the mirror of a repository, creating it if needed.
+
+        Parameters
+        ----------
+        repo_name : str
+            Full name of the repository.
+
+        Returns
+        -------
+        :obj:`GitMirror`
+            Mirror of the repository. The same instance is returned for every
+            call with the same repository.
+        """
+        with self._lock:
+            if repo_name not in self._mirrors:
+                path = os.path.join(self.mirror_dir, f'{repo_name}.git')
+                remote_url = self.remote_url.format(repo=repo_name)
+                self._mirrors[repo_name] = GitMirror(path, remote_url, self.oauth)
+            return self._mirrors[repo_name]
+
+    def close(self):
+        """ Stop the git processes used by the mirrors.
+        """
+        with self._lock:
+            for mirror in self._mirrors.values():
+                mirror.close()
+
+
+class GitMirror():
+    """ Bare local mirror of a remote git repository.
+
+    The contents of the files are read through a persistent
+    'git cat-file --batch' process, so no new process is spawned for each file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the bare repository.
+    remote_url : str
+        Url of the remote repository.
+    oauth : str
+        GitHub token sent when fetching from the remote.
+    """
+
+    def __init__(self, path, remote_url, oauth=''):
+        self.path = path
+        self.remote_url = remote_url
+        self.oauth = oauth
+        self._cat_file = None
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        """ Update the mirror with the branches and tags of the remote.
+        """
+        with self._lock:
+            if not os.path.isfile(os.path.join(self.path, 'HEAD')):
+                LOGGER.info("Creating mirror of %s in %s", self.remote_url, self.path)
+                os.makedirs(self.path, exist_ok=True)
+                self._run_git('init', '--bare', '--quiet')
+            self._run_git('fetch', '--quiet', self.remote_url, *FETCH_REFSPECS)
+
+    def diff(self, before_commit, after_commit):
+        """ Return the unified diff between the merge base of two commits and the last one.
+
+        Raises
+        ------
+        DiffNotFoundError
+            If any of the commits doesn't exist in the mirror.
+        """
+        try:
+            output = self._run_git('diff', '--no-color', '--no-ext-diff', '--no-renames',
+                                   '--full-index', f'{before_commit}...{after_commit}', '--')
+        except subprocess.CalledProcessError:
+            raise DiffNotFoundError()
+        return output.decode('utf-8')
+
+    def has_commit(self, ref):
+        """ Check if the given commit is available in the mirror.
+        """
+        return self._read_object(f'{ref}^{{commit}}') is not None
+
+    def read_file(self, ref, file_path):
+        """ Return the content of a file in the given commit.
+
+        Returns
+        -------
+        str
+            Content of the file or an empty string if the file doesn't exist
+            in that commit.
+        """
+        content = self._read_object(f'{ref}:{file_path}')
+        return content.decode('utf-8') if content is not None else ''
+
+    def close(self):
+        """ Stop the cat-file process of the mirror.
+        """
+        with self._lock:
+            if self._cat_file is not None:
+                self._cat_file.stdin.close()
+                self._cat_file.wait()
+                self._cat_file = None
+
+    def _read_object(self, object_name):
+        with self._lock:
+            cat_file = self._get_cat_file()
+            cat_file.stdin.write(object_name.encode('utf-8') + b'\n')
+            cat_file.stdin.flush()
+            header = cat_file.stdout.readline().decode('utf-8').split()
+            # the name of a missing object is echoed back, and it may contain spaces
+            if not header or header[-1] in ('missing', 'ambiguous'):
+                return None
+            object_type, size = header[-2:]
+            content = cat_file.stdout.read(int(size))
+            cat_file.stdout.read(1)
+        return content if object_type in ('blob', 'commit') else None
+
+    def _get_cat_file(self):
+        if self._cat_file is None or self._cat_file.poll() is not None:
+            self._cat_file = subprocess.Popen(['git', '--git-dir', self.path, 'cat-file', '--batch'],
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return self._cat_file
+
+    def _git_env(self):
+        env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+        if self.oauth:
+            # the token is passed through the environment so it isn't shown in
+            # the list of processes nor stored in the configuration of the mirror
+            credentials = base64.b64encode(f'x-access-token:{self.oauth}'.encode('utf-8'))
+            env.update(GIT_CONFIG_COUNT='1', GIT_CONFIG_KEY_0='http.extraHeader',
+                       GIT_CONFIG_VALUE_0=f"Authorization: Basic {credentials.decode('utf-8')}")
+        return env
+
+    def _run_git(self, *args):
+        return subprocess.run(['git', '--git-dir', self.path, *args], env=self._git_env(),
+                              check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+
+
+class MirrorDiffParser():
+    """ Load the diff of a push from a local mirror.
+
+    Parameters
+    ----------
+    mirror : :obj:`GitMirror`
+        Mirror of the repository.
+    before_commit : str
+        Sha of the initial commit before the push.
+    after_commit : str
+        Sha of the final commit after the push.
+    """
+
+    def __init__(self, mirror, before_commit, after_commit):
+        self.mirror = mirror
+        self.before_commit = before_commit
+        self.after_commit = after_commit
+        self.patch = None
+
+    def load_diff(self, path_filter=None):
+        """ Fetch the push from the remote and parse the diff between both commits.
+
+        Parameters
+        ----------
+        path_filter : callable
+            Optional function that receives the path of each file in the diff
+            and returns False for the files that must be skipped.
+
+        Raises
+        ------
+        DiffNotFoundError
+            If the diff between both commits can't be computed.
+        """
+        with DIFF_FETCH_SECONDS.labels(backend='mirror').time():
+            try:
+                self.mirror.fetch()
+            except subprocess.CalledProcessError as err:
+                LOGGER.warning("Error fetching %s: %s", self.mirror.remote_url,
+                               err.stderr.decode('utf-8', 'replace'))
+            diff = self.mirror.diff(self.before_commit, self.after_commit)
+        DIFF_SIZE_BYTES.labels(backend='mirror').observe(len(diff.encode('utf-8')))
+        self.patch = parse_diff_stream(diff.splitlines(keepends=True), path_filter)
+
+
+class MirrorDataLoader():
+    """ Read the files of a push from a local mirror.
+
+    Parameters
+    ----------
+    mirror : :obj:`GitMirror`
+        Mirror of the repository.
+    before_ref : str
+        Sha of the initial commit before the push.
+    after_ref : str
+        Sha of the final commit after the push.
+    """
+
+    def __init__(self, mirror, before_ref, after_ref):
+        self.mirror = mirror
+        self.before_ref = before_ref
+        self.after_ref = after_ref
+        self._checked_refs = set()
+
+    def load_files(self, files_to_load):
+        """ Read the given files, returning them inside GitFile objects.
+
+        Parameters
+        ----------
+        files_to_load : list of :obj:`unidiff.PatchFile`
+            Iterable containing instances of patchfile objects.
+
+        Yields
+        -------
+        :obj:`GitFile`
+            Generator that returns one instance of the GitFile class for each file.
+        """
+        for patched_file in files_to_load:
+            yield GitFile(patched_file,
+                          self._load_file(patched_file.path, self.before_ref),
+                          self._load_file(patched_file.path, self.after_ref))
+
+    def _load_file(self, file_path, ref):
+        if ref not in self._checked_refs:
+            if not self.mirror.has_commit(ref):
+                err_msg = f"Commit {ref} was not found for repository '{self.mirror.remote_url}'."
+                raise InvalidCommitError(err_msg)
+            self._checked_refs.add(ref)
+        with span('MirrorDataLoader._load_file', path=file_path, ref=ref), \
+                FILE_DOWNLOAD_SECONDS.labels(backend='mirror').time():
+            return self.mirror.read_file(ref, file_path)
@@ -0,0 +1,171 @@
+""" Line-based RDF module
+
+Fast path for N-Triples and N-Quads files. These formats contain one triple
+per line, so the operations of a file are built from the lines added and
+removed in the diff instead of parsing and comparing both versions of it.
+"""
+
+import logging
+import re
+
+from collections import defaultdict
+
+from rdflib import ConjunctiveGraph, Graph
+
+from wbsync.synchronization import AdditionOperation, RemovalOperation
+from wbsync.triplestore import TripleInfo
+from wbsync.util.uri_constants import ASIO_BASE, OWL_BASE, RDF_BASE, RDFS_BASE, XSD_BASE
+
+LOGGER = logging.getLogger(__name__)
+
+# extension of each line-based format and name of its rdflib parser
+LINE_BASED_FORMATS = {
+    'nt': 'nt',
+    'nq': 'nquads'
+}
+
+OBJECT_PROPERTY = f'{OWL_BASE}ObjectProperty'
+DATATYPE_PROPERTY = f'{OWL_BASE}DatatypeProperty'
+PROPERTY_TYPES = (OBJECT_PROPERTY, DATATYPE_PROPERTY, f'{OWL_BASE}AnnotationProperty',
+                  f'{RDF_BASE}Property')
+
+PROPERTY_DECLARATION_RE = re.compile(
+    r'^\s*<([^>]+)>\s+<' + re.escape(f'{RDF_BASE}type') + r'>\s+<(' +
+    '|'.join(re.escape(uri) for uri in PROPERTY_TYPES) + r')>', re.MULTILINE)
+RANGE_DECLARATION_RE = re.compile(
+    r'^\s*<([^>]+)>\s+<' + re.escape(f'{RDFS_BASE}range') + r'>\s+<([^>]+)>', re.MULTILINE)
+
+# subject and rest of each line, found in C instead of splitting the content in lines
+LINE_RE = re.compile(r'^[ \t]*(\S+)([^\n]*\n?)', re.MULTILINE)
+URI_RE = re.compile(r'<[^>]+>')
+
+BLANK_NODE_PREFIX = '_:'
+
+def is_line_based(path):
+    """ Return whether the file at the given path uses a line-based RDF format.
+    """
+    return _get_format(path) is not None
+
+def compute_line_operations(git_file):
+    """ Return the synchronization operations of a line-based file from its diff.
+
+    Triples that are removed in one line and added again in another one, for
+    example when lines are moved, don't generate any operation. Neither do
+    triples that are still in another line of the file, such as duplicated
+    lines or the same triple in another graph of a N-Quads file, since every
+    graph is merged when the files are synchronized. Lines with blank nodes
+    can't be compared without the rest of the graph, so those files are left
+    to the full comparison.
+
+    Parameters
+    ----------
+    git_file : :obj:`GitFile`
+        N-Triples or N-Quads file modified by the push.
+
+    Returns
+    -------
+    list of :obj:`wbsync.synchronization.operations.SyncOperation`
+        Removal operations followed by the addition operations of the file,
+        or None if the file needs to be compared with the full graphs.
+    """
+    rdf_format = _get_format(git_file.path)
+    removed_lines = [value for value, _ in git_file.removed_lines]
+    added_lines = [value for value, _ in git_file.added_lines]
+    if any(BLANK_NODE_PREFIX in line for line in removed_lines + added_lines):
+        LOGGER.info("%s has changes with blank nodes. Comparing full graphs...", git_file.path)
+        return None
+
+    removed = _parse_triples(removed_lines, rdf_format)
+    added = _parse_triples(added_lines, rdf_format)
+    removed, added = removed - added, added - removed
+    # each version of the file is scanned once, keeping only the lines whose
+    # subject is one of the uris of the changed lines
+    contents = (git_file.source_content, git_file.target_content)
+    uris = {uri for line in removed_lines + added_lines for uri in URI_RE.findall(line)}
+    source_index, target_index = (_index_by_subject(content, uris) for content in contents)
+    removed -= _find_triples(removed, removed_lines, target_index, rdf_format)
+    added -= _find_triples(added, added_lines, source_index, rdf_format)
+    ops = [RemovalOperation(*TripleInfo.from_rdflib(triple).content) for triple in removed] + \
+          [AdditionOperation(*TripleInfo.from_rdflib(triple).content) for triple in added]
+    ops = [op for op in ops if None not in op._triple_info.content]
+    _annotate_properties(ops, contents, (source_index, target_index))
+    return ops
+
+def as_ntriples(path, content):
+    """ Return the content of a line-based file in a format readable as turtle.
+
+    N-Triples is a subset of turtle, so it is returned unchanged. The graph
+    names of N-Quads files are dropped, since Wikibase has no named graphs.
+    """
+    if _get_format(path) != 'nquads':
+        return content
+    graph = ConjunctiveGraph()
+    graph.parse(data=content, format='nquads')
+    merged = Graph()
+    for triple in graph.triples((None, None, None)):
+        merged.add(triple)
+    return merged.serialize(format='nt')
+
+def _get_format(path):
+    extension = path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+    return LINE_BASED_FORMATS.get(extension)
+
+def _parse_triples(lines, rdf_format):
+    if not lines:
+        return set()
+    graph = ConjunctiveGraph() if rdf_format == 'nquads' else Graph()
+    graph.parse(data=''.join(lines), format=rdf_format)
+    return set(graph.triples((None, None, None)))
+
+def _index_by_subject(content, subjects):
+    index = defaultdict(list)
+    for subject, rest in LINE_RE.findall(content):
+        if subject in subjects:
+            index[subject].append(subject + rest)
+    return index
+
+def _find_triples(triples, lines, index, rdf_format):
+    # only the lines of the content with the same subject as the given lines are parsed
+    if not triples:
+        return set()
+    subjects = {_get_subject(line) for line in lines}
+    candidates = [line for subject in subjects for line in index.get(subject, ())]
+    return triples & _parse_triples(candidates, rdf_format)
+
+def _get_subject(line):
+    parts = line.split(None, 1)
+    return parts[0] if parts else None
+
+def _annotate_properties(ops, contents, indexes):
+    # same annotations as the ontology synchronizer, read from the declarations of the file
+    uris = {element.uri for op in ops for element in op._triple_info if element.is_uri()}
+    declarations = _get_declarations(uris, indexes)
+    # object properties whose range is also a property point to properties
+    ranges = {f'<{prange}>' for ptype, prange in declarations.values()
+              if ptype == OBJECT_PROPERTY and prange is not None and prange not in uris}
+    if ranges:
+        range_indexes = [_index_by_subject(content, ranges) for content in contents]
+        declarations.update(_get_declarations({uri[1:-1] for uri in ranges}, range_indexes))
+
+    for op in ops:
+        for element in op._triple_info:
+            if not element.is_uri() or element.uri not in declarations:
+                continue
+            element.etype = 'property'
+            ptype, prange = declarations[element.uri]
+            if ptype == DATATYPE_PROPERTY:
+                element.proptype = prange or f'{XSD_BASE}string'
+            elif ptype == OBJECT_PROPERTY:
+                element.proptype = f'{ASIO_BASE}property' if prange in declarations \
+                    else f'{ASIO_BASE}item'
+
+def _get_declarations(uris, indexes):
+    # property type and range of each declared uri, taken from the first version that has them
+    lines = ''.join(line for index in indexes for uri in uris for line in index.get(f'<{uri}>', ()))
+    types = {}
+    ranges = {}
+    for uri, ptype in PROPERTY_DECLARATION_RE.findall(lines):
+        types.setdefault(uri, ptype)
+    for uri, prange in RANGE_DECLARATION_RE.findall(lines):
+        ranges.setdefault(uri, prange)
+    return {uri: (ptype, ranges.get(uri)) for uri, ptype in types.items()}
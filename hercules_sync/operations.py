@@ -0,0 +1,107 @@
+""" Operations execution module
+
+Execution of the synchronization operations of a job in Wikibase, either one
+edit per triple or one combined edit per entity.
+"""
+
+import logging
+import time
+
+from collections import OrderedDict
+
+from wbsync.synchronization import AdditionOperation, RemovalOperation
+from wbsync.synchronization.operations import BatchOperation
+
+from .metrics import OPERATIONS_GENERATED, WIKIBASE_WRITE_SECONDS
+from .tracing import span
+
+LOGGER = logging.getLogger(__name__)
+
+def operation_type(op):
+    """ Return the name of the type of an operation used in metrics and logs.
+    """
+    if isinstance(op, AdditionOperation):
+        return 'addition'
+    if isinstance(op, RemovalOperation):
+        return 'removal'
+    if isinstance(op, BatchOperation):
+        return 'batch'
+    return type(op).__name__
+
+def count_operations(ops):
+    """ Add the given operations to the metric of generated operations.
+    """
+    for op in ops:
+        OPERATIONS_GENERATED.labels(type=operation_type(op)).inc()
+
+def group_operations(ops):
+    """ Group the operations by the entity that they modify.
+
+    Parameters
+    ----------
+    ops : list of :obj:`BasicSyncOperation`
+        Operations to group.
+
+    Returns
+    -------
+    list of (:obj:`BatchOperation`, list of :obj:`BasicSyncOperation`)
+        List with a batch operation for each subject, in order of first
+        appearance, together with the operations merged into it.
+    """
+    groups = OrderedDict()
+    for op in ops:
+        subject = op._triple_info.subject
+        key = (type(subject), getattr(subject, 'etype', None), subject.uri)
+        groups.setdefault(key, []).append(op)
+    return [(BatchOperation(group[0]._triple_info.subject,
+                            [op._triple_info for op in group]), group)
+            for group in groups.values()]
+
+def execute_operations(ops, triple_store, batched=False):
+    """ Execute the operations in the given triple store.
+
+    When the operations are batched, the operations of each entity are applied
+    with a single edit and their result is shared by all of them. If that edit
+    fails, the operations of the entity are executed one by one, so the result
+    of each triple is still reported.
+
+    Parameters
+    ----------
+    ops : list of :obj:`BasicSyncOperation`
+        Operations to execute.
+    triple_store : :obj:`TripleStoreManager`
+        Triple store where the operations are executed.
+    batched : bool
+        Whether the operations are grouped into one edit per entity.
+
+    Returns
+    -------
+    list of (:obj:`BasicSyncOperation`, :obj:`ModificationResult`)
+        Result of each operation, in the order they were executed.
+    """
+    if not batched:
+        return [(op, _execute(op, triple_store)) for op in ops]
+
+    results = []
+    for batch, group in group_operations(ops):
+        if len(group) == 1:
+            results.append((group[0], _execute(group[0], triple_store)))
+            continue
+        res = _execute(batch, triple_store)
+        if res.successful:
+            results.extend((op, res) for op in group)
+            continue
+        LOGGER.warning("Batch edit of %s failed (%s). Applying its %d triples one by one...",
+                       batch.subject, res.message, len(group))
+        results.extend((op, _execute(op, triple_store)) for op in group)
+    return results
+
+def _execute(op, triple_store):
+    start = time.perf_counter()
+    with span('op.execute', type=operation_type(op), operation=str(op)) as current_span:
+        res = op.execute(triple_store)
+        if current_span is not None:
+            current_span.set_attribute('successful', res.successful)
+    WIKIBASE_WRITE_SECONDS.labels(type=operation_type(op), successful=str(res.successful).lower()) \
+        .observe(time.perf_counter() - start)
+    return res
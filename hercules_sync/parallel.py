@@ -0,0 +1,241 @@
+""" Parallel synchronization module
+
+Pool of worker processes where the RDF files of a push are parsed and diffed,
+so the operations of a multi-file push are computed using several cores.
+"""
+
+import logging
+import multiprocessing
+import sys
+import time
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .graphs import DEFAULT_ALGORITHM, DIFF_ALGORITHMS, GraphCache, parse_graph, \
+                    synchronize_graphs
+from .metrics import PARSE_DIFF_SECONDS
+from .ntriples import as_ntriples, compute_line_operations, is_line_based
+from .tracing import record_span, span
+
+LOGGER = logging.getLogger(__name__)
+
+# modules imported once by the forkserver, so new workers start with them loaded
+PRELOADED_MODULES = ['rdflib', 'ontospy', 'wbsync.synchronization', 'hercules_sync.graphs']
+
+def compute_operations(source_content, target_content, source_graph=None,
+                       algorithm=DEFAULT_ALGORITHM):
+    """ Return the synchronization operations between two versions of a file.
+
+    Parameters
+    ----------
+    source_content : str
+        Content of the file before the push.
+    target_content : str
+        Content of the file after the push.
+    source_graph : :obj:`rdflib.Graph`
+        Graph already parsed from the source content. If it is given the
+        source content is not parsed again.
+    algorithm : str
+        Name of the algorithm used to compare both graphs: 'graphdiff' or
+        'hashed'.
+
+    Returns
+    -------
+    list of :obj:`wbsync.synchronization.operations.SyncOperation`
+        Operations needed to synchronize the changes of the file.
+    """
+    ops, _, _ = _timed_compute_operations(source_content, target_content, source_graph,
+                                          algorithm)
+    return ops
+
+def _timed_compute_operations(source_content, target_content, source_graph=None,
+                              algorithm=DEFAULT_ALGORITHM, keep_graph=False):
+    # metrics of the worker processes are lost, so the time is sent back to the parent
+    start = time.perf_counter()
+    if source_graph is None:
+        source_graph = parse_graph(source_content)
+    target_graph = parse_graph(target_content)
+    ops = synchronize_graphs(source_graph, target_graph, algorithm)
+    return ops, target_graph if keep_graph else None, time.perf_counter() - start
+
+# graph cache of a worker process, see _compute_in_worker
+_WORKER_CACHE = None
+
+def _compute_in_worker(repository, path, source_content, target_content, algorithm,
+                       cache_settings):
+    # run by the worker processes, which keep the graphs of the files routed to them,
+    # so graphs are never sent between processes
+    graph_cache = _get_worker_cache(cache_settings)
+    source_graph = graph_cache.get(repository, path, source_content) \
+        if graph_cache is not None else None
+    ops, target_graph, elapsed = _timed_compute_operations(source_content, target_content,
+                                                           source_graph, algorithm,
+                                                           graph_cache is not None)
+    if graph_cache is not None:
+        graph_cache.put(repository, path, target_content, target_graph)
+    return ops, source_graph is not None, elapsed
+
+def _get_worker_cache(cache_settings):
+    global _WORKER_CACHE
+    if cache_settings is None:
+        return None
+    if _WORKER_CACHE is None:
+        max_size, cache_dir = cache_settings
+        _WORKER_CACHE = GraphCache(max_size, cache_dir)
+    return _WORKER_CACHE
+
+class SyncProcessPool():
+    """ Pool of processes that compute the synchronization operations of each file.
+
+    Each file is processed as a separate task and the operations are returned
+    to the parent process in the same order as the files. When the pool is
+    disabled the operations are computed in the current process. The
+    operations of N-Triples and N-Quads files are built from their diff lines
+    in the current process.
+
+    When a graph cache is given, the source graph of each file is taken from
+    it if it holds the graph of that same content, and the target graph is
+    stored in it for the next push. Parsed graphs are as expensive to send
+    between processes as to parse again, so when the pool is enabled each
+    worker keeps a cache with the same settings, and each file of a
+    repository is always sent to the same worker.
+
+    Parameters
+    ----------
+    processes : int
+        Number of worker processes. Zero disables the pool.
+    graph_cache : :obj:`GraphCache`
+        Optional cache of the last graph synchronized for each file.
+    """
+
+    def __init__(self, processes=0, graph_cache=None):
+        self.processes = processes
+        self.graph_cache = graph_cache
+        self._executors = []
+
+    def compute_operations(self, files, repository=None, algorithm=DEFAULT_ALGORITHM):
+        """ Compute the synchronization operations of the given files.
+
+        Parameters
+        ----------
+        files : list of :obj:`GitFile`
+            Files modified by the push.
+        repository : str
+            Full name of the repository of the files. The graph cache is only
+            used when it is given.
+        algorithm : str
+            Name of the algorithm used to compare the graphs of each file:
+            'graphdiff' or 'hashed'.
+
+        Returns
+        -------
+        list of :obj:`wbsync.synchronization.operations.SyncOperation`
+            Operations of every file, in the same order as the files.
+        """
+        if algorithm not in DIFF_ALGORITHMS:
+            raise ValueError(f"Unknown synchronization algorithm: {algorithm}")
+        file_ops = [None] * len(files)
+        contents = []
+        for index, file in enumerate(files):
+            source, target = file.source_content, file.target_content
+            if is_line_based(file.path):
+                file_ops[index] = self._compute_from_lines(file)
+                if file_ops[index] is not None:
+                    continue
+                source, target = as_ntriples(file.path, source), as_ntriples(file.path, target)
+            contents.append((index, file.path, source, target))
+
+        use_cache = self.graph_cache is not None and repository is not None
+        if self.processes <= 0 or (len(contents) <= 1 and not use_cache):
+            self._compute_in_process(contents, file_ops, repository, algorithm)
+        else:
+            self._compute_in_pool(contents, file_ops, repository, algorithm)
+        return [op for ops in file_ops for op in ops]
+
+    def start(self):
+        """ Start the worker processes in advance.
+        """
+        for executor in self._get_executors():
+            executor.submit(int).result()
+
+    def shutdown(self):
+        """ Stop the worker processes.
+        """
+        for executor in self._executors:
+            executor.shutdown(wait=False)
+        self._executors = []
+
+    def _compute_from_lines(self, file):
+        with span('compute_line_operations', path=file.path) as current_span, \
+                PARSE_DIFF_SECONDS.time():
+            ops = compute_line_operations(file)
+        if current_span is not None and ops is not None:
+            current_span.set_attribute('operations', len(ops))
+        return ops
+
+    def _compute_in_pool(self, contents, file_ops, repository, algorithm):
+        use_cache = self.graph_cache is not None and repository is not None
+        cache_settings = (self.graph_cache.max_size, self.graph_cache.cache_dir) \
+            if use_cache else None
+        try:
+            futures = [self._select_executor(position, repository if use_cache else None, path)
+                       .submit(_compute_in_worker, repository, path, source, target, algorithm,
+                               cache_settings)
+                       for position, (_, path, source, target) in enumerate(contents)]
+            results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            LOGGER.exception("Process pool is broken. Computing operations in this process...")
+            self.shutdown()
+            self._compute_in_process(contents, file_ops, repository, algorithm)
+            return
+
+        for (index, path, _, _), (ops, cached_source, elapsed) in zip(contents, results):
+            PARSE_DIFF_SECONDS.observe(elapsed)
+            record_span('OntologySynchronizer.synchronize', elapsed, path=path,
+                        operations=len(ops), cached_source=cached_source, algorithm=algorithm)
+            file_ops[index] = ops
+
+    def _compute_in_process(self, contents, file_ops, repository, algorithm):
+        use_cache = self.graph_cache is not None and repository is not None
+        for index, path, source, target in contents:
+            source_graph = self.graph_cache.get(repository, path, source) if use_cache else None
+            with span('OntologySynchronizer.synchronize', path=path, algorithm=algorithm,
+                      cached_source=source_graph is not None) as current_span, \
+                    PARSE_DIFF_SECONDS.time():
+                ops, target_graph, _ = _timed_compute_operations(source, target, source_graph,
+                                                                 algorithm, use_cache)
+            if current_span is not None:
+                current_span.set_attribute('operations', len(ops))
+            if use_cache:
+                self.graph_cache.put(repository, path, target, target_graph)
+            file_ops[index] = ops
+
+    def _select_executor(self, position, repository, path):
+        executors = self._get_executors()
+        if repository is None:
+            return executors[position % len(executors)]
+        # each file always goes to the worker that keeps its graphs
+        key = f'{repository}\0{path}'.encode('utf-8')
+        return executors[zlib.crc32(key) % len(executors)]
+
+    def _get_executors(self):
+        # one executor per worker, so each file can be sent to a given worker
+        if not self._executors and self.processes > 0:
+            self._executors = [_create_executor() for _ in range(self.processes)]
+        return self._executors
+
+
+def _create_executor():
+    if sys.version_info < (3, 7):
+        # the start method can't be chosen before Python 3.7, so workers are forked
+        return ProcessPoolExecutor(max_workers=1)
+    return ProcessPoolExecutor(max_workers=1, mp_context=_get_mp_context())
+
+def _get_mp_context():
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(PRELOADED_MODULES)
+    return context
@@ -0,0 +1,182 @@
+""" Synchronization rules module
+
+Rules decide which pushes and which files of a repository are synchronized.
+They are evaluated against the information that is already available in the
+push payload and in the diff, so irrelevant pushes and files are discarded
+before any content is downloaded from GitHub.
+"""
+
+import posixpath
+
+from fnmatch import fnmatchcase
+
+from wbsync.util.error import InvalidConfigError
+
+# GitHub only includes up to 20 commits in the payload of a push event
+MAX_PAYLOAD_COMMITS = 20
+
+BRANCH_PREFIX = 'refs/heads/'
+REF_PREFIX = 'refs/'
+
+class SyncRule():
+    """ Declarative rule describing the files to synchronize from a repository.
+
+    Parameters
+    ----------
+    repository : str
+        Glob pattern matched against the full name of the repository
+        (e.g. 'user_name/repo_name'). By default the rule applies to every
+        repository.
+    refs : list of str
+        Glob patterns matched against the ref of the push. Patterns that don't
+        start with 'refs/' are treated as branch names. By default every ref
+        is accepted.
+    paths : list of str
+        Glob patterns matched against the path of each file.
+    formats : list of str
+        File extensions (without the dot) that will be synchronized. By default
+        every extension is accepted.
+    """
+
+    def __init__(self, repository='*', refs=None, paths=None, formats=None):
+        self.repository = repository
+        self.refs = [_normalize_ref(ref) for ref in refs] if refs is not None else None
+        self.paths = paths if paths is not None else ['*']
+        self.formats = {fmt.lstrip('.').lower() for fmt in formats} \
+            if formats is not None else None
+
+    @classmethod
+    def from_dict(cls, rule_data):
+        """ Create a rule from its dictionary representation.
+
+        Parameters
+        ----------
+        rule_data : dict
+            Dictionary with the optional keys 'repository', 'refs', 'paths'
+            and 'formats'.
+
+        Returns
+        -------
+        :obj:`SyncRule`
+            Rule equivalent to the given dictionary.
+
+        Raises
+        ------
+        InvalidConfigError
+            If the dictionary contains unknown keys.
+        """
+        valid_keys = {'repository', 'refs', 'paths', 'formats'}
+        unknown_keys = set(rule_data) - valid_keys
+        if unknown_keys:
+            raise InvalidConfigError(f"Unknown keys in synchronization rule: {unknown_keys}")
+        return cls(**rule_data)
+
+    def applies_to(self, repo_name, ref):
+        """ Check if the rule must be used with the given repository and ref.
+        """
+        if not fnmatchcase(repo_name, self.repository):
+            return False
+        if self.refs is None or ref is None:
+            return True
+        return any(fnmatchcase(ref, pattern) for pattern in self.refs)
+
+    def matches_path(self, path):
+        """ Check if a file path is selected by this rule.
+        """
+        if self.formats is not None:
+            extension = posixpath.splitext(path)[1].lstrip('.').lower()
+            if extension not in self.formats:
+                return False
+        return any(fnmatchcase(path, pattern) for pattern in self.paths)
+
+
+class RuleSet():
+    """ Collection of synchronization rules.
+
+    A push is synchronized when at least one of the rules applies to its
+    repository and ref and, whenever the payload lets us know it, when at least
+    one of its files is selected by those rules.
+
+    Parameters
+    ----------
+    rules : list of :obj:`SyncRule`
+        Rules that compose the set.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    @classmethod
+    def from_config(cls, rules_config):
+        """ Create a rule set from a list of rule dictionaries.
+
+        Parameters
+        ----------
+        rules_config : list of dict
+            Configuration of each rule, as accepted by :meth:`SyncRule.from_dict`.
+
+        Returns
+        -------
+        :obj:`RuleSet`
+            RuleSet with the rules from the configuration.
+        """
+        return cls([SyncRule.from_dict(rule_data) for rule_data in rules_config])
+
+    def matches_push(self, data):
+        """ Check if a push event needs to be synchronized.
+
+        Parameters
+        ----------
+        data : dict
+            Data obtained from a GitHub WebHook regarding a push event.
+
+        Returns
+        -------
+        bool
+            False if it is known from the payload alone that none of the
+            files of the push will be synchronized, True otherwise.
+        """
+        rules = self._rules_for(data)
+        if not rules:
+            return False
+
+        paths = _extract_payload_paths(data)
+        if paths is None:
+            return True
+        return any(rule.matches_path(path) for rule in rules for path in paths)
+
+    def path_filter(self, data):
+        """ Return a function to select the files of a push that will be synchronized.
+
+        Parameters
+        ----------
+        data : dict
+            Data obtained from a GitHub WebHook regarding a push event.
+
+        Returns
+        -------
+        callable
+            Function that receives the path of a file and returns True if the
+            file must be synchronized.
+        """
+        rules = self._rules_for(data)
+        return lambda path: any(rule.matches_path(path) for rule in rules)
+
+    def _rules_for(self, data):
+        repo_name = data.get('repository', {}).get('full_name', '')
+        ref = data.get('ref')
+        return [rule for rule in self.rules if rule.applies_to(repo_name, ref)]
+
+
+def _extract_payload_paths(data):
+    commits = data.get('commits')
+    if not commits or data.get('forced') or len(commits) >= MAX_PAYLOAD_COMMITS:
+        # the list of commits may not contain every file of the diff
+        return None
+    return {path
+            for commit in commits
+            for key in ('added', 'modified', 'removed')
+            for path in commit.get(key, [])}
+
+def _normalize_ref(ref):
+    return ref if ref.startswith(REF_PREFIX) else BRANCH_PREFIX + ref
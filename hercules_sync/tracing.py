@@ -0,0 +1,317 @@
+""" Tracing module
+
+Lightweight tracing of the synchronization of each push. Spans are nested
+using context variables, and each finished trace is exported as a single
+structured JSON line to the log or to a file using the OTLP JSON format.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _ThreadLocalVar():
+    """ Replacement of ContextVar for Python 3.6, which keeps a value per thread.
+    """
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self._default = default
+        self._local = threading.local()
+
+    def get(self):
+        return getattr(self._local, 'value', self._default)
+
+    def set(self, value):
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        self._local.value = token
+
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = _ThreadLocalVar
+
+_CURRENT_SPAN = ContextVar('hercules_current_span', default=None)
+
+class Span():
+    """ Timed operation inside a trace.
+
+    Parameters
+    ----------
+    name : str
+        Name of the operation.
+    attributes : dict
+        Attributes that describe the operation.
+    parent : :obj:`Span`
+        Parent span, or None for the root span of a trace.
+    """
+
+    def __init__(self, name, attributes=None, parent=None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = int(time.time() * 1e9)
+        self.end_ns = None
+        self.error = None
+        self.children = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        if parent is not None:
+            parent._add_child(self)
+
+    @property
+    def duration(self):
+        """ Duration of the span in seconds, or None if it hasn't finished.
+        """
+        return (self.end_ns - self.start_ns) / 1e9 if self.end_ns is not None else None
+
+    def set_attribute(self, key, value):
+        """ Add an attribute to the span.
+        """
+        self.attributes[key] = value
+
+    def finish(self, duration=None):
+        """ Mark the span as finished.
+
+        Parameters
+        ----------
+        duration : float
+            Duration of the span in seconds. By default the time elapsed since
+            the span was created is used.
+        """
+        if duration is None:
+            duration = time.perf_counter() - self._start
+        self.end_ns = self.start_ns + int(duration * 1e9)
+
+    def to_dict(self):
+        """ Return the span and its children as a JSON serializable dict.
+
+        Start times of the children are given in milliseconds relative to the
+        start of this span.
+        """
+        return self._to_dict(self.start_ns)
+
+    def iter_spans(self):
+        """ Iterate over this span and all its descendants.
+        """
+        yield self
+        for child in self._get_children():
+            yield from child.iter_spans()
+
+    def _add_child(self, child):
+        with self._lock:
+            self.children.append(child)
+
+    def _get_children(self):
+        with self._lock:
+            return list(self.children)
+
+    def _to_dict(self, origin_ns):
+        rval = {
+            'name': self.name,
+            'start_ms': round((self.start_ns - origin_ns) / 1e6, 3),
+            'duration_ms': round(self.duration * 1e3, 3) if self.end_ns is not None else None
+        }
+        if self.attributes:
+            rval['attributes'] = self.attributes
+        if self.error:
+            rval['error'] = self.error
+        children = self._get_children()
+        if children:
+            rval['children'] = [child._to_dict(origin_ns) for child in children]
+        return rval
+
+
+class LogExporter():
+    """ Export each trace as one JSON line in the log.
+    """
+
+    def export(self, root):
+        record = {'trace_id': root.trace_id}
+        record.update(root.to_dict())
+        LOGGER.info(json.dumps(record, default=str))
+
+
+class FileExporter():
+    """ Append each trace to a file, as one line in the OTLP JSON format.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+    service_name : str
+        Name of the service reported in the resource of the traces.
+    """
+
+    def __init__(self, path, service_name='hercules-sync'):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def export(self, root):
+        request = {
+            'resourceSpans': [{
+                'resource': {'attributes': _otlp_attributes({'service.name': self.service_name})},
+                'scopeSpans': [{
+                    'scope': {'name': __name__},
+                    'spans': [_otlp_span(span) for span in root.iter_spans()]
+                }]
+            }]
+        }
+        line = json.dumps(request, default=str)
+        with self._lock, open(self.path, 'a') as trace_file:
+            trace_file.write(line + '\n')
+
+
+class NullExporter():
+    """ Discard every trace.
+    """
+
+    def export(self, root):
+        pass
+
+
+_EXPORTER = LogExporter()
+
+def configure_tracing(export='log', path=None):
+    """ Select where the traces are exported.
+
+    Parameters
+    ----------
+    export : str
+        'log' to write each trace in the log, 'file' to append it to a file in
+        the OTLP JSON format or 'none' to disable tracing.
+    path : str
+        Path of the file used by the 'file' exporter.
+    """
+    global _EXPORTER
+    if export == 'file':
+        _EXPORTER = FileExporter(path)
+    elif export == 'none':
+        _EXPORTER = NullExporter()
+    else:
+        _EXPORTER = LogExporter()
+
+@contextmanager
+def trace(name, **attributes):
+    """ Start a new trace, which is exported when the block finishes.
+
+    Yields
+    ------
+    :obj:`Span`
+        Root span of the trace.
+    """
+    if isinstance(_EXPORTER, NullExporter):
+        yield None
+        return
+    root = Span(name, attributes)
+    token = _CURRENT_SPAN.set(root)
+    try:
+        yield root
+    except Exception as excpt:
+        root.error = repr(excpt)
+        raise
+    finally:
+        root.finish()
+        _CURRENT_SPAN.reset(token)
+        try:
+            _EXPORTER.export(root)
+        except Exception:
+            LOGGER.warning("Trace %s could not be exported.", root.trace_id, exc_info=True)
+
+@contextmanager
+def span(name, **attributes):
+    """ Time the block as a child of the current span.
+
+    Nothing is recorded when there is no active trace.
+
+    Yields
+    ------
+    :obj:`Span`
+        New span, or None if there is no active trace.
+    """
+    parent = _CURRENT_SPAN.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, attributes, parent)
+    token = _CURRENT_SPAN.set(child)
+    try:
+        yield child
+    except Exception as excpt:
+        child.error = repr(excpt)
+        raise
+    finally:
+        child.finish()
+        _CURRENT_SPAN.reset(token)
+
+def bind_span(function):
+    """ Return a function that runs the given one as part of the current span.
+
+    It is used for the tasks submitted to thread pools, whose threads don't
+    share the context of the thread that submits them, so the spans of the
+    tasks are nested inside the current span.
+    """
+    parent = _CURRENT_SPAN.get()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = _CURRENT_SPAN.set(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _CURRENT_SPAN.reset(token)
+    return wrapper
+
+def record_span(name, duration, **attributes):
+    """ Add a finished span with a known duration to the current span.
+
+    This is used for work done outside of this process, such as the tasks run
+    by a process pool.
+    """
+    parent = _CURRENT_SPAN.get()
+    if parent is None:
+        return
+    Span(name, attributes, parent).finish(duration)
+
+def _otlp_attributes(attributes):
+    values = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            values.append({'key': key, 'value': {'boolValue': value}})
+        elif isinstance(value, int):
+            values.append({'key': key, 'value': {'intValue': str(value)}})
+        elif isinstance(value, float):
+            values.append({'key': key, 'value': {'doubleValue': value}})
+        else:
+            values.append({'key': key, 'value': {'stringValue': str(value)}})
+    return values
+
+def _otlp_span(span):
+    rval = {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'name': span.name,
+        'kind': 1,
+        'startTimeUnixNano': str(span.start_ns),
+        'endTimeUnixNano': str(span.end_ns if span.end_ns is not None else span.start_ns),
+        'attributes': _otlp_attributes(span.attributes),
+        'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+    }
+    if span.parent is not None:
+        rval['parentSpanId'] = span.parent.span_id
+    return rval
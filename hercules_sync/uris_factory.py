@@ -1,78 +1,212 @@
 import requests
 import json
 import logging
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from wbsync.external import URIFactory
 
-from config import _try_get_config_from_env
+from .cache import TTLCache
+from .metrics import URIS_FACTORY_CALLS, URIS_FACTORY_REQUEST_SECONDS
+from .tracing import bind_span, span
+from .uris_store import URIMappingStore
 
 LOGGER = logging.getLogger(__name__)
-URIS_FACTORY = _try_get_config_from_env('URIS_FACTORY')
-WBAPI = _try_get_config_from_env('WBAPI').split("w/api.php")[0]
+# urls of the factory and of the target wikibase, see configure_uris_factory
+URIS_FACTORY = None
+WBAPI = None
+# shared session, so connections to the factory are kept alive between calls
+SESSION = requests.Session()
+
+_MISSING = object()
 
 class HerculesURIsFactory(URIFactory):
+    """ Client of the Hercules URIs factory.
+
+    Canonical and local uris returned by the factory are kept in memory, as
+    well as the uris that don't have a local uri yet, which are stored for a
+    shorter time.
+
+    Parameters
+    ----------
+    canonical_cache : :obj:`TTLCache`
+        Cache of the canonical uris. By default a cache shared by every
+        factory is used.
+    local_cache : :obj:`TTLCache`
+        Cache of the local uris. By default a cache shared by every factory
+        is used.
+    negative_ttl : float
+        Time in seconds that a missing local uri is kept in the cache. By
+        default the shared setting is used.
+    store : :obj:`URIMappingStore`
+        Persistent store where the local uris are written through. By default
+        the shared store is used, if any.
+    writer : :obj:`URIWriteBehind`
+        Queue used to send the new local uris to the factory in the
+        background. By default the shared writer is used, if any, and new
+        uris are sent synchronously otherwise.
+
+    See :func:`configure_uris_factory` for the objects shared by every factory.
+    """
+
+    def __init__(self, canonical_cache=None, local_cache=None, negative_ttl=None,
+                 store=_MISSING, writer=_MISSING):
+        shared = _get_shared()
+        self.canonical_cache = canonical_cache if canonical_cache is not None \
+            else shared['canonical_cache']
+        self.local_cache = local_cache if local_cache is not None else shared['local_cache']
+        self.negative_ttl = negative_ttl if negative_ttl is not None else shared['negative_ttl']
+        self.store = store if store is not _MISSING else shared['store']
+        self.writer = writer if writer is not _MISSING else shared['writer']
 
     def get_uri(self, uriref) -> str:
         uri = self.get_element(uriref.uri)
-        criteria = "entity"
-        idSplit = "Item:"
-        canonicalParams = {'domain': 'hercules.org', 'lang': 'es-ES', 'subDomain': 'um', 'type': 'res'}
-        body = '{"@class": "'+uri+'","canonicalClassName": "'+uri+'" }'
-        if(uriref.etype=='property'):
-            criteria = "property"
-            idSplit = "Property:"
-            body = '{"property": "' + uri + '","canonicalProperty": "' + uri + '" }'
-
-        canonicalResponse = requests.post(URIS_FACTORY+"uri-factory/canonical/" + criteria,
-                                          params=canonicalParams,
-                                          headers={'Content-type': 'application/json', 'Accept': '*/*'},
-                                          data=body).content
+        localUri = self.local_cache.get((uriref.etype, uri), _MISSING)
+        if localUri is not _MISSING:
+            URIS_FACTORY_CALLS.labels(method='get_uri', cache='hit').inc()
+            return localUri
+        URIS_FACTORY_CALLS.labels(method='get_uri', cache='miss').inc()
+        with span('HerculesURIsFactory.get_uri', uri=uri, etype=uriref.etype):
+            return self._fetch_local_uri(uri, uriref.etype)
 
-        canonicalResponseObj = json.loads(canonicalResponse)
+    def _fetch_local_uri(self, uri, etype):
+        local_key = (etype, uri)
+        idSplit = "Property:" if etype == 'property' else "Item:"
+        canonicalResponseObj = self._get_canonical(uri, etype)
         canonicalUri = canonicalResponseObj["canonicalURI"]
         language = canonicalResponseObj["language"]
 
         localParams = {'canonicalUri': canonicalUri, 'languageCode': language, 'storageName': 'wikibase'}
-        localResponse = requests.get(URIS_FACTORY+"uri-factory/local/canonical", params=localParams).content
+        with URIS_FACTORY_REQUEST_SECONDS.labels(endpoint='local/canonical').time():
+            localResponse = SESSION.get(URIS_FACTORY+"uri-factory/local/canonical", params=localParams).content
         localResponseObj = json.loads(localResponse)
 
 
         if (len(localResponseObj) == 0):
             LOGGER.info("Local uri not found for: " + uri)
+            self.local_cache.set(local_key, None, ttl=self.negative_ttl)
+            if self.store is not None:
+                self.store.delete(etype, uri)
             return None
 
 
         localUri = localResponseObj[0]["localUri"].split(idSplit)[1]
         LOGGER.info("Local uri found for: " + uri + ": " +localUri)
+        self._save_local_uri(uri, etype, localUri)
         return localUri
 
 
     def post_uri(self, uriref, wb_uri) -> None:
         uri = self.get_element(uriref.uri)
         LOGGER.info("Creating a new local uri for: " + uri)
-        criteria = "entity"
-        idSplit = "Item:"
-        canonicalParams = {'domain': 'hercules.org', 'lang': 'es-ES', 'subDomain': 'um', 'type': 'res'}
-        body = '{"@class": "' + uri + '","canonicalClassName": "' + uri + '" }'
-        if (uriref.etype == 'property'):
-            criteria = "property"
-            idSplit = "Property:"
-            body = '{"property": "' + uri + '","canonicalProperty": "' + uri + '" }'
+        URIS_FACTORY_CALLS.labels(method='post_uri', cache='write').inc()
+        if self.writer is not None:
+            # the mapping is visible right away, and sent later in the background
+            self.local_cache.set((uriref.etype, uri), wb_uri)
+            self.writer.submit(self, uri, uriref.etype, wb_uri)
+            return wb_uri
 
-        canonicalResponse = requests.post(URIS_FACTORY + "uri-factory/canonical/" + criteria,
-                                          params=canonicalParams,
-                                          headers={'Content-type': 'application/json', 'Accept': '*/*'},
-                                          data=body).content
+        with span('HerculesURIsFactory.post_uri', uri=uri, etype=uriref.etype):
+            self._send_local_uri(uri, uriref.etype, wb_uri)
+        LOGGER.info("Created a new local uri found for: " + uri )
+        return wb_uri
 
-        canonicalResponseObj = json.loads(canonicalResponse)
-        canonicalLanguageURI = canonicalResponseObj["canonicalLanguageURI"]
+    def flush(self, timeout=None) -> bool:
+        """ Wait until every new local uri posted by this factory has been sent.
 
-        localParams = {'canonicalLanguageURI': canonicalLanguageURI, 'localURI': WBAPI+'wiki/'+idSplit+wb_uri,
-                       'storageName': 'wikibase'}
+        Parameters
+        ----------
+        timeout : float
+            Maximum time in seconds to wait. By default it waits until every
+            pending uri is sent or discarded after exhausting its retries.
 
-        requests.post(URIS_FACTORY+"uri-factory/local", params=localParams).content
-        LOGGER.info("Created a new local uri found for: " + uri )
-        return wb_uri
+        Returns
+        -------
+        bool
+            True if every pending uri of this factory was sent successfully.
+        """
+        if self.writer is None:
+            return True
+        return self.writer.flush(timeout, factory=self)
+
+    def resolve_all(self, urirefs, max_workers=8) -> int:
+        """ Resolve a set of uris up front with bounded concurrency.
+
+        The results are stored in the cache of local uris, so the calls to
+        get_uri made afterwards for the same uris are answered from memory.
+        Errors are logged and the affected uris will be resolved again when
+        get_uri is called for them.
+
+        Parameters
+        ----------
+        urirefs : iterable of :obj:`URIElement`
+            Elements whose local uris will be resolved.
+        max_workers : int
+            Maximum number of concurrent requests sent to the factory.
+
+        Returns
+        -------
+        int
+            Number of uris that already have a local uri.
+        """
+        unique_urirefs = {}
+        for uriref in urirefs:
+            unique_urirefs.setdefault((uriref.etype, self.get_element(uriref.uri)), uriref)
+        if not unique_urirefs:
+            return 0
 
+        LOGGER.info("Resolving %d uris from the factory...", len(unique_urirefs))
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [executor.submit(bind_span(self._try_get_uri), uriref)
+                       for uriref in unique_urirefs.values()]
+            local_uris = [future.result() for future in futures]
+        return sum(1 for local_uri in local_uris if local_uri is not None)
+
+    def warm_up(self) -> int:
+        """ Load the local uris of the persistent store into the cache.
+
+        Returns
+        -------
+        int
+            Number of uris loaded.
+        """
+        if self.store is None:
+            return 0
+        mappings = self.store.load()
+        for etype, uri, local_uri in mappings:
+            self.local_cache.set((etype, uri), local_uri)
+        LOGGER.info("Loaded %d uris from the persistent store.", len(mappings))
+        return len(mappings)
+
+    def revalidate(self):
+        """ Query the factory again for every uri of the persistent store.
+
+        Uris whose local uri changed are updated in the cache and in the store,
+        and those that don't exist anymore in the factory are removed.
+        """
+        if self.store is None:
+            return
+        for etype, uri, _ in self.store.load():
+            try:
+                self._fetch_local_uri(uri, etype)
+            except Exception:
+                LOGGER.warning("Uri %s could not be revalidated.", uri, exc_info=True)
+
+    def cache_stats(self):
+        """ Return the hits and misses of the caches used by the factory.
+
+        Returns
+        -------
+        dict
+            Dictionary with the stats of the 'canonical' and 'local' caches.
+        """
+        return {
+            'canonical': self.canonical_cache.stats(),
+            'local': self.local_cache.stats()
+        }
 
     def get_element(self,uri:str) -> str:
         separator = uri.split("#")
@@ -82,3 +216,292 @@ class HerculesURIsFactory(URIFactory):
            separator = uri.split("/")
            return separator[len(separator) - 1]
 
+    def _send_local_uri(self, uri, etype, wb_uri):
+        idSplit = "Property:" if etype == 'property' else "Item:"
+        canonicalResponseObj = self._get_canonical(uri, etype)
+        canonicalLanguageURI = canonicalResponseObj["canonicalLanguageURI"]
+
+        localParams = {'canonicalLanguageURI': canonicalLanguageURI, 'localURI': WBAPI+'wiki/'+idSplit+wb_uri,
+                       'storageName': 'wikibase'}
+
+        with URIS_FACTORY_REQUEST_SECONDS.labels(endpoint='local').time():
+            response = SESSION.post(URIS_FACTORY+"uri-factory/local", params=localParams)
+            response.content
+        self._save_local_uri(uri, etype, wb_uri)
+        return response
+
+    def _save_local_uri(self, uri, etype, local_uri):
+        self.local_cache.set((etype, uri), local_uri)
+        if self.store is not None:
+            self.store.save(etype, uri, local_uri)
+
+    def _try_get_uri(self, uriref):
+        try:
+            return self.get_uri(uriref)
+        except Exception:
+            LOGGER.warning("Uri %s could not be resolved in advance.", uriref.uri, exc_info=True)
+            return None
+
+    def _get_canonical(self, uri, etype):
+        canonical_key = (etype, uri)
+        canonicalResponseObj = self.canonical_cache.get(canonical_key)
+        if canonicalResponseObj is not None:
+            URIS_FACTORY_CALLS.labels(method='canonical', cache='hit').inc()
+            return canonicalResponseObj
+        URIS_FACTORY_CALLS.labels(method='canonical', cache='miss').inc()
+
+        criteria = "entity"
+        canonicalParams = {'domain': 'hercules.org', 'lang': 'es-ES', 'subDomain': 'um', 'type': 'res'}
+        body = '{"@class": "'+uri+'","canonicalClassName": "'+uri+'" }'
+        if(etype=='property'):
+            criteria = "property"
+            body = '{"property": "' + uri + '","canonicalProperty": "' + uri + '" }'
+
+        with URIS_FACTORY_REQUEST_SECONDS.labels(endpoint='canonical').time():
+            canonicalResponse = SESSION.post(URIS_FACTORY+"uri-factory/canonical/" + criteria,
+                                             params=canonicalParams,
+                                             headers={'Content-type': 'application/json', 'Accept': '*/*'},
+                                             data=body).content
+
+        canonicalResponseObj = json.loads(canonicalResponse)
+        self.canonical_cache.set(canonical_key, canonicalResponseObj)
+        return canonicalResponseObj
+
+class URIWriteBehind():
+    """ Background queue that sends new local uris to the factory.
+
+    Pending uris are sent by a daemon thread, which takes them in groups once
+    a group is full or the interval has passed since the first pending uri.
+    The factory has no bulk endpoint, so each uri of a group is still sent
+    with its own request over the shared session. Uris that can't be sent are
+    queued again until they exhaust their retries.
+
+    The writer is shared by every factory, so the uris and failures of each
+    factory are tracked separately, and a factory only waits for its own uris
+    when it is flushed.
+
+    Parameters
+    ----------
+    batch_size : int
+        Maximum number of uris taken from the queue in each group.
+    interval : float
+        Maximum time in seconds that a uri waits before its group is sent.
+    retries : int
+        Number of times that a failed uri is sent again.
+    backoff : float
+        Time in seconds to wait before retrying the failed uris of a group.
+    """
+
+    def __init__(self, batch_size=50, interval=0.5, retries=3, backoff=1.0):
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.retries = retries
+        self.backoff = backoff
+        self.sent = 0
+        self.failed = 0
+        self._pending = deque()
+        self._in_flight = 0
+        # uris not sent nor discarded yet, and uris discarded since the last
+        # flush, of each factory
+        self._outstanding = {}
+        self._failed_since_flush = {}
+        self._flushing = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, factory, uri, etype, wb_uri):
+        """ Queue a new local uri to be sent by the given factory.
+        """
+        with self._condition:
+            self._pending.append((factory, uri, etype, wb_uri, 0))
+            self._outstanding[factory] = self._outstanding.get(factory, 0) + 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='uris-write-behind',
+                                                daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+
+    def flush(self, timeout=None, factory=None) -> bool:
+        """ Send the pending uris right away and wait until they are processed.
+
+        Parameters
+        ----------
+        timeout : float
+            Maximum time in seconds to wait.
+        factory : :obj:`HerculesURIsFactory`
+            Factory whose uris are waited for. By default it waits for the
+            uris of every factory.
+
+        Returns
+        -------
+        bool
+            True if every uri submitted since the last flush was sent, False
+            if some of them were discarded or the timeout expired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                while self._outstanding.get(factory, 0) if factory is not None \
+                        else self._outstanding:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._flushing -= 1
+            if factory is not None:
+                return self._failed_since_flush.pop(factory, 0) == 0
+            successful = not self._failed_since_flush
+            self._failed_since_flush.clear()
+            return successful
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pending) + self._in_flight
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.monotonic() + self.interval
+            while len(self._pending) < self.batch_size and not self._flushing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = [self._pending.popleft()
+                     for _ in range(min(self.batch_size, len(self._pending)))]
+            self._in_flight = len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            results = [(entry, self._send(entry)) for entry in batch]
+            if not all(successful for _, successful in results):
+                time.sleep(self.backoff)
+            with self._condition:
+                for (factory, uri, etype, wb_uri, attempt), successful in results:
+                    if successful:
+                        self.sent += 1
+                        self._done(factory)
+                    elif attempt < self.retries:
+                        self._pending.append((factory, uri, etype, wb_uri, attempt + 1))
+                    else:
+                        LOGGER.error("Local uri %s of %s could not be sent to the factory.",
+                                     wb_uri, uri)
+                        self.failed += 1
+                        self._failed_since_flush[factory] = \
+                            self._failed_since_flush.get(factory, 0) + 1
+                        self._done(factory)
+                self._in_flight = 0
+                self._condition.notify_all()
+
+    def _done(self, factory):
+        # must be called while holding the condition of the writer
+        self._outstanding[factory] -= 1
+        if self._outstanding[factory] == 0:
+            del self._outstanding[factory]
+
+    def _send(self, entry):
+        factory, uri, etype, wb_uri, _ = entry
+        try:
+            response = factory._send_local_uri(uri, etype, wb_uri)
+            response.raise_for_status()
+        except Exception:
+            LOGGER.warning("Error sending local uri %s of %s.", wb_uri, uri, exc_info=True)
+            return False
+        return True
+
+
+# caches, store and writer shared by every factory, so they are kept between
+# synchronization jobs
+_SHARED = None
+_SHARED_LOCK = threading.Lock()
+
+def configure_uris_factory(cache_size=10000, cache_ttl=3600.0, negative_ttl=60.0,
+                           store_path=None, write_behind=False, write_batch_size=50,
+                           write_interval=0.5, write_retries=3, factory_url=None,
+                           wikibase_api=None):
+    """ Replace the objects shared by every factory with new ones created with the given settings.
+
+    Parameters
+    ----------
+    cache_size : int
+        Maximum number of uris kept in each cache.
+    cache_ttl : float
+        Time in seconds that a uri is kept in the caches.
+    negative_ttl : float
+        Time in seconds that a missing local uri is kept in the cache.
+    store_path : str
+        Path of the persistent store of local uris. If it is None the uris
+        are only kept in memory.
+    write_behind : bool
+        Whether new local uris are sent to the factory in the background.
+    write_batch_size : int
+        Maximum number of uris sent in each batch by the write-behind queue.
+    write_interval : float
+        Maximum time in seconds that a uri waits in the write-behind queue.
+    write_retries : int
+        Number of times that the write-behind queue sends a failed uri again.
+    factory_url : str
+        Url of the URIs factory. If it is None the current url is kept.
+    wikibase_api : str
+        Endpoint of the API of the target Wikibase, used to build the local
+        uris sent to the factory. If it is None the current one is kept.
+
+    Returns
+    -------
+    dict
+        Dictionary with the new 'canonical_cache', 'local_cache',
+        'negative_ttl', 'store' and 'writer'.
+    """
+    global _SHARED, URIS_FACTORY, WBAPI
+    shared = {
+        'canonical_cache': TTLCache(cache_size, cache_ttl),
+        'local_cache': TTLCache(cache_size, cache_ttl),
+        'negative_ttl': negative_ttl,
+        'store': URIMappingStore(store_path) if store_path else None,
+        'writer': URIWriteBehind(write_batch_size, write_interval, write_retries)
+                  if write_behind else None
+    }
+    with _SHARED_LOCK:
+        if factory_url is not None:
+            URIS_FACTORY = factory_url
+        if wikibase_api is not None:
+            WBAPI = wikibase_api.split("w/api.php")[0]
+        _SHARED = shared
+    return shared
+
+def _get_shared():
+    with _SHARED_LOCK:
+        shared = _SHARED
+    # created with the default settings if the factory wasn't configured before
+    return shared if shared is not None else configure_uris_factory()
+
+def warm_up_uris_cache(factory=None) -> threading.Thread:
+    """ Load the persistent store into the cache and revalidate it in the background.
+
+    Parameters
+    ----------
+    factory : :obj:`HerculesURIsFactory`
+        Factory whose cache will be warmed up. By default a factory with the
+        shared caches and store is used.
+
+    Returns
+    -------
+    :obj:`threading.Thread`
+        Daemon thread that revalidates the stored uris, or None if there is no
+        persistent store.
+    """
+    factory = factory if factory is not None else HerculesURIsFactory()
+    if factory.store is None:
+        return None
+    factory.warm_up()
+    revalidation = threading.Thread(target=factory.revalidate, name='uris-revalidation',
+                                    daemon=True)
+    revalidation.start()
+    return revalidation
@@ -0,0 +1,62 @@
+""" URI mappings store module
+
+Embedded SQLite store with the local uris resolved by the URIs factory, used
+to warm up the in-memory cache of the factory after a restart.
+"""
+
+import sqlite3
+import threading
+import time
+
+class URIMappingStore():
+    """ Persistent store of the mappings between elements and their local uris.
+
+    Parameters
+    ----------
+    db_path : str
+        Path of the SQLite database. It is created if it doesn't exist.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS mappings ("
+                               "etype TEXT NOT NULL, "
+                               "element TEXT NOT NULL, "
+                               "local_uri TEXT NOT NULL, "
+                               "updated REAL NOT NULL, "
+                               "PRIMARY KEY (etype, element))")
+
+    def load(self):
+        """ Return every mapping of the store.
+
+        Returns
+        -------
+        list of (str, str, str)
+            List of tuples with the entity type, element and local uri of
+            each mapping.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT etype, element, local_uri FROM mappings").fetchall()
+
+    def save(self, etype, element, local_uri):
+        """ Insert or update the local uri of an element.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO mappings VALUES (?, ?, ?, ?)",
+                               (etype, element, local_uri, time.time()))
+
+    def delete(self, etype, element):
+        """ Remove the mapping of an element from the store.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM mappings WHERE etype = ? AND element = ?",
+                               (etype, element))
+
+    def close(self):
+        """ Close the connection with the database.
+        """
+        with self._lock:
+            self._conn.close()
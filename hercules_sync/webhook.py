@@ -5,28 +5,45 @@ import collections
 import hashlib
 import hmac
 import json
+import logging
 import six
 
-from flask import abort, request
+from flask import abort, jsonify, request
+
+from .metrics import WEBHOOK_VERIFICATION_SECONDS
+
+LOGGER = logging.getLogger(__name__)
 
 CONTENT_HEADER = "content-type"
+DELIVERY_HEADER = "X-GitHub-Delivery"
 EVENT_HEADER = "X-Github-Event"
 SIGN_HEADER = "X-Hub-Signature"
 
 class WebHook():
     """ Class to manage Github webhooks from a Flask app.
+
+    When a cache of deliveries is given, the response to each delivery is
+    stored in it, and redeliveries with the same delivery id get that same
+    response without running the hooks again. If a replay check is given,
+    it is called with the stored (status, body) response before replaying it,
+    and the delivery is processed again when it returns False.
     """
 
-    def __init__(self, app, endpoint, key):
+    def __init__(self, app, endpoint, key, deliveries=None, replay_check=None):
         app.add_url_rule(rule=endpoint, endpoint=endpoint,
                          view_func=self._on_request,
                          methods=['POST'])
         self._hooks = collections.defaultdict(list)
         self.key = key
+        self.deliveries = deliveries
+        self.replay_check = replay_check
 
     def hook(self, event="push"):
         """ Add a function to process a webhook event.
 
+        The function can return a (status, body) tuple, which is used as the
+        response of the request. If the body is a dict it is sent as json.
+
         Params
         ------
         event: str. Type of event to be listened to.
@@ -36,12 +53,7 @@ class WebHook():
             return fun
         return decorator
 
-    def _is_signature_valid(self, signature, data):
-        secret_gen = _create_secret_gen_from(self.key, data)
-        digest = "sha1=" + secret_gen.hexdigest()
-        return digest == signature
-
-    def _on_request(self):
+    def _verify_request(self):
         signature = _try_get_header(request, SIGN_HEADER,
                                     "There is no signature header.")
         if not self._is_signature_valid(signature, request.data):
@@ -60,11 +72,40 @@ class WebHook():
 
         event = _try_get_header(request, EVENT_HEADER,
                                 "There was no event received.")
+        return data, event
 
-        for fun in self._hooks[event]:
-            fun(data)
-        return "", 204
+    def _is_signature_valid(self, signature, data):
+        secret_gen = _create_secret_gen_from(self.key, data)
+        digest = "sha1=" + secret_gen.hexdigest()
+        return digest == signature
 
+    def _on_request(self):
+        with WEBHOOK_VERIFICATION_SECONDS.time():
+            data, event = self._verify_request()
+
+        delivery = request.headers.get(DELIVERY_HEADER)
+        if delivery is not None and self.deliveries is not None:
+            response = self.deliveries.get(('delivery', delivery))
+            if response is not None and (self.replay_check is None or
+                                         self.replay_check(response)):
+                LOGGER.info("Delivery %s was already received.", delivery)
+                return _make_response(response)
+
+        response = None
+        for fun in self._hooks[event]:
+            res = fun(data)
+            if response is None and isinstance(res, tuple):
+                response = res
+        if response is None:
+            response = (204, "")
+        if delivery is not None and self.deliveries is not None:
+            self.deliveries.set(('delivery', delivery), response)
+        return _make_response(response)
+
+
+def _make_response(response):
+    status, body = response
+    return (jsonify(body) if isinstance(body, dict) else body), status
 
 def _create_secret_gen_from(key, data):
     if not isinstance(key, six.binary_type):
@@ -0,0 +1,185 @@
+""" Wikibase sessions module
+
+Pool of authenticated Wikibase adapters reused by the synchronization jobs,
+so each push doesn't need to log in again.
+"""
+
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+
+from wbsync.triplestore import WikibaseAdapter
+from wbsync.triplestore import wikibase_adapter
+from wikidataintegrator import wdi_login
+
+LOGGER = logging.getLogger(__name__)
+
+class PooledWikibaseAdapter(WikibaseAdapter):
+    """ Wikibase adapter with its own uris factory.
+
+    The WikibaseAdapter of wbsync reads the uris factory from a global of its
+    module, which would be shared by every adapter of the pool. This adapter
+    keeps the factory in an attribute instead, so each session can use a
+    different factory without affecting the sessions of other jobs.
+
+    Parameters
+    ----------
+    *args
+        Arguments of :obj:`WikibaseAdapter`.
+    factory_of_uris : :obj:`URIFactory`
+        Uris factory used by the adapter.
+    """
+
+    def __init__(self, *args, factory_of_uris=None, **kwargs):
+        # the global of wbsync is left as it was
+        super().__init__(*args, factory_of_uris=wikibase_adapter.uris_factory, **kwargs)
+        self.uris_factory = factory_of_uris
+
+    def _get_wb_id_of(self, uriref, proptype):
+        wb_uri = self.uris_factory.get_uri(uriref)
+        if wb_uri is not None:
+            LOGGER.debug("Id of %s in wikibase: %s", uriref, wb_uri)
+            return wb_uri
+
+        LOGGER.debug("Entity %s doesn't exist in wikibase. Creating it...", uriref)
+        entity_id = self._create_new_wb_item(uriref, proptype).result
+        self.uris_factory.post_uri(uriref, entity_id)
+        return entity_id
+
+
+class WikibaseAdapterPool():
+    """ Pool of long-lived authenticated Wikibase adapters.
+
+    Adapters are created lazily, up to the maximum size of the pool, and jobs
+    wait for a free adapter when all of them are in use. The session of an
+    adapter that has been idle for a while is checked before reusing it, and a
+    new login is done if the session expired.
+
+    Parameters
+    ----------
+    api_url : str
+        Url of the mediawiki API.
+    sparql_url : str
+        Url of the SPARQL endpoint.
+    username : str
+        Username used to log in.
+    password : str
+        Password of the user.
+    max_size : int
+        Maximum number of adapters, and therefore of concurrent sessions.
+    check_interval : float
+        Time in seconds that an adapter can be idle before its session is
+        checked again.
+    clock : callable
+        Function that returns the current time in seconds.
+    """
+
+    def __init__(self, api_url, sparql_url, username, password, max_size=2,
+                 check_interval=60.0, clock=time.monotonic):
+        self.api_url = api_url
+        self.sparql_url = sparql_url
+        self.username = username
+        self.password = password
+        self.max_size = max(1, max_size)
+        self.check_interval = check_interval
+        self.logins = 0
+        self.relogins = 0
+        self.reuses = 0
+        self._clock = clock
+        self._idle = []
+        self._size = 0
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.max_size)
+
+    @contextmanager
+    def session(self, factory_of_uris):
+        """ Borrow an authenticated adapter from the pool.
+
+        Parameters
+        ----------
+        factory_of_uris : :obj:`URIFactory`
+            Uris factory used by the adapter during this session.
+
+        Yields
+        ------
+        :obj:`PooledWikibaseAdapter`
+            Adapter that is returned to the pool at the end of the block. If
+            the block raises an exception the adapter is discarded.
+        """
+        self._semaphore.acquire()
+        try:
+            adapter = self._acquire(factory_of_uris)
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        try:
+            yield adapter
+        except BaseException:
+            with self._lock:
+                self._size -= 1
+            self._semaphore.release()
+            raise
+        with self._lock:
+            self._idle.append((adapter, self._clock()))
+        self._semaphore.release()
+
+    def stats(self):
+        """ Return the number of logins and reuses of the pool.
+
+        Returns
+        -------
+        dict
+            Dictionary with the number of logins, relogins after an expired
+            session, reuses of an existing adapter, adapters created and idle
+            adapters.
+        """
+        with self._lock:
+            return {'logins': self.logins, 'relogins': self.relogins, 'reuses': self.reuses,
+                    'size': self._size, 'idle': len(self._idle)}
+
+    def _acquire(self, factory_of_uris):
+        with self._lock:
+            entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                self._size += 1
+                self.logins += 1
+        if entry is None:
+            LOGGER.info("Logging in a new Wikibase session...")
+            try:
+                return PooledWikibaseAdapter(self.api_url, self.sparql_url, self.username,
+                                             self.password, factory_of_uris=factory_of_uris)
+            except BaseException:
+                with self._lock:
+                    self._size -= 1
+                raise
+
+        adapter, last_used = entry
+        adapter.uris_factory = factory_of_uris
+        if self._clock() - last_used >= self.check_interval and not self._is_logged_in(adapter):
+            LOGGER.info("Wikibase session expired. Logging in again...")
+            try:
+                adapter._local_login = wdi_login.WDLogin(self.username, self.password,
+                                                         self.api_url)
+            except BaseException:
+                # the adapter is discarded, and the session releases its slot
+                with self._lock:
+                    self._size -= 1
+                raise
+            with self._lock:
+                self.logins += 1
+                self.relogins += 1
+        with self._lock:
+            self.reuses += 1
+        return adapter
+
+    def _is_logged_in(self, adapter):
+        params = {'action': 'query', 'meta': 'userinfo', 'format': 'json'}
+        try:
+            response = adapter._local_login.get_session().get(self.api_url, params=params)
+            return 'anon' not in response.json()['query']['userinfo']
+        except Exception:
+            LOGGER.warning("Wikibase session could not be checked.", exc_info=True)
+            return False
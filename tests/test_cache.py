@@ -0,0 +1,42 @@
+import os
+
+from hercules_sync.cache import BlobCache, git_blob_sha
+
+CONTENT = 'hello\n'
+# sha obtained with: echo 'hello' | git hash-object --stdin
+CONTENT_SHA = 'ce013625030ba8dba906f756967f9e9ca394464a'
+
+def test_git_blob_sha():
+    assert git_blob_sha(CONTENT.encode('utf-8')) == CONTENT_SHA
+
+def test_blob_cache_abbreviated_sha(tmpdir):
+    cache = BlobCache(str(tmpdir), 1024)
+    assert cache.get(CONTENT_SHA[:7]) is None
+    assert cache.put(CONTENT_SHA[:7], CONTENT)
+    assert cache.get(CONTENT_SHA[:7]) == CONTENT
+    assert cache.get(CONTENT_SHA) == CONTENT
+    assert cache.hits == 2
+    assert cache.misses == 1
+
+def test_blob_cache_invalid_sha(tmpdir):
+    cache = BlobCache(str(tmpdir), 1024)
+    assert not cache.put('abcdef0', CONTENT)
+    assert cache.size == 0
+
+def test_blob_cache_lru_eviction(tmpdir):
+    cache = BlobCache(str(tmpdir), 14)
+    first, second, third = 'first\n', 'second\n', 'third\n'
+    cache.put(git_blob_sha(first.encode()), first)
+    cache.put(git_blob_sha(second.encode()), second)
+    assert cache.get(git_blob_sha(first.encode())) == first
+    cache.put(git_blob_sha(third.encode()), third)
+    assert cache.get(git_blob_sha(second.encode())) is None
+    assert cache.get(git_blob_sha(first.encode())) == first
+    assert cache.size <= 14
+    assert len(os.listdir(str(tmpdir))) == 2
+
+def test_blob_cache_persistence(tmpdir):
+    BlobCache(str(tmpdir), 1024).put(CONTENT_SHA, CONTENT)
+    cache = BlobCache(str(tmpdir), 1024)
+    assert cache.size == len(CONTENT)
+    assert cache.get(CONTENT_SHA[:10]) == CONTENT
@@ -0,0 +1,28 @@
+from hercules_sync.coalescer import merge_pushes, push_key
+
+def _push(before, after, ref='refs/heads/master', repo='weso/ontology', files=None):
+    return {
+        'ref': ref,
+        'before': before,
+        'after': after,
+        'repository': {'full_name': repo},
+        'commits': [{'added': [], 'modified': files or ['ontology.ttl'], 'removed': []}]
+    }
+
+def test_merge_consecutive_pushes():
+    merged = merge_pushes(_push('001', '002'), _push('002', '003', files=['other.ttl']))
+    assert merged['before'] == '001'
+    assert merged['after'] == '003'
+    assert not merged['forced']
+    assert [c['modified'] for c in merged['commits']] == [['ontology.ttl'], ['other.ttl']]
+
+def test_merge_non_consecutive_pushes():
+    merged = merge_pushes(_push('001', '002'), _push('005', '003'))
+    assert merged['before'] == '001'
+    assert merged['after'] == '003'
+    assert merged['forced']
+
+def test_push_key():
+    assert push_key(_push('001', '002')) == 'weso/ontology:refs/heads/master'
+    assert push_key(_push('001', '002')) != push_key(_push('001', '002', ref='refs/heads/dev'))
+    assert push_key(_push('001', '002')) != push_key(_push('001', '002', repo='weso/other'))
@@ -5,9 +5,13 @@ import json
 import os
 import pytest
 
-from hercules_sync.git import GitDataLoader, GitDiffParser, \
+from hercules_sync.cache import BlobCache
+from hercules_sync.git import GitDataLoader, GitDiffParser, GitFile, \
                               GitPushEventHandler, \
-                              DiffNotFoundError, InvalidCommitError
+                              DiffNotFoundError, InvalidCommitError, \
+                              PatchApplyError, iter_diff_lines, \
+                              parse_diff_stream, reverse_patch
+from unidiff import PatchSet
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 SOURCE_DIR = 'source'
@@ -29,8 +33,10 @@ def mocked_diff_parser():
     file_path = os.path.join(DATA_DIR, 'test_diff.diff')
     diff_parser = GitDiffParser('', SOURCE_DIR, TARGET_DIR)
 
+    with open(file_path, 'rb') as fp:
+        diff = fp.read()
     fake_response = mock.Mock()
-    fake_response.data = open(file_path, 'r').read().encode('utf-8')
+    fake_response.stream = lambda amt: (diff[i:i + 100] for i in range(0, len(diff), 100))
 
     diff_parser._send_request = mock.MagicMock(return_value=fake_response)
     return diff_parser
@@ -42,10 +48,18 @@ def mocked_data_loader():
     data_loader._send_request = lambda url: fake_load_file(url)
     return data_loader
 
+@pytest.fixture
+def mocked_concurrent_data_loader():
+    data_loader = GitDataLoader('', SOURCE_DIR, TARGET_DIR, max_workers=4)
+    data_loader._build_download_url = lambda file_path, ref: os.path.join(ref, file_path)
+    data_loader._send_request = lambda url: fake_load_file(url)
+    return data_loader
+
 @pytest.fixture
 def mocked_event_handler(mocked_diff_parser, mocked_data_loader):
     with mock.patch.object(GitPushEventHandler, "__init__", lambda _, data: None):
         event_handler = GitPushEventHandler('')
+        event_handler.path_filter = None
         event_handler.diff_parser = mocked_diff_parser
         event_handler.diff_parser.load_diff()
         event_handler.data_loader = mocked_data_loader
@@ -85,6 +99,93 @@ def test_data_loader_invalid_commit(mocked_event_handler):
         _ = list(mocked_event_handler.added_files)
     assert f"Commit {bef_ref} was not found" in str(err.value)
 
+def test_data_loader_concurrent_order(mocked_diff_parser, mocked_concurrent_data_loader,
+                                      mocked_data_loader):
+    mocked_diff_parser.load_diff()
+    patch = mocked_diff_parser.patch
+    expected = list(mocked_data_loader.load_files(patch))
+    loaded = list(mocked_concurrent_data_loader.load_files(patch))
+    assert [f.path for f in loaded] == [f.path for f in expected]
+    assert [f.source_content for f in loaded] == [f.source_content for f in expected]
+    assert [f.target_content for f in loaded] == [f.target_content for f in expected]
+
+def test_data_loader_concurrent_invalid_commit(mocked_diff_parser):
+    bef_ref = '1234'
+    data_loader = GitDataLoader('', bef_ref, '5678', max_workers=4)
+    response = mock.Mock()
+    response.data = json.dumps({
+        "message": 'No commit found for the ref {}'.format(bef_ref)
+    }).encode('utf-8')
+    data_loader._send_request = lambda url: response
+    mocked_diff_parser.load_diff()
+    with pytest.raises(InvalidCommitError) as err:
+        _ = list(data_loader.load_files(mocked_diff_parser.patch))
+    assert f"Commit {bef_ref} was not found" in str(err.value)
+
+def test_data_loader_blob_cache(mocked_diff_parser, tmpdir):
+    requested_urls = []
+    def tracking_load_file(url):
+        requested_urls.append(url)
+        return fake_load_file(url)
+
+    data_loader = GitDataLoader('', SOURCE_DIR, TARGET_DIR, blob_cache=BlobCache(str(tmpdir), 4096))
+    data_loader._build_download_url = lambda file_path, ref: os.path.join(ref, file_path)
+    data_loader._send_request = tracking_load_file
+    mocked_diff_parser.load_diff()
+    modified = mocked_diff_parser.patch.modified_files
+
+    first_load = list(data_loader.load_files(modified))
+    assert len(requested_urls) == 2
+    second_load = list(data_loader.load_files(modified))
+    assert len(requested_urls) == 2
+    assert second_load[0].source_content == first_load[0].source_content
+    assert second_load[0].target_content == first_load[0].target_content
+
+def test_data_loader_rebuild_source(mocked_diff_parser, mocked_data_loader):
+    requested_urls = []
+    def tracking_load_file(url):
+        requested_urls.append(url)
+        return fake_load_file(url)
+
+    data_loader = GitDataLoader('', SOURCE_DIR, TARGET_DIR, rebuild_source=True)
+    data_loader._build_download_url = lambda file_path, ref: os.path.join(ref, file_path)
+    data_loader._send_request = tracking_load_file
+    mocked_diff_parser.load_diff()
+    modified = mocked_diff_parser.patch.modified_files
+
+    rebuilt, = data_loader.load_files(modified)
+    expected, = mocked_data_loader.load_files(modified)
+    assert requested_urls == [os.path.join(TARGET_DIR, 'ASTBasicTest.txt')]
+    assert rebuilt.source_content == expected.source_content
+    assert rebuilt.target_content == expected.target_content
+
+def test_data_loader_rebuild_source_fallback(mocked_diff_parser):
+    data_loader = GitDataLoader('', SOURCE_DIR, TARGET_DIR, max_workers=2, rebuild_source=True)
+    data_loader._build_download_url = lambda file_path, ref: os.path.join(ref, file_path)
+    # every request returns the original content, so the diff can't be reversed
+    data_loader._send_request = lambda url: fake_load_file(
+        os.path.join(SOURCE_DIR, os.path.basename(url)))
+    mocked_diff_parser.load_diff()
+
+    modified, = data_loader.load_files(mocked_diff_parser.patch.modified_files)
+    with open(os.path.join(DATA_DIR, SOURCE_DIR, 'ASTBasicTest.txt'), 'r') as f:
+        assert modified.source_content == f.read()
+
+def test_reverse_patch_no_newline():
+    patch = PatchSet('diff --git a/f.ttl b/f.ttl\n'
+                     'index 1111111..2222222 100644\n'
+                     '--- a/f.ttl\n'
+                     '+++ b/f.ttl\n'
+                     '@@ -1,3 +1,3 @@\n'
+                     ' a\n'
+                     ' b\n'
+                     '-c\n'
+                     '\\ No newline at end of file\n'
+                     '+d\n')
+    assert reverse_patch(patch[0], 'a\nb\nd\n') == 'a\nb\nc'
+    with pytest.raises(PatchApplyError):
+        reverse_patch(patch[0], 'a\nx\nd\n')
+
 def test_data_loader_invalid_file():
     loader = GitDataLoader('', '', '')
     response = mock.Mock()
@@ -106,6 +207,38 @@ def test_diff_parser_diff_not_found(mocked_diff_parser):
     with pytest.raises(DiffNotFoundError):
         mocked_diff_parser.load_diff()
 
+def test_diff_parser_filter(mocked_diff_parser):
+    mocked_diff_parser.load_diff(path_filter=lambda path: path.endswith('.txt'))
+    assert [file.path for file in mocked_diff_parser.patch] == ['ASTBasicTest.txt',
+                                                               'definitions.txt']
+    with open(os.path.join(DATA_DIR, 'test_diff.diff'), 'r') as fp:
+        expected = PatchSet(fp.read())
+    assert str(mocked_diff_parser.patch[1]) == str(expected[2])
+
+def test_iter_diff_lines():
+    chunks = [b'diff --git a/f.ttl', b' b/f.ttl\n+\xc3', b'\xb1\n\n', b'last']
+    assert list(iter_diff_lines(chunks)) == ['diff --git a/f.ttl b/f.ttl\n', '+\u00f1\n', '\n', 'last']
+
+def test_parse_diff_stream_paths():
+    diff = ('diff --git a/old.ttl b/old.ttl\n'
+            'deleted file mode 100644\n'
+            'index 0000001..0000000\n'
+            '--- a/old.ttl\n'
+            '+++ /dev/null\n'
+            '@@ -1 +0,0 @@\n'
+            '-removed\n'
+            'diff --git a/logo.png b/logo.png\n'
+            'index 0000001..0000002 100644\n'
+            'Binary files a/logo.png and b/logo.png differ\n')
+    seen = []
+    def path_filter(path):
+        seen.append(path)
+        return path.endswith('.ttl')
+    patch = parse_diff_stream(diff.splitlines(keepends=True), path_filter)
+    assert seen == ['old.ttl', 'logo.png']
+    assert [file.path for file in patch] == ['old.ttl']
+    assert patch[0].is_removed_file
+
 def test_event_handler_init():
     data = {
         'before': '1234',
@@ -120,6 +253,20 @@ def test_event_handler_init():
         assert handler.after_commit == '5678'
         assert handler.repo_name == 'user_name/repo_name'
 
+def test_event_handler_path_filter(mocked_event_handler):
+    requested_urls = []
+    send_request = mocked_event_handler.data_loader._send_request
+    def tracking_send_request(url):
+        requested_urls.append(url)
+        return send_request(url)
+
+    mocked_event_handler.data_loader._send_request = tracking_send_request
+    mocked_event_handler.path_filter = lambda path: path.endswith('.interp')
+    assert [f.path for f in mocked_event_handler.added_files] == ['ShExL.interp']
+    assert list(mocked_event_handler.modified_files) == []
+    assert list(mocked_event_handler.removed_files) == []
+    assert all(url.endswith('ShExL.interp') for url in requested_urls)
+
 def test_gitfile_str(mocked_event_handler):
     test_file = list(mocked_event_handler.added_files)[0]
     str_representation = str(test_file)
@@ -140,6 +287,20 @@ def test_removed_lines(mocked_event_handler):
     assert ('\n', 2) in removed_lines
     assert ('\n', 4) in removed_lines
 
+def test_lines_between(mocked_event_handler):
+    test_file = list(mocked_event_handler.added_files)[0]
+    assert test_file.added_lines_between(2, 3) == [line for line in test_file.added_lines
+                                                   if 2 <= line[1] <= 3]
+    assert test_file.added_lines_between(100, 200) == []
+    removed_file = list(mocked_event_handler.removed_files)[0]
+    assert removed_file.removed_lines_between(1, 2) == [('package es.weso.shexl\n', 1), ('\n', 2)]
+
+def test_git_file_slots():
+    git_file = GitFile(None, 'source', 'target')
+    assert not hasattr(git_file, '__dict__')
+    with pytest.raises(AttributeError):
+        git_file.extra = True
+
 def test_removed_files(mocked_event_handler):
     removed_files = list(mocked_event_handler.removed_files)
     assert len(removed_files) == 1
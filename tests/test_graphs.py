@@ -0,0 +1,102 @@
+from unittest import mock
+
+import pytest
+
+from hercules_sync.git import GitFile
+from hercules_sync.graphs import GraphCache, hashed_diff, isomorphic_diff, parse_graph, \
+                                 synchronize_graphs
+from hercules_sync.parallel import SyncProcessPool
+from rdflib import BNode, Graph
+from wbsync.synchronization import GraphDiffSyncAlgorithm, OntologySynchronizer
+
+SOURCE = '''@prefix ex: <http://example.org/> .
+@prefix owl: <http://www.w3.org/2002/07/owl#> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+ex:name a owl:DatatypeProperty .
+ex:knows a owl:ObjectProperty ; rdfs:range ex:Person .
+ex:a ex:name "Old" ; ex:knows ex:b .
+'''
+
+TARGET = SOURCE.replace('"Old"', '"New"') + 'ex:c ex:knows ex:a .\n'
+
+def _summary(ops):
+    return sorted((type(op).__name__,
+                   tuple((str(element), getattr(element, 'etype', None),
+                          getattr(element, 'proptype', None))
+                         for element in op._triple_info.content))
+                  for op in ops)
+
+def test_synchronize_graphs():
+    ops = synchronize_graphs(parse_graph(SOURCE), parse_graph(TARGET))
+    expected = OntologySynchronizer(GraphDiffSyncAlgorithm()).synchronize(SOURCE, TARGET)
+    assert _summary(ops) == _summary(expected)
+
+def test_graph_cache():
+    cache = GraphCache(1)
+    graph = parse_graph(SOURCE)
+    assert cache.get('weso/ontology', 'ontology.ttl', SOURCE) is None
+    cache.put('weso/ontology', 'ontology.ttl', SOURCE, graph)
+    assert cache.get('weso/ontology', 'ontology.ttl', SOURCE) is graph
+    # graphs are only returned for the content they were parsed from
+    assert cache.get('weso/ontology', 'ontology.ttl', TARGET) is None
+    assert cache.get('weso/other', 'ontology.ttl', SOURCE) is None
+
+    cache.put('weso/ontology', 'other.ttl', TARGET, parse_graph(TARGET))
+    assert cache.get('weso/ontology', 'ontology.ttl', SOURCE) is None
+    assert cache.stats() == {'hits': 1, 'misses': 4, 'size': 1}
+
+def test_graph_cache_on_disk(tmp_path):
+    graph = parse_graph(SOURCE)
+    GraphCache(4, str(tmp_path)).put('weso/ontology', 'ontology.ttl', SOURCE, graph)
+    cache = GraphCache(4, str(tmp_path))
+    loaded = cache.get('weso/ontology', 'ontology.ttl', SOURCE)
+    assert set(loaded) == set(graph)
+    assert cache.get('weso/ontology', 'ontology.ttl', TARGET) is None
+
+    # graphs are stored as N-Triples, and invalid files are ignored
+    path, = tmp_path.iterdir()
+    assert set(Graph().parse(data=path.read_text(encoding='utf-8'), format='nt')) == set(graph)
+    path.write_text('# 1234\ninvalid\n', encoding='utf-8')
+    assert GraphCache(4, str(tmp_path)).get('weso/ontology', 'ontology.ttl', SOURCE) is None
+
+def test_pool_reuses_cached_graphs():
+    pool = SyncProcessPool(0, GraphCache(4))
+    first = GitFile(mock.Mock(path='ontology.ttl'), '', SOURCE)
+    second = GitFile(mock.Mock(path='ontology.ttl'), SOURCE, TARGET)
+    pool.compute_operations([first], 'weso/ontology')
+    with mock.patch('hercules_sync.parallel.parse_graph', wraps=parse_graph) as mocked_parse:
+        ops = pool.compute_operations([second], 'weso/ontology')
+    mocked_parse.assert_called_once_with(TARGET)
+    assert _summary(ops) == _summary(SyncProcessPool(0).compute_operations([second]))
+
+def test_hashed_diff():
+    source = parse_graph(SOURCE)
+    target = parse_graph(TARGET)
+    removed, added = hashed_diff(source, target)
+    expected_removed, expected_added = isomorphic_diff(source, target)
+    assert set(removed) == set(expected_removed)
+    assert set(added) == set(expected_added)
+    assert hashed_diff(source, parse_graph(SOURCE)) == ([], [])
+    assert set(hashed_diff(Graph(), source)[1]) == set(source)
+
+def test_hashed_diff_blank_nodes():
+    source = parse_graph(SOURCE + 'ex:a ex:address [ ex:city "Oviedo" ] .\n')
+    target = parse_graph(TARGET + 'ex:a ex:address [ ex:city "Oviedo" ] .\n')
+    removed, added = hashed_diff(source, target)
+    assert len(removed) == 1 and len(added) == 2
+    assert not any(isinstance(term, BNode) for triple in removed + added for term in triple)
+    # blank nodes get the same labels as in the isomorphic diff
+    changed = parse_graph(TARGET + 'ex:a ex:address [ ex:city "Gijon" ] .\n')
+    removed, added = hashed_diff(source, changed)
+    expected_removed, expected_added = isomorphic_diff(source, changed)
+    assert (set(removed), set(added)) == (set(expected_removed), set(expected_added))
+
+def test_synchronize_graphs_hashed():
+    source = parse_graph(SOURCE)
+    target = parse_graph(TARGET)
+    assert _summary(synchronize_graphs(source, target, 'hashed')) == \
+        _summary(synchronize_graphs(source, target))
+
+def test_pool_unknown_algorithm():
+    with pytest.raises(ValueError):
+        SyncProcessPool(0).compute_operations([], algorithm='unknown')
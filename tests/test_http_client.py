@@ -0,0 +1,107 @@
+import gzip
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import pytest
+
+from urllib3.exceptions import ProtocolError
+
+from hercules_sync.http_client import HttpClient, configure_http_client, get_http_client
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+
+    def do_GET(self):
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = b'content'
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), FakeGitHubHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    FakeGitHubHandler.statuses = []
+
+def _url(server):
+    return f'http://127.0.0.1:{server.server_port}/file'
+
+def test_connections_are_reused(server):
+    client = HttpClient(retries=0)
+    for _ in range(3):
+        response = client.request('GET', _url(server))
+        assert response.data == b'content'
+    host_stats = client.stats()[f'127.0.0.1:{server.server_port}']
+    assert host_stats['requests'] == 3
+    assert host_stats['pool_requests'] == 3
+    assert host_stats['connections'] == 1
+
+@mock.patch('hercules_sync.http_client.time.sleep')
+def test_retry_server_errors(mocked_sleep, server):
+    FakeGitHubHandler.statuses = [502, 503]
+    client = HttpClient(retries=3, backoff_factor=0.1)
+    response = client.request('GET', _url(server))
+    assert response.status == 200
+    assert mocked_sleep.call_count == 2
+    assert all(0 <= call[0][0] <= 0.4 for call in mocked_sleep.call_args_list)
+    host_stats = client.stats()[f'127.0.0.1:{server.server_port}']
+    assert host_stats['retries'] == 2
+    assert host_stats['errors'] == 2
+
+@mock.patch('hercules_sync.http_client.time.sleep')
+def test_retried_responses_are_released(mocked_sleep, server):
+    FakeGitHubHandler.statuses = [502, 503, 504]
+    client = HttpClient(pool_size=1, retries=3)
+    response = client.request('GET', _url(server), preload_content=False)
+    assert response.status == 200
+    assert response.read() == b'content'
+    response.release_conn()
+    # the connection of each failed response was reused by the next attempt
+    assert client.stats()[f'127.0.0.1:{server.server_port}']['connections'] == 1
+
+@mock.patch('hercules_sync.http_client.time.sleep')
+def test_retries_exhausted(mocked_sleep, server):
+    FakeGitHubHandler.statuses = [500, 500, 500]
+    client = HttpClient(retries=1)
+    assert client.request('GET', _url(server)).status == 500
+    assert mocked_sleep.call_count == 1
+
+@mock.patch('hercules_sync.http_client.time.sleep')
+def test_retry_connection_errors(mocked_sleep):
+    client = HttpClient(retries=2)
+    response = mock.Mock(status=200)
+    client._pool.request = mock.MagicMock(side_effect=[ProtocolError('reset'), response])
+    assert client.request('GET', 'https://api.github.com/repos') is response
+
+    client._pool.request = mock.MagicMock(side_effect=ProtocolError('reset'))
+    with pytest.raises(ProtocolError):
+        client.request('GET', 'https://api.github.com/repos')
+    assert client.stats()['api.github.com']['errors'] == 4
+
+def test_non_idempotent_requests_are_not_retried(server):
+    FakeGitHubHandler.statuses = [503]
+    client = HttpClient(retries=3)
+    assert client.request('POST', _url(server)).status == 503
+
+@mock.patch('hercules_sync.http_client._CLIENT', None)
+def test_shared_client():
+    client = configure_http_client(pool_size=2)
+    assert get_http_client() is client
+    assert client.pool_size == 2
@@ -0,0 +1,200 @@
+import threading
+import time
+
+import pytest
+
+from hercules_sync.cache import TTLCache
+from hercules_sync.jobs import JobQueue
+
+@pytest.fixture
+def db_path(tmpdir):
+    return str(tmpdir.join('jobs.db'))
+
+def test_jobs_are_run(db_path):
+    results = []
+    queue = JobQueue(db_path, workers=2)
+    queue.register('sum', lambda payload: results.append(sum(payload)))
+    job_ids = [queue.enqueue('sum', [i, i]) for i in range(5)]
+    queue.start()
+    assert queue.join(timeout=10)
+    assert sorted(results) == [0, 2, 4, 6, 8]
+    assert queue.stats() == {'done': 5}
+    job = queue.get(job_ids[0])
+    assert job['status'] == 'done'
+    assert job['attempts'] == 1
+    assert job['started'] <= job['finished']
+    assert queue.get(100) is None
+    queue.close()
+
+def test_failed_jobs_are_retried(db_path):
+    attempts = []
+    def failing(payload):
+        attempts.append(payload)
+        if len(attempts) < 2:
+            raise ValueError('temporary error')
+
+    queue = JobQueue(db_path, max_attempts=2, retry_backoff=0)
+    queue.register('failing', failing)
+    queue.register('always_failing', lambda payload: 1 / 0)
+    first = queue.enqueue('failing', {'push': 1})
+    second = queue.enqueue('always_failing', {'push': 2})
+    queue.start()
+    assert queue.join(timeout=10)
+    assert attempts == [{'push': 1}, {'push': 1}]
+    assert queue.get(first)['status'] == 'done'
+    assert queue.get(second)['status'] == 'failed'
+    assert queue.get(second)['attempts'] == 2
+    assert 'ZeroDivisionError' in queue.get(second)['error']
+    queue.close()
+
+def test_retries_back_off(db_path):
+    attempts = []
+    def failing(payload):
+        attempts.append(time.time())
+        raise ValueError('service unavailable')
+
+    queue = JobQueue(db_path, max_attempts=3, retry_backoff=0.2, poll_interval=0.01)
+    queue.register('failing', failing)
+    job_id = queue.enqueue('failing', {})
+    queue.start()
+    assert queue.join(timeout=10)
+    assert queue.get(job_id)['status'] == 'failed'
+    delays = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+    assert delays[0] >= 0.2
+    assert delays[1] >= 0.4
+    queue.close()
+
+def test_pending_jobs_survive_restart(db_path):
+    queue = JobQueue(db_path)
+    queue.enqueue('sync', 'a')
+    queue.enqueue('sync', 'b')
+    assert queue.depth() == 2
+    queue.close()
+
+    results = []
+    queue = JobQueue(db_path)
+    queue.register('sync', results.append)
+    queue.start()
+    assert queue.join(timeout=10)
+    assert results == ['a', 'b']
+    queue.close()
+
+def test_interrupted_jobs_are_recovered(db_path):
+    started = threading.Event()
+    release = threading.Event()
+    def blocking(payload):
+        started.set()
+        release.wait(10)
+
+    queue = JobQueue(db_path, lease_time=0.3)
+    queue.register('sync', blocking)
+    job_id = queue.enqueue('sync', 'a')
+    queue.start()
+    assert started.wait(10)
+    assert queue.get(job_id)['status'] == 'running'
+
+    # a new queue over the same database leaves the job alone while its lease is renewed
+    results = []
+    recovered_queue = JobQueue(db_path, lease_time=0.3, poll_interval=0.01)
+    recovered_queue.register('sync', results.append)
+    recovered_queue.start()
+    time.sleep(0.6)
+    assert results == []
+
+    # once the first queue stops renewing the lease, as after a crash, the job is run again
+    queue.stop(timeout=0)
+    assert recovered_queue.join(timeout=10)
+    assert results == ['a']
+    release.set()
+    queue.close()
+    job = recovered_queue.get(job_id)
+    assert job['status'] == 'done'
+    assert job['attempts'] == 2
+    recovered_queue.close()
+
+def test_jobs_with_same_key_are_run_in_order(db_path):
+    results = []
+    def failing_once(payload):
+        results.append(payload)
+        if results.count(payload) == 1 and payload == 'first':
+            raise ValueError('temporary error')
+
+    queue = JobQueue(db_path, workers=2, max_attempts=2, retry_backoff=0.3, poll_interval=0.01)
+    queue.register('push', failing_once)
+    queue.enqueue('push', 'first', key='master')
+    queue.enqueue('push', 'second', key='master')
+    queue.enqueue('push', 'other', key='develop')
+    queue.start()
+    assert queue.join(timeout=10)
+    # the second push waits for the retry of the first one
+    assert [result for result in results if result != 'other'] == ['first', 'first', 'second']
+    # jobs with other keys don't wait
+    assert results.index('other') < 2
+    queue.close()
+
+def test_jobs_with_same_key_are_merged(db_path):
+    results = []
+    queue = JobQueue(db_path)
+    queue.register('push', results.append)
+    merge = lambda first, last: first + last
+    first = queue.enqueue('push', [1], key='master', delay=0.2, merge=merge)
+    assert queue.enqueue('push', [2], key='master', delay=0.2, merge=merge) == first
+    other = queue.enqueue('push', [3], key='develop', delay=0.2, merge=merge)
+    assert other != first
+    assert queue.depth() == 2
+    queue.start()
+    assert queue.join(timeout=10)
+    assert sorted(results) == [[1, 2], [3]]
+    # jobs that already started are never merged
+    assert queue.enqueue('push', [4], key='master', merge=merge) not in (first, other)
+    queue.close()
+
+def test_enqueue_unique(db_path):
+    queue = JobQueue(db_path, max_attempts=1, dedup_cache=TTLCache(10, 60))
+    queue.register('push', lambda payload: None)
+    queue.register('failing', lambda payload: 1 / 0)
+    first, is_new = queue.enqueue_unique(('repo', '001', '002'), 'push', {})
+    assert is_new
+    assert queue.enqueue_unique(('repo', '001', '002'), 'push', {}) == (first, False)
+    failed, _ = queue.enqueue_unique(('repo', '002', '003'), 'failing', {})
+    queue.start()
+    assert queue.join(timeout=10)
+    # finished jobs are still duplicates, but failed ones can be queued again
+    assert queue.enqueue_unique(('repo', '001', '002'), 'push', {}) == (first, False)
+    retried, is_new = queue.enqueue_unique(('repo', '002', '003'), 'push', {})
+    assert is_new and retried != failed
+    queue.close()
+
+def test_job_stages_and_result(db_path):
+    queue = JobQueue(db_path)
+    def staged(payload):
+        queue.set_stage('fetching')
+        queue.set_stage('writing')
+        return {'operations': payload}
+    queue.register('staged', staged)
+    job_id = queue.enqueue('staged', 3)
+    assert queue.get(job_id)['stage'] == 'queued'
+    queue.set_stage('ignored outside of a job')
+    queue.start()
+    assert queue.join(timeout=10)
+    job = queue.get(job_id)
+    assert job['stage'] == 'done'
+    assert job['result'] == {'operations': 3}
+    assert set(job['timings']) == {'running', 'fetching', 'writing'}
+    queue.close()
+
+def test_jobs_are_claimed_once(db_path):
+    # queues of different processes can share the same database
+    results = []
+    queues = [JobQueue(db_path, workers=4, poll_interval=0.001) for _ in range(4)]
+    for queue in queues:
+        queue.register('sync', results.append)
+    for i in range(200):
+        queues[0].enqueue('sync', i)
+    for queue in queues:
+        queue.start()
+    for queue in queues:
+        assert queue.join(timeout=10)
+    assert sorted(results) == list(range(200))
+    for queue in queues:
+        queue.close()
@@ -1,3 +1,5 @@
+import json
+
 from unittest import mock
 
 import pytest
@@ -8,7 +10,47 @@ from flask import Flask
 
 app = Flask(__name__)
 app.config['GITHUB_OAUTH'] = ''
+app.config['GITHUB_DOWNLOAD_WORKERS'] = 1
+app.config['SYNC_RULES'] = [{'refs': ['master'], 'formats': ['ttl']}]
+app.config['BLOB_CACHE_DIR'] = None
+app.config['BLOB_CACHE_SIZE'] = 0
+app.config['GIT_BACKEND'] = 'github'
+app.config['PUSH_COALESCE_WINDOW'] = 0.0
+app.config['JOB_QUEUE_PATH'] = ':memory:'
+app.config['DELIVERY_CACHE_SIZE'] = 10
+app.config['DELIVERY_TTL'] = 60.0
+app.config['SYNC_PROCESSES'] = 0
+app.config['SYNC_BATCH_EDITS'] = False
+app.config['SYNC_ALGORITHM'] = 'graphdiff'
+app.config['SYNC_WARM_UP'] = False
+app.config['GRAPH_CACHE_SIZE'] = 0
+app.config['GRAPH_CACHE_DIR'] = None
+app.config['WB_SESSIONS'] = 1
+app.config['TRACE_EXPORT'] = 'none'
+app.config['TRACE_FILE'] = None
+app.config['WB_SESSION_CHECK_INTERVAL'] = 60.0
+app.config['JOB_WORKERS'] = 1
+app.config['JOB_MAX_ATTEMPTS'] = 1
+app.config['JOB_RETENTION'] = 60.0
+app.config['JOB_RETRY_BACKOFF'] = 0.0
+app.config['JOB_LEASE_TIME'] = 60.0
+app.config['HTTP_POOL_SIZE'] = 1
+app.config['HTTP_TIMEOUT'] = 1.0
+app.config['HTTP_CONNECT_TIMEOUT'] = 1.0
+app.config['HTTP_RETRIES'] = 0
+app.config['HTTP_BACKOFF'] = 0.0
+app.config['URIS_PREFETCH_WORKERS'] = 2
+app.config['URIS_CACHE_SIZE'] = 10
+app.config['URIS_CACHE_TTL'] = 60.0
+app.config['URIS_CACHE_NEGATIVE_TTL'] = 1.0
+app.config['URIS_STORE_PATH'] = None
+app.config['URIS_WRITE_BEHIND'] = False
+app.config['URIS_WRITE_BATCH_SIZE'] = 1
+app.config['URIS_WRITE_INTERVAL'] = 0.0
+app.config['URIS_WRITE_RETRIES'] = 0
+app.config['REBUILD_SOURCE_FROM_DIFF'] = False
 app.config['WBAPI'] = 'test/api'
+app.config['URIS_FACTORY'] = 'test/factory/'
 app.config['WBSPARQL'] = 'test/sparql'
 app.config['WBUSER'] = 'user'
 app.config['WBPASS'] = 'pass'
@@ -16,9 +58,17 @@ app.config['WEBHOOK_SECRET'] = ''
 ctx = app.app_context()
 ctx.push()
 
+from hercules_sync.coalescer import merge_pushes
 from hercules_sync.git import GitFile, GitPushEventHandler, DiffNotFoundError
-from hercules_sync.listener import on_push, _extract_ontology_files, _filter_asio_files, _synchronize_files
+from hercules_sync.jobs import DONE, FAILED
+from hercules_sync.listener import on_push, _collect_uri_elements, _extract_ontology_files, \
+                                   _filter_asio_files, _load_sync_dependencies, _process_push, \
+                                   _synchronize_files
 from hercules_sync.webhook import WebHook
+from wbsync.synchronization import AdditionOperation
+from wbsync.triplestore import LiteralElement, URIElement
+from wbsync.util.uri_constants import RDFS_LABEL
+from unidiff import PatchSet
 
 @pytest.fixture
 def mocked_req():
@@ -31,6 +81,15 @@ def mocked_req():
         req.data = b'{"ref": "head", "before": "001", "after": "002"}'
         yield req
 
+DIFF = '''diff --git a/ontology.ttl b/ontology.ttl
+index 0000001..0000002 100644
+--- a/ontology.ttl
++++ b/ontology.ttl
+@@ -1,1 +1,1 @@
+-source
++target
+'''
+
 def raise_diff_not_found():
     raise DiffNotFoundError()
 
@@ -38,24 +97,120 @@ def raise_diff_not_found():
 def webhook(app):
     return WebHook(app, endpoint='/postreceive', key='abc')
 
+def _push(ref='refs/heads/master', **kwargs):
+    return dict({'ref': ref, 'before': '001', 'after': '002',
+                 'repository': {'full_name': 'weso/ontology'}}, **kwargs)
+
+@mock.patch('hercules_sync.listener.GitPushEventHandler')
+@mock.patch('hercules_sync.listener.JOB_QUEUE')
+def test_on_push_valid(mock_queue, mock_handler):
+    mock_queue.enqueue_unique.return_value = (7, True)
+    data = _push()
+    res = on_push(data)
+    assert res == (202, {'job': 7, 'url': '/jobs/7'})
+    mock_queue.enqueue_unique.assert_called_once_with(('weso/ontology', '001', '002'), 'push',
+                                                      data, key='weso/ontology:refs/heads/master',
+                                                      delay=0.0, merge=None)
+    mock_handler.assert_not_called()
+
+@mock.patch('hercules_sync.listener.JOB_QUEUE')
+def test_on_push_duplicate(mock_queue):
+    mock_queue.enqueue_unique.return_value = (7, False)
+    assert on_push(_push()) == (200, {'job': 7, 'url': '/jobs/7', 'duplicate': True})
+
+@mock.patch('hercules_sync.listener.JOB_QUEUE')
+def test_redelivery_of_failed_job(mock_queue):
+    mock_queue.enqueue_unique.side_effect = [(7, True), (8, True)]
+    mock_queue.get.return_value = {'id': 7, 'status': FAILED}
+    headers = {
+        'content-type': 'application/json',
+        'X-Hub-Signature': 'sha1=8b84bcf8d0fc7f6cba5a7c74446fd3531d87de62',
+        'X-Github-Event': 'push',
+        'X-GitHub-Delivery': 'a1b2c3d4-cc78-11e3-81ab-4c9367dc0958'
+    }
+    data = json.dumps(_push()).encode('utf-8')
+    client = app.test_client()
+    assert client.post('/postreceive', data=data, headers=headers).get_json()['job'] == 7
+    assert client.post('/postreceive', data=data, headers=headers).get_json()['job'] == 8
+    assert mock_queue.enqueue_unique.call_count == 2
+    mock_queue.get.assert_called_once_with(7)
+
+    # deliveries of jobs that didn't fail are replayed
+    mock_queue.get.return_value = {'id': 8, 'status': DONE}
+    assert client.post('/postreceive', data=data, headers=headers).get_json()['job'] == 8
+    assert mock_queue.enqueue_unique.call_count == 2
+
+@mock.patch('hercules_sync.listener.JOB_QUEUE')
+def test_on_push_coalesced(mock_queue):
+    mock_queue.enqueue_unique.return_value = (3, True)
+    data = _push()
+    with mock.patch.dict(app.config, {'PUSH_COALESCE_WINDOW': 30.0}):
+        res = on_push(data)
+    assert res == (202, {'job': 3, 'url': '/jobs/3'})
+    mock_queue.enqueue_unique.assert_called_once_with(('weso/ontology', '001', '002'), 'push',
+                                                      data, key='weso/ontology:refs/heads/master',
+                                                      delay=30.0, merge=merge_pushes)
+
+@mock.patch('hercules_sync.listener.JOB_QUEUE')
+def test_on_push_ignored_ref(mock_queue):
+    res = on_push(_push('refs/heads/develop'))
+    assert res == (200, 'Ignored')
+    mock_queue.enqueue_unique.assert_not_called()
+
+@mock.patch('hercules_sync.listener.JOB_QUEUE')
+def test_on_push_ignored_files(mock_queue):
+    data = _push(commits=[{'added': ['README.md'], 'modified': ['img/logo.png'], 'removed': []}])
+    res = on_push(data)
+    assert res == (200, 'Ignored')
+    mock_queue.enqueue_unique.assert_not_called()
+
+def test_on_push_invalid():
+    with pytest.raises(werkzeug.exceptions.BadRequest):
+        on_push({})
+
 @mock.patch('hercules_sync.listener._extract_ontology_files')
 @mock.patch('hercules_sync.listener._synchronize_files')
-@mock.patch.object(GitPushEventHandler, '__init__', lambda x, y, z: None)
-def test_on_push_valid(mock_synchronize, mock_extract):
-    res = on_push({})
-    assert res == (200, 'Ok')
-    mock_extract.assert_called_once()
+@mock.patch.object(GitPushEventHandler, '__init__', lambda x, y, **kwargs: None)
+def test_process_push(mock_synchronize, mock_extract):
+    files = [GitFile(PatchSet(DIFF)[0], 'source', 'target')]
+    mock_extract.return_value = files
+    mock_synchronize.return_value = {'operations': 3, 'failed': 1}
+    assert _process_push(_push()) == {'operations': 3, 'failed': 1, 'files': 1}
+    mock_synchronize.assert_called_once_with(files, 'weso/ontology')
 
 @mock.patch('hercules_sync.listener._extract_ontology_files')
 @mock.patch('hercules_sync.listener._synchronize_files')
-@mock.patch.object(GitPushEventHandler, '__init__', lambda x, y, z: raise_diff_not_found())
-def test_on_push_diff_not_found(mock_synchronize, mock_extract):
-    res = on_push({})
-    assert res == (200, 'No diff')
+@mock.patch.object(GitPushEventHandler, '__init__', lambda x, y, **kwargs: None)
+def test_process_push_without_files(mock_synchronize, mock_extract):
+    mock_extract.return_value = []
+    assert _process_push(_push()) == {'files': 0}
+    mock_synchronize.assert_not_called()
 
-def test_on_push_invalid():
-    with pytest.raises(werkzeug.exceptions.NotFound):
-        on_push({})
+@mock.patch('hercules_sync.listener._synchronize_files')
+@mock.patch.object(GitPushEventHandler, '__init__', lambda x, y, **kwargs: raise_diff_not_found())
+def test_process_push_diff_not_found(mock_synchronize):
+    assert _process_push(_push()) == {'files': 0, 'message': 'No diff'}
+    mock_synchronize.assert_not_called()
+
+@mock.patch('hercules_sync.listener.JOB_QUEUE')
+def test_get_job(mock_queue):
+    job = {'id': 1, 'status': 'running', 'stage': 'fetching', 'timings': {'running': 0.1}}
+    mock_queue.get.side_effect = lambda job_id: job if job_id == 1 else None
+    client = app.test_client()
+    res = client.get('/jobs/1')
+    assert res.status_code == 200
+    assert res.get_json() == job
+    assert client.get('/jobs/2').status_code == 404
+
+@mock.patch('hercules_sync.listener.JOB_QUEUE')
+def test_get_metrics(mock_queue):
+    mock_queue.depth.return_value = 4
+    res = app.test_client().get('/metrics')
+    assert res.status_code == 200
+    assert res.mimetype == 'text/plain'
+    body = res.get_data(as_text=True)
+    assert '# TYPE hercules_wikibase_write_seconds histogram' in body
+    assert 'hercules_job_queue_depth' in body
 
 def test_extract_files():
     handler = mock.MagicMock()
@@ -75,6 +230,38 @@ def test_extract_files():
 
     assert _extract_ontology_files(handler, 'ttl', _filter_asio_files) == []
 
+def test_collect_uri_elements():
+    researcher = URIElement('http://example.org/Researcher')
+    name = URIElement('http://example.org/name')
+    ops = [AdditionOperation(researcher, URIElement(RDFS_LABEL), LiteralElement('Investigador', lang='es')),
+           AdditionOperation(researcher, name, LiteralElement('John')),
+           AdditionOperation(researcher, URIElement('http://example.org/knows'),
+                             URIElement('http://example.org/Other'))]
+    elements = _collect_uri_elements(ops)
+    assert [element.uri for element in elements] == [
+        'http://example.org/Researcher',
+        'http://example.org/Researcher', 'http://example.org/name',
+        'http://example.org/Researcher', 'http://example.org/Other', 'http://example.org/knows'
+    ]
+    assert elements[2].etype == 'property'
+    assert name.etype == 'item'
+
+@mock.patch('hercules_sync.uris_factory._SHARED', None)
+@mock.patch('hercules_sync.uris_factory.URIS_FACTORY', None)
+@mock.patch('hercules_sync.uris_factory.WBAPI', None)
+@mock.patch('hercules_sync.parallel.SyncProcessPool')
+@mock.patch('hercules_sync.listener.SYNC_POOL', None)
+@mock.patch('hercules_sync.listener.ADAPTER_POOL', None)
+def test_load_sync_dependencies(mock_pool):
+    from hercules_sync import uris_factory
+
+    _load_sync_dependencies()
+    mock_pool.return_value.start.assert_called_once_with()
+    assert uris_factory.URIS_FACTORY == app.config['URIS_FACTORY']
+    # dependencies are only loaded once
+    _load_sync_dependencies()
+    assert mock_pool.call_count == 1
+
 @mock.patch('wbsync.triplestore.WikibaseAdapter')
 @mock.patch('wbsync.triplestore.WikibaseAdapter.__init__', return_value=None)
 @mock.patch('wbsync.synchronization.GraphDiffSyncAlgorithm')
@@ -0,0 +1,51 @@
+import pytest
+
+from hercules_sync.metrics import Counter, Gauge, Histogram, Registry
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+def test_counter(registry):
+    counter = Counter('test_calls', 'Calls received.', ['method'], registry=registry)
+    counter.labels(method='get').inc()
+    counter.labels('get').inc(2)
+    counter.labels(method='post').inc()
+    assert registry.render() == (
+        '# HELP test_calls Calls received.\n'
+        '# TYPE test_calls counter\n'
+        'test_calls_total{method="get"} 3\n'
+        'test_calls_total{method="post"} 1\n'
+    )
+    with pytest.raises(ValueError):
+        counter.labels(method='get').inc(-1)
+    with pytest.raises(ValueError):
+        counter.inc()
+
+def test_gauge(registry):
+    gauge = Gauge('test_depth', 'Queue depth.', registry=registry)
+    gauge.set(3)
+    assert 'test_depth 3\n' in registry.render()
+    gauge.set_function(lambda: 7)
+    assert 'test_depth 7\n' in registry.render()
+
+def test_histogram(registry):
+    histogram = Histogram('test_seconds', 'Duration.', ['stage'], registry=registry,
+                          buckets=(0.1, 1.0))
+    histogram.labels(stage='fetch').observe(0.05)
+    histogram.labels(stage='fetch').observe(0.5)
+    histogram.labels(stage='fetch').observe(5)
+    with histogram.labels(stage='parse').time():
+        pass
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{stage="fetch",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="fetch",le="1"} 2' in lines
+    assert 'test_seconds_bucket{stage="fetch",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="fetch"} 3' in lines
+    assert 'test_seconds_sum{stage="fetch"} 5.55' in lines
+    assert 'test_seconds_count{stage="parse"} 1' in lines
+
+def test_label_values_are_escaped(registry):
+    counter = Counter('test_errors', 'Errors.', ['message'], registry=registry)
+    counter.labels(message='invalid "value"\n').inc()
+    assert 'test_errors_total{message="invalid \\"value\\"\\n"} 1' in registry.render()
@@ -0,0 +1,97 @@
+import os
+import subprocess
+
+import pytest
+
+from hercules_sync.git import DiffNotFoundError, GitPushEventHandler, InvalidCommitError
+from hercules_sync.mirror import GitMirrorBackend, MirrorDataLoader
+
+REPO_NAME = 'weso/ontology'
+
+def _git(repo_dir, *args):
+    return subprocess.run(['git', '-C', repo_dir, '-c', 'user.name=test',
+                           '-c', 'user.email=test@example.org', *args],
+                          check=True, stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+
+def _commit_files(repo_dir, files, removed=()):
+    for path, content in files.items():
+        with open(os.path.join(repo_dir, path), 'w') as f:
+            f.write(content)
+    for path in removed:
+        _git(repo_dir, 'rm', '--quiet', path)
+    _git(repo_dir, 'add', '--all')
+    _git(repo_dir, 'commit', '--quiet', '-m', 'test commit')
+    return _git(repo_dir, 'rev-parse', 'HEAD')
+
+@pytest.fixture
+def remote_repo(tmpdir):
+    repo_dir = str(tmpdir.join('remote', REPO_NAME))
+    os.makedirs(repo_dir)
+    _git(repo_dir, 'init', '--quiet')
+    before = _commit_files(repo_dir, {'modified.ttl': 'a\nb\nc\n', 'removed.ttl': 'r\n'})
+    after = _commit_files(repo_dir, {'modified.ttl': 'a\nB\nc\n', 'added.ttl': 'new\n'},
+                          removed=['removed.ttl'])
+    return {'before': before, 'after': after}
+
+@pytest.fixture
+def backend(tmpdir):
+    backend = GitMirrorBackend(str(tmpdir.join('mirrors')),
+                               str(tmpdir.join('remote', '{repo}')))
+    yield backend
+    backend.close()
+
+def _push_data(before, after):
+    return {
+        'before': before,
+        'after': after,
+        'repository': {
+            'full_name': REPO_NAME
+        }
+    }
+
+def test_mirror_push_files(remote_repo, backend):
+    handler = GitPushEventHandler(_push_data(remote_repo['before'], remote_repo['after']),
+                                  backend=backend)
+    added, = handler.added_files
+    assert added.path == 'added.ttl'
+    assert added.source_content == ''
+    assert added.target_content == 'new\n'
+
+    modified, = handler.modified_files
+    assert modified.path == 'modified.ttl'
+    assert modified.source_content == 'a\nb\nc\n'
+    assert modified.target_content == 'a\nB\nc\n'
+    assert modified.added_lines == [('B\n', 2)]
+    assert modified.removed_lines == [('b\n', 2)]
+
+    removed, = handler.removed_files
+    assert removed.path == 'removed.ttl'
+    assert removed.source_content == 'r\n'
+    assert removed.target_content == ''
+
+def test_mirror_is_reused(remote_repo, backend):
+    data = _push_data(remote_repo['before'], remote_repo['after'])
+    GitPushEventHandler(data, backend=backend)
+    mirror = backend.get_mirror(REPO_NAME)
+    assert os.path.isdir(mirror.path)
+    assert backend.get_mirror(REPO_NAME) is mirror
+
+def test_mirror_diff_not_found(remote_repo, backend):
+    with pytest.raises(DiffNotFoundError):
+        GitPushEventHandler(_push_data('0' * 40, remote_repo['after']), backend=backend)
+
+def test_mirror_invalid_commit(remote_repo, backend):
+    handler = GitPushEventHandler(_push_data(remote_repo['before'], remote_repo['after']),
+                                  backend=backend)
+    invalid_ref = '1234567'
+    handler.data_loader = MirrorDataLoader(backend.get_mirror(REPO_NAME), invalid_ref,
+                                           remote_repo['after'])
+    with pytest.raises(InvalidCommitError) as err:
+        _ = list(handler.added_files)
+    assert f"Commit {invalid_ref} was not found" in str(err.value)
+
+def test_mirror_missing_file_with_spaces(remote_repo, backend):
+    GitPushEventHandler(_push_data(remote_repo['before'], remote_repo['after']), backend=backend)
+    mirror = backend.get_mirror(REPO_NAME)
+    assert mirror.read_file(remote_repo['after'], 'missing dir/missing file.ttl') == ''
+    assert mirror.read_file(remote_repo['after'], 'added.ttl') == 'new\n'
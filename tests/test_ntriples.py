@@ -0,0 +1,123 @@
+from hercules_sync.git import GitFile
+from hercules_sync.ntriples import as_ntriples, compute_line_operations, is_line_based
+from hercules_sync.parallel import SyncProcessPool
+from unidiff import PatchSet
+from wbsync.util.uri_constants import ASIO_BASE
+
+SOURCE = '''<http://example.org/a> <http://example.org/knows> <http://example.org/b> .
+<http://example.org/name> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/2002/07/owl#DatatypeProperty> .
+<http://example.org/a> <http://example.org/name> "Old" .
+<http://example.org/c> <http://example.org/knows> <http://example.org/a> .
+'''
+
+TARGET = '''<http://example.org/c> <http://example.org/knows> <http://example.org/a> .
+<http://example.org/a> <http://example.org/knows> <http://example.org/b> .
+<http://example.org/name> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/2002/07/owl#DatatypeProperty> .
+<http://example.org/a> <http://example.org/name> "New"@en .
+'''
+
+DIFF = '''diff --git a/ontology.nt b/ontology.nt
+index 0000001..0000002 100644
+--- a/ontology.nt
++++ b/ontology.nt
+@@ -1,4 +1,4 @@
++<http://example.org/c> <http://example.org/knows> <http://example.org/a> .
+ <http://example.org/a> <http://example.org/knows> <http://example.org/b> .
+ <http://example.org/name> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/2002/07/owl#DatatypeProperty> .
+-<http://example.org/a> <http://example.org/name> "Old" .
+-<http://example.org/c> <http://example.org/knows> <http://example.org/a> .
++<http://example.org/a> <http://example.org/name> "New"@en .
+'''
+
+def _file(diff=DIFF, source=SOURCE, target=TARGET):
+    return GitFile(PatchSet(diff)[0], source, target)
+
+def _summary(ops):
+    return [(type(op).__name__, tuple(str(element) for element in op._triple_info.content))
+            for op in ops]
+
+def test_is_line_based():
+    assert is_line_based('ontology/data.nt')
+    assert is_line_based('data.NQ')
+    assert not is_line_based('ontology.ttl')
+    assert not is_line_based('Makefile')
+
+def test_compute_line_operations():
+    ops = compute_line_operations(_file())
+    # the moved line doesn't generate operations
+    assert [(type(op).__name__, op._triple_info.object.content) for op in ops] == \
+        [('RemovalOperation', 'Old'), ('AdditionOperation', 'New')]
+    predicate = ops[1]._triple_info.predicate
+    assert predicate.etype == 'property'
+    assert predicate.proptype == 'http://www.w3.org/2001/XMLSchema#string'
+
+def test_compute_line_operations_blank_nodes():
+    diff = DIFF.replace('"New"@en', '_:b0')
+    assert compute_line_operations(_file(diff)) is None
+
+def test_compute_line_operations_nquads():
+    diff = DIFF.replace('ontology.nt', 'ontology.nq') \
+               .replace('"New"@en .', '"New"@en <http://example.org/graph> .')
+    ops = compute_line_operations(_file(diff))
+    assert [name for name, _ in _summary(ops)] == ['RemovalOperation', 'AdditionOperation']
+
+def test_as_ntriples():
+    content = '<http://example.org/a> <http://example.org/p> "b" <http://example.org/graph> .\n'
+    assert as_ntriples('ontology.nt', SOURCE) == SOURCE
+    assert as_ntriples('ontology.nq', content).strip() == \
+        '<http://example.org/a> <http://example.org/p> "b" .'
+
+def test_pool_uses_line_operations():
+    blank_diff = DIFF.replace('"New"@en', '_:b0')
+    blank_target = TARGET.replace('"New"@en', '_:b0')
+    files = [_file(), _file(blank_diff, target=blank_target)]
+    ops = SyncProcessPool(0).compute_operations(files)
+    assert _summary(ops)[:2] == _summary(compute_line_operations(files[0]))
+    # the file with blank nodes is compared with the full graphs
+    assert [name for name, _ in _summary(ops)[2:]] == ['RemovalOperation', 'AdditionOperation']
+
+def test_compute_line_operations_triples_in_other_lines():
+    quad = '<http://example.org/a> <http://example.org/name> "Old" <http://example.org/g{}> .\n'
+    source = quad.format(1) + quad.format(2)
+    diff = f'''diff --git a/ontology.nq b/ontology.nq
+index 0000001..0000002 100644
+--- a/ontology.nq
++++ b/ontology.nq
+@@ -1,2 +1,2 @@
+-{quad.format(1)} {quad.format(2)}+{quad.format(3)}'''
+    # the triple is still in the file, moved from the graph g1 to g3
+    assert compute_line_operations(_file(diff, source, quad.format(2) + quad.format(3))) == []
+
+    line = SOURCE.splitlines(True)[2]
+    diff = f'''diff --git a/ontology.nt b/ontology.nt
+index 0000001..0000002 100644
+--- a/ontology.nt
++++ b/ontology.nt
+@@ -1,2 +1,1 @@
+-{line} {line}'''
+    assert compute_line_operations(_file(diff, line + line, line)) == []
+    diff = diff.replace('@@ -1,2 +1,1 @@\n-', '@@ -1,1 +1,2 @@\n+')
+    assert compute_line_operations(_file(diff, line, line + line)) == []
+
+def test_compute_line_operations_object_properties():
+    declarations = '''<http://example.org/knows> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/2002/07/owl#ObjectProperty> .
+<http://example.org/knows> <http://www.w3.org/2000/01/rdf-schema#range> <http://example.org/Person> .
+<http://example.org/sameProperty> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/2002/07/owl#ObjectProperty> .
+<http://example.org/sameProperty> <http://www.w3.org/2000/01/rdf-schema#range> <http://example.org/knows> .
+'''
+    added = '''<http://example.org/a> <http://example.org/knows> <http://example.org/d> .
+<http://example.org/a> <http://example.org/sameProperty> <http://example.org/knows> .
+'''
+    diff = '''diff --git a/ontology.nt b/ontology.nt
+index 0000001..0000002 100644
+--- a/ontology.nt
++++ b/ontology.nt
+@@ -1,4 +1,6 @@
+''' + ''.join(' ' + line for line in declarations.splitlines(True)) + \
+        ''.join('+' + line for line in added.splitlines(True))
+    ops = compute_line_operations(_file(diff, declarations, declarations + added))
+    proptypes = {op._triple_info.predicate.uri: op._triple_info.predicate.proptype
+                 for op in ops}
+    # the declarations are read from the unchanged lines of the file
+    assert proptypes == {'http://example.org/knows': ASIO_BASE + 'item',
+                         'http://example.org/sameProperty': ASIO_BASE + 'property'}
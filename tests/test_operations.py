@@ -0,0 +1,56 @@
+from unittest import mock
+
+from hercules_sync.operations import execute_operations, group_operations
+from wbsync.synchronization import AdditionOperation, RemovalOperation
+from wbsync.triplestore import AnonymousElement, LiteralElement, ModificationResult, URIElement
+
+EX = 'http://example.org/'
+
+def _ops():
+    researcher = URIElement(EX + 'Researcher')
+    return [
+        AdditionOperation(researcher, URIElement(EX + 'p'), URIElement(EX + 'a')),
+        AdditionOperation(URIElement(EX + 'Project'), URIElement(EX + 'p'), URIElement(EX + 'b')),
+        RemovalOperation(URIElement(EX + 'Researcher'), URIElement(EX + 'q'), LiteralElement('c')),
+        AdditionOperation(AnonymousElement('_:b0'), URIElement(EX + 'p'), LiteralElement('d'))
+    ]
+
+def test_group_operations():
+    ops = _ops()
+    groups = group_operations(ops)
+    assert [group for _, group in groups] == [[ops[0], ops[2]], [ops[1]], [ops[3]]]
+    batch, _ = groups[0]
+    assert batch.subject.uri == EX + 'Researcher'
+    assert [triple.isAdded for triple in batch.triples] == [True, False]
+
+def test_execute_operations_per_triple():
+    store = mock.MagicMock()
+    store.create_triple.return_value = ModificationResult(True)
+    store.remove_triple.return_value = ModificationResult(True)
+    results = execute_operations(_ops(), store)
+    assert len(results) == 4
+    assert store.create_triple.call_count == 3
+    store.batch_update.assert_not_called()
+
+def test_execute_operations_batched():
+    store = mock.MagicMock()
+    store.create_triple.return_value = ModificationResult(True)
+    store.batch_update.return_value = ModificationResult(True, res='Q1')
+    ops = _ops()
+    results = execute_operations(ops, store, batched=True)
+    assert [op for op, _ in results] == [ops[0], ops[2], ops[1], ops[3]]
+    assert all(res.successful for _, res in results)
+    store.batch_update.assert_called_once()
+    assert store.create_triple.call_count == 2
+    store.remove_triple.assert_not_called()
+
+def test_execute_operations_batch_fallback():
+    store = mock.MagicMock()
+    store.batch_update.return_value = ModificationResult(False, message='Edit conflict')
+    store.create_triple.return_value = ModificationResult(True)
+    store.remove_triple.return_value = ModificationResult(False, message='Invalid value')
+    ops = _ops()
+    results = execute_operations(ops, store, batched=True)
+    assert [op for op, _ in results] == [ops[0], ops[2], ops[1], ops[3]]
+    assert results[0][1].successful
+    assert results[1][1].message == 'Invalid value'
@@ -0,0 +1,57 @@
+from unittest import mock
+
+import pytest
+
+from hercules_sync.git import GitFile
+from hercules_sync.graphs import GraphCache
+from hercules_sync.parallel import SyncProcessPool
+from hercules_sync.tracing import trace
+
+PREFIXES = '@prefix ex: <http://example.org/> .\n'
+
+def _file(source, target):
+    return GitFile(mock.Mock(path='ontology.ttl'), PREFIXES + source, PREFIXES + target)
+
+def _summary(ops):
+    return [(type(op).__name__, tuple(str(element) for element in op._triple_info.content))
+            for op in ops]
+
+@pytest.fixture
+def files():
+    return [_file('ex:a ex:p ex:b .\n', 'ex:a ex:p ex:c .\n'),
+            _file('', 'ex:d ex:p ex:e .\nex:d ex:q ex:f .\n'),
+            _file('ex:g ex:p ex:h .\n', '')]
+
+def test_compute_operations_in_process(files):
+    ops = SyncProcessPool(0).compute_operations(files)
+    assert [name for name, _ in _summary(ops)] == \
+        ['RemovalOperation', 'AdditionOperation', 'AdditionOperation', 'AdditionOperation',
+         'RemovalOperation']
+
+def test_compute_operations_in_pool(files):
+    pool = SyncProcessPool(2)
+    try:
+        pool.start()
+        ops = pool.compute_operations(files)
+    finally:
+        pool.shutdown()
+    assert sorted(_summary(ops)) == sorted(_summary(SyncProcessPool(0).compute_operations(files)))
+    # operations are returned following the order of the files
+    assert _summary(ops)[-1][0] == 'RemovalOperation'
+
+def test_pool_keeps_graphs_in_workers(files):
+    pool = SyncProcessPool(2, GraphCache(4))
+    for i, file in enumerate(files):
+        file._patched_file.path = f'ontology{i}.ttl'
+    updated = [GitFile(file._patched_file, file.target_content, PREFIXES + 'ex:z ex:p ex:y .\n')
+               for file in files]
+    try:
+        pool.compute_operations(files, 'weso/ontology')
+        with mock.patch('hercules_sync.tracing._EXPORTER'), trace('push') as root:
+            ops = pool.compute_operations(updated, 'weso/ontology')
+    finally:
+        pool.shutdown()
+    # every file was sent to the worker that parsed its previous version
+    assert [child.attributes['cached_source'] for child in root.children] == [True] * 3
+    assert pool.graph_cache.stats()['size'] == 0
+    assert sorted(_summary(ops)) == sorted(_summary(SyncProcessPool(0).compute_operations(updated)))
@@ -0,0 +1,63 @@
+import pytest
+
+from hercules_sync.rules import RuleSet, SyncRule
+from wbsync.util.error import InvalidConfigError
+
+def _push(ref='refs/heads/master', repo='weso/hercules-ontology', files=None, **kwargs):
+    data = {
+        'ref': ref,
+        'repository': {
+            'full_name': repo
+        }
+    }
+    if files is not None:
+        data['commits'] = [{'added': files, 'modified': [], 'removed': []}]
+    data.update(kwargs)
+    return data
+
+def test_rule_defaults():
+    rule = SyncRule()
+    assert rule.applies_to('any/repo', 'refs/heads/any')
+    assert rule.matches_path('README.md')
+    assert rule.matches_path('src/ontology.ttl')
+
+def test_rule_branch_names():
+    rule = SyncRule(refs=['master', 'refs/tags/v*'])
+    assert rule.applies_to('repo', 'refs/heads/master')
+    assert rule.applies_to('repo', 'refs/tags/v1.0')
+    assert not rule.applies_to('repo', 'refs/heads/develop')
+
+def test_rule_paths_and_formats():
+    rule = SyncRule(paths=['*current/*'], formats=['.TTL', 'nt'])
+    assert rule.matches_path('ontology/current/asio.ttl')
+    assert rule.matches_path('ontology/current/asio.nt')
+    assert not rule.matches_path('ontology/current/README.md')
+    assert not rule.matches_path('ontology/old/asio.ttl')
+
+def test_rule_unknown_keys():
+    with pytest.raises(InvalidConfigError):
+        SyncRule.from_dict({'format': ['ttl']})
+
+def test_ruleset_repository():
+    rules = RuleSet.from_config([{'repository': 'weso/*', 'formats': ['ttl']}])
+    assert rules.matches_push(_push())
+    assert not rules.matches_push(_push(repo='other/hercules-ontology'))
+
+def test_ruleset_payload_files():
+    rules = RuleSet.from_config([{'formats': ['ttl']}])
+    assert rules.matches_push(_push(files=['docs/README.md', 'asio.ttl']))
+    assert not rules.matches_push(_push(files=['docs/README.md', 'img/logo.png']))
+
+def test_ruleset_incomplete_payload():
+    rules = RuleSet.from_config([{'formats': ['ttl']}])
+    assert rules.matches_push(_push(files=['README.md'], forced=True))
+    truncated = _push()
+    truncated['commits'] = [{'added': ['README.md']}] * 20
+    assert rules.matches_push(truncated)
+
+def test_ruleset_path_filter():
+    rules = RuleSet.from_config([{'refs': ['master'], 'formats': ['ttl']},
+                                 {'refs': ['develop'], 'formats': ['nt']}])
+    path_filter = rules.path_filter(_push(ref='refs/heads/develop'))
+    assert path_filter('asio.nt')
+    assert not path_filter('asio.ttl')
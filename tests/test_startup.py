@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# maximum time in seconds to import the package and create the app
+STARTUP_BUDGET = 1.0
+# dependencies that are only loaded by the synchronization jobs
+SYNC_MODULES = ['numpy', 'ontospy', 'pandas', 'rdflib', 'wbsync.synchronization',
+                'wbsync.triplestore', 'wikidataintegrator']
+
+STARTUP_SCRIPT = '''
+import json
+import sys
+import time
+
+start = time.perf_counter()
+from hercules_sync import create_app
+create_app()
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))
+'''
+
+def _run_startup():
+    # the server is started in a new process, so nothing is imported beforehand
+    env = dict(os.environ, JOB_QUEUE_PATH=':memory:', TRACE_EXPORT='none',
+               SYNC_WARM_UP='false')
+    res = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=ROOT_DIR, env=env,
+                         stdout=subprocess.PIPE, check=True, timeout=60)
+    return json.loads(res.stdout.decode('utf-8').splitlines()[-1])
+
+def test_sync_modules_are_not_imported_at_startup():
+    modules = _run_startup()['modules']
+    assert [module for module in SYNC_MODULES if module in modules] == []
+
+def test_startup_time_budget():
+    elapsed = min(_run_startup()['elapsed'] for _ in range(3))
+    assert elapsed < STARTUP_BUDGET
@@ -0,0 +1,105 @@
+import json
+import logging
+import threading
+
+import pytest
+
+from hercules_sync.tracing import _ThreadLocalVar, bind_span, configure_tracing, record_span, \
+                                  span, trace
+
+@pytest.fixture(autouse=True)
+def log_exporter():
+    configure_tracing('log')
+    yield
+    configure_tracing('log')
+
+def test_spans_without_trace():
+    with span('orphan') as current_span:
+        assert current_span is None
+    record_span('orphan', 1.0)
+
+def test_nested_spans(caplog):
+    with caplog.at_level(logging.INFO, logger='hercules_sync.tracing'):
+        with trace('push', repository='weso/ontology') as root:
+            with span('GitDiffParser.load_diff'):
+                pass
+            with span('op.execute', type='addition') as op_span:
+                with span('HerculesURIsFactory.get_uri', uri='Researcher'):
+                    pass
+                op_span.set_attribute('successful', True)
+            record_span('OntologySynchronizer.synchronize', 0.5, path='ontology.ttl')
+
+    assert root.duration is not None
+    records = [json.loads(record.getMessage()) for record in caplog.records]
+    assert len(records) == 1
+    exported = records[0]
+    assert exported['trace_id'] == root.trace_id
+    assert exported['name'] == 'push'
+    assert exported['attributes'] == {'repository': 'weso/ontology'}
+    assert [child['name'] for child in exported['children']] == \
+        ['GitDiffParser.load_diff', 'op.execute', 'OntologySynchronizer.synchronize']
+    op_span = exported['children'][1]
+    assert op_span['attributes'] == {'type': 'addition', 'successful': True}
+    assert op_span['children'][0]['name'] == 'HerculesURIsFactory.get_uri'
+    assert exported['children'][2]['duration_ms'] == 500.0
+
+def test_spans_of_failed_blocks(caplog):
+    with caplog.at_level(logging.INFO, logger='hercules_sync.tracing'):
+        with pytest.raises(ValueError):
+            with trace('push'):
+                with span('GitDataLoader._load_file'):
+                    raise ValueError('invalid commit')
+    exported = json.loads(caplog.records[0].getMessage())
+    assert 'invalid commit' in exported['error']
+    assert 'invalid commit' in exported['children'][0]['error']
+
+def test_spans_of_threads_bound_to_the_span():
+    with trace('push') as root:
+        threads = [threading.Thread(target=bind_span(_child_span), args=(i,)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert sorted(child.attributes['index'] for child in root.children) == [0, 1, 2]
+
+def _child_span(index):
+    with span('child', index=index):
+        pass
+
+def test_thread_local_var():
+    var = _ThreadLocalVar('span')
+    token = var.set('root')
+    values = []
+    thread = threading.Thread(target=lambda: values.append(var.get()))
+    thread.start()
+    thread.join()
+    assert values == [None]
+    assert var.get() == 'root'
+    var.reset(token)
+    assert var.get() is None
+
+def test_file_exporter(tmpdir):
+    path = str(tmpdir.join('traces.jsonl'))
+    configure_tracing('file', path)
+    with trace('push', files=2):
+        with span('op.execute'):
+            pass
+    with trace('push'):
+        pass
+    with open(path) as trace_file:
+        lines = [json.loads(line) for line in trace_file]
+    assert len(lines) == 2
+    spans = lines[0]['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert [s['name'] for s in spans] == ['push', 'op.execute']
+    assert spans[1]['parentSpanId'] == spans[0]['spanId']
+    assert spans[1]['traceId'] == spans[0]['traceId']
+    assert spans[0]['attributes'] == [{'key': 'files', 'value': {'intValue': '2'}}]
+    assert int(spans[0]['endTimeUnixNano']) >= int(spans[1]['endTimeUnixNano'])
+
+def test_disabled_tracing():
+    configure_tracing('none')
+    with trace('push') as root:
+        with span('op.execute') as child:
+            pass
+    assert root is None
+    assert child is None
@@ -0,0 +1,202 @@
+import json
+
+from unittest import mock
+
+import pytest
+
+from hercules_sync import uris_factory
+from hercules_sync.cache import TTLCache
+from hercules_sync.uris_factory import HerculesURIsFactory, URIWriteBehind, \
+                                       configure_uris_factory
+from wbsync.triplestore import URIElement
+
+CANONICAL_RESPONSE = {
+    'canonicalURI': 'http://hercules.org/um/es-ES/res/Researcher',
+    'canonicalLanguageURI': 'http://hercules.org/um/es-ES/rec/Investigador',
+    'language': 'es-ES'
+}
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def _response(content):
+    return mock.Mock(content=json.dumps(content).encode('utf-8'))
+
+@pytest.fixture(autouse=True)
+def urls():
+    with mock.patch('hercules_sync.uris_factory.URIS_FACTORY', 'http://factory/'), \
+         mock.patch('hercules_sync.uris_factory.WBAPI', 'http://wb/'):
+        yield
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def factory(clock):
+    return HerculesURIsFactory(TTLCache(10, 100, clock), TTLCache(10, 100, clock),
+                               negative_ttl=10, writer=None)
+
+@pytest.fixture
+def session():
+    with mock.patch('hercules_sync.uris_factory.SESSION') as session:
+        session.post = mock.MagicMock(return_value=_response(CANONICAL_RESPONSE))
+        yield session
+
+def test_ttl_cache_expiration(clock):
+    cache = TTLCache(10, 5, clock)
+    cache.set('key', 'value')
+    cache.set('negative', None, ttl=1)
+    assert cache.get('key') == 'value'
+    clock.now = 2
+    assert cache.get('negative', 'missing') == 'missing'
+    assert cache.get('key') == 'value'
+    clock.now = 5
+    assert cache.get('key') is None
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'size': 0}
+
+def test_ttl_cache_max_size(clock):
+    cache = TTLCache(2, 5, clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert len(cache) == 2
+
+def test_get_uri_is_cached(factory, session):
+    session.get = mock.MagicMock(return_value=_response(
+        [{'localUri': 'http://wb/wiki/Item:Q7'}]))
+    uriref = URIElement('http://example.org/ontology#Researcher')
+    assert factory.get_uri(uriref) == 'Q7'
+    assert factory.get_uri(uriref) == 'Q7'
+    assert session.post.call_count == 1
+    assert session.get.call_count == 1
+    assert factory.cache_stats()['local']['hits'] == 1
+
+def test_get_uri_negative_results(factory, session, clock):
+    session.get = mock.MagicMock(return_value=_response([]))
+    uriref = URIElement('http://example.org/ontology#Researcher')
+    assert factory.get_uri(uriref) is None
+    assert factory.get_uri(uriref) is None
+    assert session.get.call_count == 1
+    clock.now = 10
+    assert factory.get_uri(uriref) is None
+    assert session.get.call_count == 2
+    # the canonical uri is still cached
+    assert session.post.call_count == 1
+
+def test_post_uri_updates_cache(factory, session):
+    session.get = mock.MagicMock(return_value=_response([]))
+    uriref = URIElement('http://example.org/ontology#hasName', etype='property')
+    assert factory.get_uri(uriref) is None
+    assert factory.post_uri(uriref, 'P3') == 'P3'
+    assert factory.get_uri(uriref) == 'P3'
+    assert session.get.call_count == 1
+    # canonical post of the factory and local post of the new uri
+    assert session.post.call_count == 2
+    _, kwargs = session.post.call_args
+    assert kwargs['params']['localURI'].endswith('wiki/Property:P3')
+
+def test_resolve_all(factory, session):
+    session.get = mock.MagicMock(side_effect=[
+        _response([{'localUri': 'http://wb/wiki/Item:Q1'}]),
+        _response([])
+    ])
+    urirefs = [URIElement('http://example.org/ontology#Researcher'),
+               URIElement('http://example.org/ontology#Researcher'),
+               URIElement('http://example.org/ontology#hasName', etype='property')]
+    assert factory.resolve_all(urirefs, max_workers=1) == 1
+    assert session.get.call_count == 2
+
+    assert factory.get_uri(urirefs[0]) == 'Q1'
+    assert factory.get_uri(urirefs[2]) is None
+    assert session.get.call_count == 2
+
+def test_resolve_all_errors(factory, session):
+    session.get = mock.MagicMock(side_effect=ValueError('invalid response'))
+    uriref = URIElement('http://example.org/ontology#Researcher')
+    assert factory.resolve_all([uriref]) == 0
+    assert factory.cache_stats()['local']['size'] == 0
+
+@mock.patch('hercules_sync.uris_factory.WBAPI', 'http://wb/')
+def test_write_behind(session):
+    writer = URIWriteBehind(batch_size=2, interval=60, retries=0, backoff=0)
+    factory = HerculesURIsFactory(TTLCache(10, 100), TTLCache(10, 100), writer=writer)
+    session.get = mock.MagicMock(return_value=_response([]))
+    uriref = URIElement('http://example.org/ontology#Researcher')
+    assert factory.post_uri(uriref, 'Q1') == 'Q1'
+    # the new uri is visible before it is sent
+    assert factory.get_uri(uriref) == 'Q1'
+    assert session.get.call_count == 0
+
+    factory.post_uri(URIElement('http://example.org/ontology#Project'), 'Q2')
+    factory.post_uri(URIElement('http://example.org/ontology#hasName', etype='property'), 'P1')
+    assert factory.flush(timeout=10)
+    assert len(writer) == 0
+    assert writer.sent == 3
+    local_uris = [kwargs['params']['localURI'] for _, kwargs in session.post.call_args_list
+                  if 'localURI' in kwargs['params']]
+    assert sorted(local_uris) == ['http://wb/wiki/Item:Q1', 'http://wb/wiki/Item:Q2',
+                                  'http://wb/wiki/Property:P1']
+
+def test_write_behind_retries(session):
+    failure = mock.Mock()
+    failure.raise_for_status.side_effect = ValueError('500 Server Error')
+    session.post = mock.MagicMock(side_effect=[
+        _response(CANONICAL_RESPONSE), failure, _response({}),
+        _response(CANONICAL_RESPONSE), failure, failure
+    ])
+    writer = URIWriteBehind(batch_size=10, interval=0, retries=1, backoff=0)
+    factory = HerculesURIsFactory(TTLCache(10, 100), TTLCache(10, 100), writer=writer)
+    factory.post_uri(URIElement('http://example.org/ontology#Researcher'), 'Q1')
+    assert factory.flush(timeout=10)
+    assert writer.sent == 1
+
+    factory.post_uri(URIElement('http://example.org/ontology#Project'), 'Q2')
+    assert not factory.flush(timeout=10)
+    assert writer.failed == 1
+
+def test_write_behind_failures_of_each_factory(session):
+    writer = URIWriteBehind(batch_size=10, interval=0, retries=0, backoff=0)
+    failing = HerculesURIsFactory(TTLCache(10, 100), TTLCache(10, 100), writer=writer)
+    working = HerculesURIsFactory(TTLCache(10, 100), TTLCache(10, 100), writer=writer)
+    failing._send_local_uri = mock.Mock(side_effect=ValueError('500 Server Error'))
+    working._send_local_uri = mock.Mock()
+    failing.post_uri(URIElement('http://example.org/ontology#Researcher'), 'Q1')
+    working.post_uri(URIElement('http://example.org/ontology#Project'), 'Q2')
+    # the failures of one job don't affect the flush of another one
+    assert working.flush(timeout=10)
+    assert not failing.flush(timeout=10)
+    assert failing.flush(timeout=10)
+    assert writer.sent == 1
+    assert writer.failed == 1
+
+def test_flush_without_writer(factory):
+    assert factory.flush()
+
+@mock.patch('hercules_sync.uris_factory._SHARED', None)
+def test_shared_configuration():
+    # the shared objects are created on first use with the default settings
+    assert HerculesURIsFactory().writer is None
+    shared = configure_uris_factory(cache_size=5, negative_ttl=1, write_behind=True)
+    factory = HerculesURIsFactory()
+    assert factory.local_cache is shared['local_cache']
+    assert factory.local_cache.max_size == 5
+    assert factory.negative_ttl == 1
+    assert factory.writer is shared['writer']
+    assert HerculesURIsFactory().writer is factory.writer
+
+@mock.patch('hercules_sync.uris_factory._SHARED', None)
+def test_configure_urls():
+    configure_uris_factory(factory_url='http://factory/', wikibase_api='http://wb/w/api.php')
+    assert uris_factory.URIS_FACTORY == 'http://factory/'
+    assert uris_factory.WBAPI == 'http://wb/'
+    # the urls are kept when they are not given again
+    configure_uris_factory(cache_size=5)
+    assert uris_factory.URIS_FACTORY == 'http://factory/'
@@ -0,0 +1,128 @@
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from hercules_sync.cache import TTLCache
+from hercules_sync.uris_factory import HerculesURIsFactory, warm_up_uris_cache
+from hercules_sync.uris_store import URIMappingStore
+from wbsync.triplestore import URIElement
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """ Same as http.server.ThreadingHTTPServer, which needs Python 3.7. """
+    daemon_threads = True
+
+class FakeFactoryHandler(BaseHTTPRequestHandler):
+    """ Minimal stand-in of the URIs factory that keeps the local uris in memory. """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        self.server.requests.append(('GET', url.path))
+        canonical = params['canonicalUri'][0]
+        local_uri = self.server.local_uris.get(canonical)
+        self._send_json([{'localUri': local_uri}] if local_uri else [])
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        self.server.requests.append(('POST', url.path))
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if url.path.endswith('/local'):
+            canonical = params['canonicalLanguageURI'][0].replace('/rec/', '/res/')
+            self.server.local_uris[canonical] = params['localURI'][0]
+            self._send_json({})
+            return
+        element = list(json.loads(body).values())[0]
+        self._send_json({
+            'canonicalURI': f'http://hercules.org/um/es-ES/res/{element}',
+            'canonicalLanguageURI': f'http://hercules.org/um/es-ES/rec/{element}',
+            'language': 'es-ES'
+        })
+
+    def _send_json(self, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FakeFactoryHandler)
+    httpd.local_uris = {}
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{httpd.server_address[1]}/'
+    with mock.patch('hercules_sync.uris_factory.URIS_FACTORY', url), \
+         mock.patch('hercules_sync.uris_factory.WBAPI', 'http://wb/'):
+        yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'uris.db')
+
+def _create_factory(store):
+    return HerculesURIsFactory(TTLCache(10, 100), TTLCache(10, 100), store=store)
+
+def test_store_operations(db_path):
+    store = URIMappingStore(db_path)
+    store.save('item', 'Researcher', 'Q1')
+    store.save('property', 'hasName', 'P1')
+    store.save('item', 'Researcher', 'Q2')
+    store.delete('property', 'hasName')
+    store.close()
+
+    store = URIMappingStore(db_path)
+    assert store.load() == [('item', 'Researcher', 'Q2')]
+    store.close()
+
+def test_warm_restart(server, db_path):
+    researcher = URIElement('http://example.org/ontology#Researcher')
+    has_name = URIElement('http://example.org/ontology#hasName', etype='property')
+    factory = _create_factory(URIMappingStore(db_path))
+    assert factory.get_uri(researcher) is None
+    factory.post_uri(researcher, 'Q1')
+    factory.post_uri(has_name, 'P1')
+    assert factory.get_uri(researcher) == 'Q1'
+    factory.store.close()
+
+    server.requests.clear()
+    factory = _create_factory(URIMappingStore(db_path))
+    assert factory.warm_up() == 2
+    assert factory.get_uri(researcher) == 'Q1'
+    assert factory.get_uri(has_name) == 'P1'
+    assert server.requests == []
+    factory.store.close()
+
+def test_revalidation(server, db_path):
+    store = URIMappingStore(db_path)
+    store.save('item', 'Researcher', 'Q1')
+    store.save('item', 'Removed', 'Q2')
+    server.local_uris['http://hercules.org/um/es-ES/res/Researcher'] = 'http://wb/wiki/Item:Q5'
+
+    factory = _create_factory(store)
+    revalidation = warm_up_uris_cache(factory)
+    revalidation.join(timeout=10)
+    assert not revalidation.is_alive()
+    assert sorted(store.load()) == [('item', 'Researcher', 'Q5')]
+    assert factory.get_uri(URIElement('http://example.org/ontology#Researcher')) == 'Q5'
+    assert factory.get_uri(URIElement('http://example.org/ontology#Removed')) is None
+    store.close()
+
+def test_warm_up_without_store():
+    assert warm_up_uris_cache(_create_factory(None)) is None
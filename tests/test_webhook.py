@@ -3,6 +3,9 @@ from unittest import mock
 import pytest
 import werkzeug
 
+from flask import Flask
+
+from hercules_sync.cache import TTLCache
 from hercules_sync.webhook import WebHook
 
 @pytest.fixture
@@ -83,3 +86,62 @@ def _assert_request_fails(hook, err_msg):
     with pytest.raises(werkzeug.exceptions.BadRequest) as excpt:
         hook._on_request()
     assert err_msg in str(excpt.value)
+
+def test_handler_response():
+    flask_app = Flask(__name__)
+    webhook = WebHook(flask_app, endpoint='/postreceive', key='abc')
+    webhook.hook()(lambda data: (202, {'job': 1}))
+    webhook.hook()(lambda data: (200, 'Ignored'))
+    res = flask_app.test_client().post('/postreceive',
+                                       data=b'{"ref": "head", "before": "001", "after": "002"}',
+                                       headers={
+                                           'content-type': 'application/json',
+                                           'X-Hub-Signature': 'sha1=61620b06f590da1915eb1f802f9ea701aea5a4d4',
+                                           'X-Github-Event': 'push'
+                                       })
+    assert res.status_code == 202
+    assert res.get_json() == {'job': 1}
+
+def test_duplicate_deliveries():
+    flask_app = Flask(__name__)
+    webhook = WebHook(flask_app, endpoint='/postreceive', key='abc', deliveries=TTLCache(10, 60))
+    handler = mock.Mock(return_value=(202, {'job': 1}))
+    webhook.hook()(handler)
+    headers = {
+        'content-type': 'application/json',
+        'X-Hub-Signature': 'sha1=61620b06f590da1915eb1f802f9ea701aea5a4d4',
+        'X-Github-Event': 'push',
+        'X-GitHub-Delivery': '72d3162e-cc78-11e3-81ab-4c9367dc0958'
+    }
+    client = flask_app.test_client()
+    data = b'{"ref": "head", "before": "001", "after": "002"}'
+    for _ in range(2):
+        res = client.post('/postreceive', data=data, headers=headers)
+        assert res.status_code == 202
+        assert res.get_json() == {'job': 1}
+    handler.assert_called_once()
+
+    headers['X-GitHub-Delivery'] = 'd2e8f9a0-cc78-11e3-81ab-4c9367dc0958'
+    client.post('/postreceive', data=data, headers=headers)
+    assert handler.call_count == 2
+
+def test_duplicate_deliveries_not_replayed():
+    flask_app = Flask(__name__)
+    replay_check = mock.Mock(return_value=False)
+    webhook = WebHook(flask_app, endpoint='/postreceive', key='abc', deliveries=TTLCache(10, 60),
+                      replay_check=replay_check)
+    handler = mock.Mock(side_effect=[(202, {'job': 1}), (202, {'job': 2})])
+    webhook.hook()(handler)
+    headers = {
+        'content-type': 'application/json',
+        'X-Hub-Signature': 'sha1=61620b06f590da1915eb1f802f9ea701aea5a4d4',
+        'X-Github-Event': 'push',
+        'X-GitHub-Delivery': '72d3162e-cc78-11e3-81ab-4c9367dc0958'
+    }
+    client = flask_app.test_client()
+    data = b'{"ref": "head", "before": "001", "after": "002"}'
+    client.post('/postreceive', data=data, headers=headers)
+    res = client.post('/postreceive', data=data, headers=headers)
+    assert res.get_json() == {'job': 2}
+    assert handler.call_count == 2
+    replay_check.assert_called_once_with((202, {'job': 1}))
@@ -0,0 +1,130 @@
+import threading
+
+from unittest import mock
+
+import pytest
+
+from hercules_sync.wikibase import PooledWikibaseAdapter, WikibaseAdapterPool
+from wbsync.triplestore import URIElement, WikibaseAdapter, wikibase_adapter
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def _userinfo(anonymous):
+    userinfo = {'id': 0, 'name': '127.0.0.1', 'anon': ''} if anonymous else {'id': 1, 'name': 'Bot'}
+    return mock.Mock(json=mock.Mock(return_value={'query': {'userinfo': userinfo}}))
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def adapter_cls():
+    with mock.patch('hercules_sync.wikibase.PooledWikibaseAdapter') as adapter_cls:
+        adapter_cls.side_effect = lambda *args, **kwargs: mock.MagicMock()
+        yield adapter_cls
+
+@pytest.fixture
+def login_cls():
+    with mock.patch('hercules_sync.wikibase.wdi_login.WDLogin') as login_cls:
+        yield login_cls
+
+@pytest.fixture
+def pool(clock, adapter_cls):
+    return WikibaseAdapterPool('http://wb/w/api.php', 'http://wb/sparql', 'user', 'pass',
+                               max_size=2, check_interval=60, clock=clock)
+
+def test_adapters_are_reused(pool, adapter_cls):
+    factory = mock.Mock()
+    with pool.session(factory) as first:
+        pass
+    with pool.session(factory) as second:
+        assert second is first
+    assert adapter_cls.call_count == 1
+    assert pool.stats() == {'logins': 1, 'relogins': 0, 'reuses': 1, 'size': 1, 'idle': 1}
+    assert second.uris_factory is factory
+
+def test_adapters_use_their_own_factory():
+    global_factory = wikibase_adapter.uris_factory
+    first, second = mock.Mock(), mock.Mock()
+    first.get_uri.return_value = 'Q1'
+    second.get_uri.return_value = None
+    with mock.patch.object(WikibaseAdapter, '__init__', return_value=None):
+        first_adapter = PooledWikibaseAdapter(factory_of_uris=first)
+        second_adapter = PooledWikibaseAdapter(factory_of_uris=second)
+    second_adapter._create_new_wb_item = mock.Mock(return_value=mock.Mock(result='Q2'))
+
+    uriref = URIElement('http://example.org/Researcher')
+    assert first_adapter._get_wb_id_of(uriref, None) == 'Q1'
+    assert second_adapter._get_wb_id_of(uriref, None) == 'Q2'
+    second.post_uri.assert_called_once_with(uriref, 'Q2')
+    first.post_uri.assert_not_called()
+    assert wikibase_adapter.uris_factory is global_factory
+
+def test_concurrent_sessions_are_capped(pool, adapter_cls):
+    with pool.session(None) as first, pool.session(None) as second:
+        assert first is not second
+        acquired = threading.Event()
+        def third_session():
+            with pool.session(None):
+                acquired.set()
+        thread = threading.Thread(target=third_session)
+        thread.start()
+        assert not acquired.wait(0.1)
+    assert acquired.wait(5)
+    thread.join()
+    assert adapter_cls.call_count == 2
+    assert pool.stats()['size'] == 2
+
+def test_expired_session_logs_in_again(pool, clock, login_cls):
+    with pool.session(None) as adapter:
+        adapter._local_login.get_session.return_value.get.return_value = _userinfo(True)
+    clock.now = 30
+    with pool.session(None):
+        pass
+    login_cls.assert_not_called()
+
+    clock.now = 100
+    with pool.session(None) as relogged:
+        assert relogged is adapter
+    login_cls.assert_called_once_with('user', 'pass', 'http://wb/w/api.php')
+    assert adapter._local_login is login_cls.return_value
+    assert pool.stats()['relogins'] == 1
+
+def test_failed_login_is_discarded(pool, clock, login_cls, adapter_cls):
+    login_cls.side_effect = ValueError('login failed')
+    with pool.session(None) as first, pool.session(None) as second:
+        for adapter in (first, second):
+            adapter._local_login.get_session.return_value.get.return_value = _userinfo(True)
+    clock.now = 100
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            with pool.session(None):
+                pass
+    assert pool.stats()['size'] == 0
+    # the pool isn't exhausted by the failed logins
+    with pool.session(None), pool.session(None):
+        pass
+    assert pool.stats()['size'] == 2
+
+def test_valid_session_is_kept(pool, clock, login_cls):
+    with pool.session(None) as adapter:
+        adapter._local_login.get_session.return_value.get.return_value = _userinfo(False)
+    clock.now = 100
+    with pool.session(None):
+        pass
+    login_cls.assert_not_called()
+    assert pool.stats()['logins'] == 1
+
+def test_failed_session_is_discarded(pool, adapter_cls):
+    with pytest.raises(ValueError):
+        with pool.session(None):
+            raise ValueError('connection lost')
+    assert pool.stats()['size'] == 0
+    with pool.session(None):
+        pass
+    assert adapter_cls.call_count == 2